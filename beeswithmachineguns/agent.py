@@ -0,0 +1,543 @@
+"""The bee's side of an attack
+
+Travels to the bees as a zip bundle (see :func:`build_bundle`) and runs the
+load generator there, through its driver (see :mod:`drivers`). Everything it
+reports goes back over stdout of the ssh channel as frames: one line each,
+``BEES `` followed by json.
+
+* ``ready`` when armed (``--armed``): everything is in place and the agent
+  waits for ``go <epoch>`` on stdin to start the generator at that instant
+* ``progress`` frames at most once per interval while the generator runs
+* ``stage`` when the next stage of a load profile starts (``--stages``)
+* ``samples`` frames with the raw samples (``--send-samples``), right
+  before the result
+* one ``result`` frame when it is done - compressed, as it carries the
+  histograms and the time series
+* ``missing`` instead of all of the above if the bee lacks a payload (see
+  :func:`launch_command`)
+* one ``health`` frame instead of an attack (``--health``): which load
+  generators the bee has and how much cpu and network it has to spare
+
+Runs with whatever python the bee has, see :data:`BUNDLE_MODULES`.
+"""
+import base64
+import functools
+import io
+import json
+import math
+import optparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+
+from beeswithmachineguns import drivers, samples, scenarios, warmup
+from beeswithmachineguns.histogram import LatencyHistogram
+from beeswithmachineguns.timeseries import TimeSeries
+
+
+FRAME_PREFIX = 'BEES '
+REMOTE_PYTHON = '"$(command -v python3 || command -v python)"'
+BUNDLE_MODULES = ['__init__.py', 'agent.py', 'drivers.py', 'engine.py',
+                  'histogram.py', 'profiles.py', 'samples.py',
+                  'scenarios.py', 'timeseries.py', 'warmup.py']
+"""what travels to the bees - these run with whatever python a bee has (2.6+
+or 3, engine.py only with 3), so they may import the stdlib and each other,
+nothing else"""
+GENERATORS = drivers.NAMES
+SIMULATE_ENV = 'BEES_SIMULATE'
+"""set (e.g. to ``latency=20,failures=0.01``): simulate, don't attack"""
+SPIN = 0.002
+"""last bit of waiting for the start is done busy - sleep is too coarse"""
+SAMPLES_CHUNK = 1024 * 1024
+"""bytes of the sample file per frame"""
+
+
+def _pack(data):
+    return base64.b64encode(zlib.compress(data)).decode('ascii')
+
+
+def _unpack(text):
+    return zlib.decompress(base64.b64decode(text))
+
+
+def emit(frameType, compress=False, **payload):
+    payload['type'] = frameType
+    payload['t'] = time.time()
+    line = json.dumps(payload)
+    if compress:
+        line = json.dumps(dict(type=frameType, t=payload['t'],
+                               zlib=_pack(line.encode('utf-8'))))
+    sys.stdout.write(FRAME_PREFIX + line + '\n')
+    sys.stdout.flush()
+
+
+def read_frames(lines):
+    """commander side: yield the decoded frames from the channel's lines"""
+    for line in lines:
+        if line.startswith(FRAME_PREFIX):
+            frame = json.loads(line[len(FRAME_PREFIX):])
+            if 'zlib' in frame:
+                data = _unpack(frame['zlib'])
+                # python 2 reads json from bytes several times faster
+                if sys.version_info[0] >= 3:
+                    data = data.decode('utf-8')
+                frame = json.loads(data)
+            yield frame
+
+
+def send_samples(path):
+    """stream the sample file back in ``samples`` frames, then remove it"""
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(SAMPLES_CHUNK)
+            if not chunk:
+                break
+
+            emit('samples', data=_pack(chunk))
+    os.remove(path)
+
+
+def read_samples(frame):
+    """commander side: the bytes of the sample file in a ``samples`` frame"""
+    return _unpack(frame['data'])
+
+
+class Progress(object):
+    """what the generator did so far - reported at most every `interval`"""
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.complete = 0
+        self.failed = 0
+        self.window = None
+        """latency histogram of the requests since the last frame"""
+        self._lock = threading.Lock()
+        self._lastEmit = 0
+        self._carried = (0, 0)
+
+    def update(self, complete=None, failed=None, latency=None):
+        with self._lock:
+            if complete is not None:
+                self.complete = self._carried[0] + complete
+            if failed is not None:
+                self.failed = self._carried[1] + failed
+            if latency is not None:
+                if self.window is None:
+                    self.window = LatencyHistogram()
+                self.window.record(latency)
+        self.maybe_emit()
+
+    def add(self, complete=0, failed=0, histogram=None):
+        """add what happened since the last call (e.g. in a worker)"""
+        with self._lock:
+            self.complete += complete
+            self.failed += failed
+            if histogram is not None:
+                if self.window is None:
+                    self.window = LatencyHistogram(histogram.relativeError)
+                self.window.merge(histogram)
+        self.maybe_emit()
+
+    def carry(self):
+        """the next run of the generator counts on from here"""
+        with self._lock:
+            self._carried = (self.complete, self.failed)
+
+    def maybe_emit(self, force=False):
+        now = time.time()
+        if not force and now - self._lastEmit < self.interval:
+            return
+
+        with self._lock:
+            self._lastEmit = now
+            window, self.window = self.window, None
+            payload = dict(complete=self.complete, failed=self.failed)
+            if window is not None:
+                payload['histogram'] = window.asDict
+        emit('progress', **payload)
+
+
+def wait_for_go(stream=None):
+    """report ready, wait for ``go <epoch>`` and then for that instant
+
+    :returns: the start time the commander asked for
+    """
+    emit('ready')
+    words = (stream or sys.stdin).readline().split()
+    if len(words) != 2 or words[0] != 'go':
+        raise ValueError('expected "go <epoch>", got %r' % words)
+
+    startAt = float(words[1])
+    delay = startAt - time.time()
+    if delay > SPIN:
+        time.sleep(delay - SPIN)
+    while time.time() < startAt:
+        pass
+    return startAt
+
+
+def parse_simulation(settings):
+    """``latency=20,failures=0.01,spread=0.5`` -> keyword arguments"""
+    kwargs = {}
+    for setting in settings.split(','):
+        if setting.strip():
+            name, _, value = setting.partition('=')
+            kwargs[name.strip()] = float(value)
+    return kwargs
+
+
+def run_sim(args, progress, release=None, samplesPath=None, latency=50.0,
+            failures=0.0, spread=0.5, seed=None):
+    """pretend to attack - for bees of a local hive
+
+    Takes -n, -c and -t out of the ab/engine arguments and lets every
+    connection do one request after the other in real time, each lasting a
+    log-normally distributed number of ms (median `latency`). Each request
+    fails with probability `failures`.
+    """
+    load = {'-n': None, '-c': '1', '-t': None}
+    for flag, value in zip(args, args[1:]):
+        if flag in load:
+            load[flag] = value
+    concurrency = int(load['-c'])
+    duration = load['-t'] and float(load['-t']) * 1000
+    numRequests = int(load['-n'] or (0 if duration else 1))
+    rand = random.Random(seed)
+    mu = math.log(latency)
+    histogram = LatencyHistogram()
+    series = TimeSeries()
+    writer = samplesPath and samples.SampleWriter(samplesPath)
+    complete = failed = sent = 0
+    inFlight = []
+    """(ms when done, latency) of each connection's current request"""
+
+    def send(at):
+        if ((numRequests and sent >= numRequests) or
+                (duration and at >= duration)):
+            return None
+
+        requestLatency = rand.lognormvariate(mu, spread)
+        return at + requestLatency, requestLatency
+
+    startAt = release() if release else None
+    startedAt = time.time()
+    for _ in range(concurrency):
+        inFlight.append(send(0.0))
+        sent += inFlight[-1] is not None
+    while any(inFlight):
+        now = (time.time() - startedAt) * 1000
+        window = LatencyHistogram()
+        windowComplete = windowFailed = 0
+        for index, request in enumerate(inFlight):
+            while request and request[0] <= now:
+                requestFailed = rand.random() < failures
+                window.record(request[1])
+                windowComplete += 1
+                windowFailed += requestFailed
+                sentAt = startedAt + (request[0] - request[1]) / 1000
+                series.record(sentAt, request[1], requestFailed)
+                if writer:
+                    writer.record(sentAt, request[1],
+                                  500 if requestFailed else 200)
+                request = send(request[0])
+                sent += request is not None
+            inFlight[index] = request
+        histogram.merge(window)
+        complete += windowComplete
+        failed += windowFailed
+        progress.add(windowComplete, windowFailed, window)
+        pending = [r[0] for r in inFlight if r]
+        if pending:
+            time.sleep(min(0.05, max(0, min(pending) - now) / 1000))
+    elapsed = time.time() - startedAt
+    if writer:
+        writer.close()
+    progress.maybe_emit(force=True)
+    return dict(
+        exitCode=0, histogram=histogram.asDict, timeseries=series.asDict,
+        startAt=startAt, startedAt=startedAt,
+        summary=dict(complete_requests=complete, failed_requests=failed,
+                     requests_per_second=complete / elapsed if elapsed else 0,
+                     ms_per_request=histogram.mean))
+
+
+def stage_args(stage):
+    """generator options for one stage - ab's, which every driver reads"""
+    args = ['-t', str(stage['duration']), '-c', str(stage['concurrency'])]
+    if stage.get('requests'):
+        args += ['-n', str(stage['requests'])]
+    if stage.get('rate'):
+        args += ['--rate', str(stage['rate'])]
+    return args
+
+
+def run_stages(generate, args, stages, progress, release=None):
+    """run the generator once per stage, back to back
+
+    :param generate: (args, progress, release) -> result
+    :param args: generator arguments without -n/-c, the URL last
+    """
+    results = []
+    for index, stage in enumerate(stages):
+        emit('stage', index=index, **stage)
+        start = time.time()
+        result = generate(args[:-1] + stage_args(stage) + args[-1:],
+                          progress, release if index == 0 else None)
+        result['elapsed'] = time.time() - start
+        result['stage'] = stage
+        results.append(result)
+    return merge_results(results)
+
+
+def merge_results(results):
+    """one result of several runs of the generator (stages or batches) -
+    the runs are kept under ``stages``"""
+    histogram = LatencyHistogram.merged(
+        LatencyHistogram.from_dict(r['histogram']) for r in results)
+    endpoints = scenarios.merge_endpoint_stats(
+        r['endpoints'] for r in results if r.get('endpoints'))
+    # one series for all runs - they are in there by time
+    series = TimeSeries.merged(
+        TimeSeries.from_dict(r.pop('timeseries')) for r in results)
+    return dict(exitCode=max(r['exitCode'] for r in results),
+                histogram=histogram.asDict, stages=results,
+                timeseries=series.asDict,
+                endpoints=endpoints,
+                startAt=results[0]['startAt'],
+                startedAt=results[0]['startedAt'])
+
+
+def run_queue(generate, args, concurrency, progress, release=None,
+              stream=None):
+    """run batches of requests as the commander hands them out
+
+    Asks for each batch with a ``want`` frame, the answer on stdin is
+    ``batch <requests>`` or ``done``. Every batch is reported as soon as it
+    is done (a ``batch`` frame) - what a bee got done counts even if she is
+    lost later.
+
+    :param args: generator arguments without -n/-c, the URL last
+    :param concurrency: connections, fewer if a batch is smaller
+    """
+    stream = stream or sys.stdin
+    batches = exitCode = 0
+    while True:
+        emit('want')
+        words = stream.readline().split()
+        if not words or words == ['done']:
+            break
+
+        if len(words) != 2 or words[0] != 'batch':
+            raise ValueError('expected "batch <requests>", got %r' % words)
+
+        requests = int(words[1])
+        result = generate(
+            args[:-1] + ['-n', str(requests),
+                         '-c', str(min(concurrency, requests))] + args[-1:],
+            progress, release if not batches else None)
+        # from the start - the first batch waits for the swarm before
+        result['elapsed'] = time.time() - result['startedAt']
+        result['requests'] = requests
+        emit('batch', compress=True, **result)
+        progress.carry()
+        batches += 1
+        exitCode = max(exitCode, result['exitCode'])
+    return dict(exitCode=exitCode, batches=batches)
+
+
+def build_bundle():
+    """zip the agent with everything it needs - run with ``python x.zip``"""
+    packagePath = os.path.dirname(os.path.abspath(__file__))
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as bundle:
+        for name in BUNDLE_MODULES:
+            bundle.write(os.path.join(packagePath, name),
+                         'beeswithmachineguns/%s' % name)
+        bundle.writestr('__main__.py', 'from beeswithmachineguns.agent '
+                                       'import main\nmain()\n')
+    return buf.getvalue()
+
+
+TOOLING_READY = 'bees tooling ready'
+INSTALL_TOOLING = ' && '.join([
+    'if command -v apt-get >/dev/null; then'
+    ' sudo apt-get update -q'
+    ' && sudo DEBIAN_FRONTEND=noninteractive apt-get install -y -q'
+    ' apache2-utils python3;'
+    ' else sudo yum install -y -q httpd-tools python3; fi',
+    'ab -V',
+    '%s --version' % REMOTE_PYTHON,
+    'echo %s' % TOOLING_READY])
+"""shell command that installs what the generators need on a bee (ab,
+python 3 for the engine) - echoes :data:`TOOLING_READY` when done"""
+
+
+def _which(name):
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read()
+    except (IOError, OSError):
+        return None
+
+
+def _cpu_times():
+    """(idle, total) jiffies of all cpus - None without /proc"""
+    stat = _read('/proc/stat')
+    if not stat:
+        return None
+
+    times = [int(t) for t in stat.splitlines()[0].split()[1:]]
+    # idle and iowait
+    return sum(times[3:5]), sum(times)
+
+
+def _net_bytes():
+    """interface -> bytes received and sent so far (loopback left out)"""
+    interfaces = {}
+    for line in (_read('/proc/net/dev') or '').splitlines()[2:]:
+        name, _, counters = line.partition(':')
+        counters = counters.split()
+        if name.strip() != 'lo' and len(counters) > 8:
+            interfaces[name.strip()] = int(counters[0]) + int(counters[8])
+    return interfaces
+
+
+def _link_mbps(interface):
+    try:
+        speed = int(_read('/sys/class/net/%s/speed' % interface) or 0)
+    except ValueError:
+        return None
+
+    return speed if speed > 0 else None
+
+
+def health(interval=0.5):
+    """what the bee has to offer for an attack, measured over `interval`"""
+    cpuBefore, netBefore, startedAt = _cpu_times(), _net_bytes(), time.time()
+    time.sleep(interval)
+    cpuAfter, netAfter = _cpu_times(), _net_bytes()
+    elapsed = time.time() - startedAt
+    cpuIdle = None
+    if cpuBefore and cpuAfter and cpuAfter[1] > cpuBefore[1]:
+        cpuIdle = (float(cpuAfter[0] - cpuBefore[0]) /
+                   (cpuAfter[1] - cpuBefore[1]))
+    netMbps = linkMbps = None
+    if netAfter:
+        netMbps = sum(netAfter[i] - netBefore.get(i, netAfter[i])
+                      for i in netAfter) * 8 / elapsed / 1e6
+        links = [_link_mbps(i) for i in netAfter]
+        if all(links):
+            linkMbps = sum(links)
+    try:
+        import resource
+        openFiles = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+    except (ImportError, ValueError):
+        openFiles = None
+    try:
+        import multiprocessing
+        cpus = multiprocessing.cpu_count()
+    except NotImplementedError:
+        cpus = None
+    return dict(ab=_which('ab'), wrk=_which('wrk'), hey=_which('hey'),
+                python=sys.version.split()[0],
+                engine=sys.version_info >= (3, 5), cpus=cpus,
+                cpuIdle=cpuIdle, load=os.getloadavg()[0], netMbps=netMbps,
+                linkMbps=linkMbps, openFiles=openFiles)
+
+
+def remote_command(bundlePath, *args):
+    """command line to run the agent on a bee"""
+    return '%s %s %s' % (REMOTE_PYTHON, bundlePath, ' '.join(args))
+
+
+def launch_command(bundlePath, payloadPaths, *args):
+    """command line to run the agent on a bee in one round trip
+
+    Checks first that the bee holds the bundle and the payloads. If it
+    doesn't, the answer is a ``missing`` frame with their paths (separated
+    by spaces) instead - upload those and launch again.
+    """
+    paths = ' '.join([bundlePath] + list(payloadPaths))
+    missingFrame = (FRAME_PREFIX +
+                    '{\\"type\\": \\"missing\\", \\"paths\\": \\"$missing\\"}')
+    return ('missing=""; for p in %s; do '
+            '[ -f "$p" ] || missing="$missing $p"; done; '
+            'if [ -n "$missing" ]; then echo "%s"; else exec %s; fi' % (
+                paths, missingFrame, remote_command(bundlePath, *args)))
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(
+        usage='%%prog [options] %s AB_ARGS' % '|'.join(GENERATORS))
+    parser.disable_interspersed_args()
+    parser.add_option('--interval', type='float', default=1.0,
+                      help='seconds between progress frames')
+    parser.add_option('--armed', action='store_true', default=False,
+                      help='prepare, then wait for "go <epoch>" on stdin')
+    parser.add_option('--stages', default=None,
+                      help='json list of stages (concurrency, duration and '
+                           'optionally rate, requests) to run back to back')
+    parser.add_option('--queue', type='int', default=None,
+                      metavar='CONCURRENCY',
+                      help='ask the commander for batches of requests (see '
+                           'run_queue) and run them with this many '
+                           'connections')
+    parser.add_option('--samples', default=None, metavar='PATH',
+                      help='append the raw samples (one per request) to '
+                           'this file')
+    parser.add_option('--send-samples', action='store_true', default=False,
+                      help='collect the raw samples in a temporary file and '
+                           'send them back before the result')
+    parser.add_option('--health', action='store_true', default=False,
+                      help="don't attack, report the health of the bee")
+    parser.add_option('--warm-up', default=None, metavar='JSON',
+                      help='json of the arguments of warmup.warm_up - warm '
+                           'up before getting ready')
+    options, args = parser.parse_args(argv)
+    if options.health:
+        emit('health', **health())
+        return
+
+    if not args or args[0] not in GENERATORS:
+        parser.error('unknown load generator: %s' % args[:1])
+
+    if options.warm_up:
+        emit('warmup', **warmup.warm_up(**json.loads(options.warm_up)))
+    progress = Progress(options.interval)
+    release = wait_for_go if options.armed else None
+    if os.environ.get(SIMULATE_ENV):
+        generate = functools.partial(
+            run_sim, **parse_simulation(os.environ[SIMULATE_ENV]))
+    else:
+        generate = functools.partial(drivers.run, args[0])
+    samplesPath = options.samples
+    if options.send_samples:
+        fd, samplesPath = tempfile.mkstemp(prefix='bees_samples_')
+        os.close(fd)
+        # the writer starts a new file
+        os.remove(samplesPath)
+    if samplesPath:
+        generate = functools.partial(generate, samplesPath=samplesPath)
+    if options.stages:
+        result = run_stages(generate, args[1:], json.loads(options.stages),
+                            progress, release)
+    elif options.queue:
+        result = run_queue(generate, args[1:], options.queue, progress,
+                           release)
+    else:
+        result = generate(args[1:], progress, release)
+    if options.send_samples:
+        if os.path.exists(samplesPath):
+            send_samples(samplesPath)
+    emit('result', compress=True, **result)
@@ -24,28 +24,61 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
 
-from multiprocessing import Pool
+import json
 import os
-import re
+import pipes
+import Queue
 import socket
+import sqlite3
 import time
-import urllib2
 import base64
 import csv
+import itertools
 import sys
-import random
+import tempfile
+import threading
 
 import boto
 import boto.ec2
 import paramiko
 
+import agent
+from dispatch import Dispatcher, StartBarrier, DEFAULT_FAN_OUT
+import drivers
+import gate
+import hive
+import history
+import localhive
+import payloads
+from probe import CapacitySearch, Measurement
+import profiles
+import samples
+import scenarios
+import sessions
+from live import SwarmView
+from histogram import LatencyHistogram
+import timeseries
+from timeseries import TimeSeries
+import warmup
+import workqueue
+
 
 STATE_FILENAME = os.path.expanduser('~/.bees')
+SSH_TIMEOUT = 15
+BUSY_CPU_IDLE = 0.5
+BEE_PREPARE_SECONDS = 120
+"""
+What connecting, uploading and launching the agent may take, per wave of -F bees.
+"""
 
 # Utilities
 
 def _read_server_list():
+    """
+    The roster - (username, key_name, zones, instance_ids), zones has the zone of each bee.
+    """
     instance_ids = []
+    zones = []
 
     if not os.path.isfile(STATE_FILENAME):
         return (None, None, None, None)
@@ -53,20 +86,26 @@ def _read_server_list():
     with open(STATE_FILENAME, 'r') as f:
         username = f.readline().strip()
         key_name = f.readline().strip()
-        zone = f.readline().strip()
-        text = f.read()
-        instance_ids = text.split('\n')
+        # the zones as given to up - just one for older rosters
+        zone = f.readline().strip().split(',')[0].partition(':')[0]
+        for line in f:
+            if not line.strip():
+                continue
+            # rosters of single zone swarms have no zone per bee
+            instance_id, _, instance_zone = line.strip().partition(' ')
+            instance_ids.append(instance_id)
+            zones.append(instance_zone or zone)
 
         print 'Read %i bees from the roster.' % len(instance_ids)
 
-    return (username, key_name, zone, instance_ids)
+    return (username, key_name, zones, instance_ids)
 
 def _write_server_list(username, key_name, zone, instances):
     with open(STATE_FILENAME, 'w') as f:
         f.write('%s\n' % username)
         f.write('%s\n' % key_name)
         f.write('%s\n' % zone)
-        f.write('\n'.join([instance.id for instance in instances]))
+        f.write('\n'.join(['%s %s' % (instance.id, instance.placement or zone) for instance in instances]))
 
 def _delete_server_list():
     os.remove(STATE_FILENAME)
@@ -75,7 +114,27 @@ def _get_pem_path(key):
     return os.path.expanduser('~/.ssh/%s.pem' % key)
 
 def _get_region(zone):
-    return zone if 'gov' in zone else zone[:-1] # chop off the "d" in the "us-east-1d" to get the "Region"
+    return hive.region_of(zone) # chop off the "d" in the "us-east-1d" to get the "Region"
+
+def _get_region_connection(region):
+    # the local hive stands in for EC2 when rehearsing on this machine
+    if region == localhive.LOCAL_ZONE:
+        return localhive.LocalConnection()
+    return boto.ec2.connect_to_region(region)
+
+def _get_connection(zone):
+    return _get_region_connection(_get_region(zone))
+
+def _in_each_region(zones, instance_ids, work):
+    """
+    Call work(connection, instance_ids) for the bees of each region, all regions at once - the results joined.
+    """
+    regions = {}
+    for zone, instance_id in zip(zones, instance_ids):
+        regions.setdefault(_get_region(zone), []).append(instance_id)
+
+    results = Dispatcher().map(lambda region: work(_get_region_connection(region), regions[region]), sorted(regions))
+    return [item for result in results for item in result]
 
 def _get_security_group_ids(connection, security_group_names, subnet):
     ids = []
@@ -94,90 +153,239 @@ def _get_security_group_ids(connection, security_group_names, subnet):
 
         return ids
 
+def _connect(session_key):
+    instance_name, username, key_name = session_key
+    if localhive.is_local(instance_name):
+        return localhive.LocalClient(instance_name)
+
+    client = paramiko.SSHClient()
+    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+
+    pem_path = key_name and _get_pem_path(key_name) or None
+    # a bee with a closed port shouldn't keep the whole swarm waiting
+    if not os.path.isfile(pem_path):
+        client.load_system_host_keys()
+        client.connect(instance_name, username=username, timeout=SSH_TIMEOUT)
+    else:
+        client.connect(
+            instance_name,
+            username=username,
+            key_filename=pem_path,
+            timeout=SSH_TIMEOUT)
+
+    client.get_transport().set_keepalive(30)
+    return client
+
+# Sessions stay open for all attacks made by this process
+_sessions = sessions.close_at_exit(
+    sessions.SessionPool(_connect, sessions.paramiko_is_alive))
+
+# Remembers which payloads the bees hold, so each is uploaded only once
+_distributor = payloads.Distributor()
+
 # Methods
 
 def up(count, group, zone, image_id, instance_type, username, key_name, subnet):
     """
     Startup the load testing server.
+
+    zone can list several zones (and regions) with a number of bees each, see hive.parse_placements,
+    image_id an image per region, see hive.parse_images.
     """
 
-    existing_username, existing_key_name, existing_zone, instance_ids = _read_server_list()
+    existing_username, existing_key_name, existing_zones, instance_ids = _read_server_list()
 
     if instance_ids:
-        print 'Bees are already assembled and awaiting orders.'
+        instances = _in_each_region(existing_zones, instance_ids, hive.describe_bees)
+        if all(instance.state == 'running' for instance in instances):
+            print 'Bees are already assembled and awaiting orders.'
+        else:
+            _wake(existing_zones, instance_ids)
         return
 
     count = int(count)
+    placements = hive.parse_placements(zone, count)
+    images = hive.parse_images(image_id)
+    count = sum(placement.count for placement in placements)
+
+    without_image = sorted(set(p.region for p in placements if p.region not in images and None not in images))
+    if without_image:
+        print 'bees: error: no image (-i) given for %s' % ', '.join(without_image)
+        return
 
     pem_path = _get_pem_path(key_name)
 
-    if not os.path.isfile(pem_path):
+    if not os.path.isfile(pem_path) and zone != localhive.LOCAL_ZONE:
         print 'Warning. No key file found for %s. You will need to add this key to your SSH agent to connect.' % pem_path
 
     print 'Connecting to the hive.'
 
-    ec2_connection = boto.ec2.connect_to_region(_get_region(zone))
-
-    print 'Attempting to call up %i bees.' % count
+    def run_instances(ec2_connection, instance_zone, instance_count):
+        region = _get_region(instance_zone)
+        return ec2_connection.run_instances(
+            image_id=images.get(region, images.get(None)),
+            min_count=1,
+            max_count=instance_count,
+            key_name=key_name,
+            security_groups=[group] if subnet is None else _get_security_group_ids(ec2_connection, [group], subnet),
+            instance_type=instance_type,
+            placement=None if 'gov' in instance_zone else instance_zone,
+            subnet_id=subnet)
+
+    def ready(instance):
+        print 'Bee %s is ready for the attack.' % instance.id
 
-    reservation = ec2_connection.run_instances(
-        image_id=image_id,
-        min_count=count,
-        max_count=count,
-        key_name=key_name,
-        security_groups=[group] if subnet is None else _get_security_group_ids(ec2_connection, [group], subnet),
-        instance_type=instance_type,
-        placement=None if 'gov' in zone else zone,
-        subnet_id=subnet)
+    if len(placements) == 1:
+        print 'Attempting to call up %i bees.' % count
+    else:
+        print 'Attempting to call up %i bees in %s.' % (count, ', '.join('%s (%i)' % (p.zone, p.count) for p in placements))
 
     print 'Waiting for bees to load their machine guns...'
 
-    instance_ids = []
+    # a subnet lives in one zone, there is nowhere to fall back to
+    launch = hive.launch(_get_region_connection, placements, run_instances, tags={"Name": "a bee!"},
+                         ready=ready, fallback=subnet is None)
 
-    for instance in reservation.instances:
-        instance.update()
-        while instance.state != 'running':
-            print '.'
-            time.sleep(5)
-            instance.update()
+    for placement_zone, missing in sorted(launch.shortfall.items()):
+        print 'bees: warning: %i bees found no room in %s (or the other zones of its region).' % (missing, placement_zone)
 
-        instance_ids.append(instance.id)
+    for region, error in sorted(launch.errors.items()):
+        print 'bees: error: calling up the bees in %s failed: %s' % (region, error)
 
-        print 'Bee %s is ready for the attack.' % instance.id
+    if launch.instances:
+        _write_server_list(username, key_name, zone, launch.instances)
+
+    print 'The swarm has assembled %i bees.' % len(launch.ready)
+
+def _wake(zones, instance_ids):
+    """
+    Start the bees of the roster that were stopped by "bees down --stop".
+    """
+    print 'Waking up the resting bees.'
+
+    lock = threading.Lock()
+
+    def ready(instance):
+        with lock:
+            print 'Bee %s is ready for the attack.' % instance.id
 
-    ec2_connection.create_tags(instance_ids, { "Name": "a bee!" })
+    awake = _in_each_region(zones, instance_ids, lambda ec2_connection, region_instance_ids: hive.wake(
+        ec2_connection, region_instance_ids, ready=ready))
 
-    _write_server_list(username, key_name, zone, reservation.instances)
+    if len(awake) < len(instance_ids):
+        print 'bees: warning: %i bees of the roster are lost, "bees down" and "bees up" make a new swarm.' % (
+            len(instance_ids) - len(awake))
 
-    print 'The swarm has assembled %i bees.' % len(reservation.instances)
+    print 'The swarm has assembled %i bees.' % len(awake)
 
-def report():
+def report(fan_out=None, engine='ab'):
     """
-    Report the status of the load testing servers.
+    Report the status of the load testing servers - and how ready the running ones are to attack with engine (see drivers.py).
     """
-    username, key_name, zone, instance_ids = _read_server_list()
+    username, key_name, zones, instance_ids = _read_server_list()
 
     if not instance_ids:
         print 'No bees have been mobilized.'
         return
 
-    ec2_connection = boto.ec2.connect_to_region(_get_region(zone))
+    instances = _in_each_region(zones, instance_ids, hive.describe_bees)
+    running = [instance for instance in instances if instance.state == 'running']
+
+    # all bees at once, only the handshakes and uploads are throttled
+    dispatcher = Dispatcher(fan_out or DEFAULT_FAN_OUT)
+    agent_bundle = payloads.Payload(agent.build_bundle(), name='agent', suffix='.zip')
+    healths = dispatcher.map(_check_bee, [{
+        'instance_name': instance.public_dns_name,
+        'username': username,
+        'key_name': key_name,
+        'dispatcher': dispatcher,
+        'agent_bundle': agent_bundle,
+        'engine': engine,
+    } for instance in running])
+    health_by_id = dict((instance.id, health) for instance, health in zip(running, healths))
 
-    reservations = ec2_connection.get_all_instances(instance_ids=instance_ids)
+    for instance in instances:
+        health = health_by_id.get(instance.id)
+        line = 'Bee %s: %s @ %s in %s' % (instance.id, instance.state, instance.ip_address, instance.placement)
+        if health is None:
+            print line
+        elif health['error']:
+            print '%s  NOT READY: %s' % (line, health['error'])
+        else:
+            print '%s  ssh %4.0f ms  ab %s  wrk %s  hey %s  engine %s  cpu %3.0f%% idle of %s  load %.2f  net %s Mbit/s  files %s  %s' % (
+                line, health['ssh_ms'], 'ok' if health['ab'] else '--', 'ok' if health['wrk'] else '--',
+                'ok' if health['hey'] else '--', 'ok' if health['engine'] else '--',
+                (health['cpuIdle'] or 0) * 100, health['cpus'], health['load'],
+                '%.1f' % health['netMbps'] if health['netMbps'] is not None else '?',
+                health['openFiles'], 'ready' if health['ready'] else 'NOT READY: %s' % health['problem'])
+
+    ready = [health for health in healths if health['ready']]
+    print 'Ready to attack with %s:\t%i of %i bees' % (engine, len(ready), len(instances))
+    reached = [health for health in healths if health['ssh_ms'] is not None]
+    if reached:
+        print 'Slowest ssh connect:\t\t%.0f ms' % max(health['ssh_ms'] for health in reached)
+
+def _check_bee(params):
+    """
+    How ready a bee is to attack: ssh, load generators, spare cpu and network.
 
-    instances = []
+    Intended for use with a dispatch.Dispatcher.
+    """
+    health = {'ssh_ms': None, 'error': None, 'ready': False, 'problem': None}
 
-    for reservation in reservations:
-        instances.extend(reservation.instances)
+    session_key = (params['instance_name'], params['username'], params['key_name'])
 
-    for instance in instances:
-        print 'Bee %s: %s @ %s' % (instance.id, instance.state, instance.ip_address)
-
-def down():
+    client = None
+    try:
+        with params['dispatcher'].throttle():
+            started = time.time()
+            client = _sessions.checkout(session_key)
+            health['ssh_ms'] = (time.time() - started) * 1000
+
+        launched = _launch(client, session_key, params, '--health')
+        if launched is None:
+            health['error'] = 'the agent could not be uploaded'
+            return health
+
+        stdin, stderr, frames = launched
+        for frame in frames:
+            if frame['type'] == 'health':
+                health.update(frame)
+
+        if 'ab' not in health:
+            health['error'] = 'the agent did not answer: %s' % (stderr.read().strip() or 'no python?')
+            return health
+    except (socket.error, paramiko.SSHException, EOFError, IOError), e:
+        _sessions.discard(session_key)
+        _distributor.forget(session_key)
+        health['error'] = 'ssh: %s' % (e or e.__class__.__name__)
+        return health
+    finally:
+        if client is not None:
+            _sessions.release(session_key)
+
+    health['problem'] = _readiness_problem(health, params.get('engine') or 'ab')
+    health['ready'] = health['problem'] is None
+
+    return health
+
+def _readiness_problem(health, engine):
+    """
+    Why the bee can't attack with engine (the load generator that will run) - None if she can.
+    """
+    if not health[engine]:
+        others = [name for name in drivers.NAMES if health[name]]
+        return 'no %s%s' % ('python 3.5+ for the engine' if engine == 'engine' else engine,
+                            ' (try -E %s)' % others[0] if others else '')
+    if health['cpuIdle'] is not None and health['cpuIdle'] < BUSY_CPU_IDLE:
+        return 'busy, %.0f%% cpu idle' % (health['cpuIdle'] * 100)
+    return None
+
+def down(stop=False):
     """
-    Shutdown the load testing server.
+    Shutdown the load testing server - or only stop it, to be started again by the next up.
     """
-    username, key_name, zone, instance_ids = _read_server_list()
+    username, key_name, zones, instance_ids = _read_server_list()
 
     if not instance_ids:
         print 'No bees have been mobilized.'
@@ -185,12 +393,21 @@ def down():
 
     print 'Connecting to the hive.'
 
-    ec2_connection = boto.ec2.connect_to_region(_get_region(zone))
+    if stop:
+        print 'Sending the swarm to rest.'
+
+        stopped_instances = _in_each_region(
+            zones, instance_ids, lambda ec2_connection, region_instance_ids: ec2_connection.stop_instances(
+                instance_ids=region_instance_ids))
+
+        print 'Stopped %i bees, "bees up" wakes them.' % len(stopped_instances)
+        return
 
     print 'Calling off the swarm.'
 
-    terminated_instance_ids = ec2_connection.terminate_instances(
-        instance_ids=instance_ids)
+    terminated_instance_ids = _in_each_region(
+        zones, instance_ids, lambda ec2_connection, region_instance_ids: ec2_connection.terminate_instances(
+            instance_ids=region_instance_ids))
 
     print 'Stood down %i bees.' % len(terminated_instance_ids)
 
@@ -200,23 +417,19 @@ def _attack(params):
     """
     Test the target URL with requests.
 
-    Intended for use with multiprocessing.
+    Intended for use with a dispatch.Dispatcher.
     """
     print 'Bee %i is joining the swarm.' % params['i']
 
+    session_key = (params['instance_name'], params['username'], params['key_name'])
+
+    client = None
     try:
-        client = paramiko.SSHClient()
-        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        throttle = params['dispatcher'].throttle
 
-        pem_path = params.get('key_name') and _get_pem_path(params['key_name']) or None
-        if not os.path.isfile(pem_path):
-            client.load_system_host_keys()
-            client.connect(params['instance_name'], username=params['username'])
-        else:
-            client.connect(
-                params['instance_name'],
-                username=params['username'],
-                key_filename=pem_path)
+        with throttle():
+            # checked out, so the pool doesn't take it for idle however long the attack takes
+            client = _sessions.checkout(session_key)
 
         print 'Bee %i is firing her machine gun. Bang bang!' % params['i']
 
@@ -226,18 +439,9 @@ def _attack(params):
                 if h != '':
                     options += ' -H "%s"' % h.strip()
 
-        stdin, stdout, stderr = client.exec_command('mktemp')
-        params['csv_filename'] = stdout.read().strip()
-        if params['csv_filename']:
-            options += ' -e %(csv_filename)s' % params
-        else:
-            print 'Bee %i lost sight of the target (connection timed out creating csv_filename).' % params['i']
-            return None
-
-        if params['post_file']:
-            pem_file_path=_get_pem_path(params['key_name'])
-            os.system("scp -q -o 'StrictHostKeyChecking=no' -i %s %s %s@%s:/tmp/honeycomb" % (pem_file_path, params['post_file'], params['username'], params['instance_name']))
-            options += ' -T "%(mime_type)s; charset=UTF-8" -p /tmp/honeycomb' % params
+        if params['post_payload']:
+            params['post_path'] = params['post_payload'].remotePath
+            options += ' -T "%(mime_type)s; charset=UTF-8" -p %(post_path)s' % params
 
         if params['keep_alive']:
             options += ' -k'
@@ -250,44 +454,267 @@ def _attack(params):
         if params['basic_auth'] is not '':
             options += ' -A %s' % params['basic_auth']
 
-        params['options'] = options
-        benchmark_command = 'ab -r -n %(num_requests)s -c %(concurrent_requests)s %(options)s "%(url)s"' % params
-        stdin, stdout, stderr = client.exec_command(benchmark_command)
+        agent_options = '--armed'
+        if params['samples_filename']:
+            # the samples come back with the result, in the same channel
+            agent_options += ' --send-samples'
+        if params.get('stages'):
+            # the agent adds -n/-c (and --rate) for each stage of the profile
+            agent_options += ' --stages %s' % pipes.quote(json.dumps(params['stages']))
+            params['load'] = ''
+        else:
+            if params.get('work_queue'):
+                # the agent asks for the batches and adds -n/-c for each of them
+                agent_options += ' --queue %(concurrent_requests)s' % params
+                params['load'] = ''
+            else:
+                params['load'] = '-n %(num_requests)s -c %(concurrent_requests)s' % params
+            if params['rate']:
+                options += ' --rate %(rate)f' % params
+
+        if params.get('warm_up'):
+            warm_up = params['warm_up']
+            if params['post_payload']:
+                warm_up = dict(warm_up, requests=[dict(r, bodyPath=params['post_path']) for r in warm_up['requests']])
+            agent_options += ' --warm-up %s' % pipes.quote(json.dumps(warm_up))
+
+        if params.get('scenario_payload'):
+            # the bee draws its requests from the mix, with a sequence of its own; the
+            # agent inserts the load of stages and batches before the last argument
+            options += ' --scenario %s --seed %i' % (params['scenario_payload'].remotePath, params['i'])
+            params['target'] = '--'
+        else:
+            params['target'] = '"%(url)s"' % params
 
-        response = {}
+        if params['engine'] == 'engine':
+            options += ' --pipeline %(pipeline)s' % params
 
-        ab_results = stdout.read()
-        ms_per_request_search = re.search('Time\ per\ request:\s+([0-9.]+)\ \[ms\]\ \(mean\)', ab_results)
+        params['options'] = options
+        # ab's options, whichever load generator it is - its driver on the bee translates them
+        benchmark_command = '%(engine)s %(load)s %(options)s %(target)s' % params
+
+        # the agent runs the load generator on the bee and streams its progress back;
+        # armed, it reports ready and waits for the whole swarm to start at once
+        launched = _launch(client, session_key, params, agent_options, benchmark_command)
+        if launched is None:
+            print 'Bee %i could not be handed her payloads.' % params['i']
+            return None
 
-        if not ms_per_request_search:
-            print 'Bee %i lost sight of the target (connection timed out running ab).' % params['i']
+        stdin, stderr, frames = launched
+        work_queue = params.get('work_queue')
+        batches = []
+        released = False
+        result = None
+        warm_up = None
+        clock_offset = 0.0
+        samples_file = None
+        for frame in frames:
+            if frame['type'] == 'samples':
+                if samples_file is None:
+                    samples_file = tempfile.NamedTemporaryFile(prefix='bees_samples_', delete=False)
+                samples_file.write(agent.read_samples(frame))
+            elif frame['type'] == 'warmup':
+                warm_up = frame
+                print 'Bee %i warmed up in %.1f seconds.' % (params['i'], frame['seconds'])
+            elif frame['type'] == 'ready':
+                # bee clock minus ours, minus the one way latency - only reported,
+                # the start time goes out as is (the bees' clocks are synced by ntp)
+                clock_offset = frame['t'] - time.time()
+                start_at = params['barrier'].arrive(params['i'])
+                stdin.write('go %f\n' % start_at)
+                stdin.flush()
+                released = True
+                if work_queue is not None:
+                    work_queue.begin(params['i'], start_at)
+            elif frame['type'] == 'want':
+                # before the start there is no waiting for batches that might come
+                # back, the rest of the swarm is waiting at the barrier
+                requests = work_queue.take(params['i'], wait=released)
+                stdin.write('batch %i\n' % requests if requests else 'done\n')
+                stdin.flush()
+            elif frame['type'] == 'batch':
+                # a batch that was taken away has been done by another bee
+                if work_queue.complete(params['i']):
+                    batches.append(frame)
+            elif frame['type'] == 'progress':
+                if params.get('progress_queue'):
+                    params['progress_queue'].put((params['i'], frame))
+            elif frame['type'] == 'result':
+                result = frame
+
+        if work_queue is not None:
+            if result is None and batches:
+                print 'Bee %i was relieved after %i batches.' % (params['i'], len(batches))
+            # what counts is the batches she got done
+            result = batches and agent.merge_results(batches)
+            if not result:
+                print 'Bee %i got no batch done.' % params['i']
+                return None
+
+        if result is None:
+            print 'Bee %i lost sight of the target (connection lost running %s).' % (params['i'], params['engine'])
             return None
 
-        requests_per_second_search = re.search('Requests\ per\ second:\s+([0-9.]+)\ \[#\/sec\]\ \(mean\)', ab_results)
-        failed_requests = re.search('Failed\ requests:\s+([0-9.]+)', ab_results)
-        complete_requests_search = re.search('Complete\ requests:\s+([0-9]+)', ab_results)
-
-        response['ms_per_request'] = float(ms_per_request_search.group(1))
-        response['requests_per_second'] = float(requests_per_second_search.group(1))
-        response['failed_requests'] = float(failed_requests.group(1))
-        response['complete_requests'] = float(complete_requests_search.group(1))
-
-        stdin, stdout, stderr = client.exec_command('cat %(csv_filename)s' % params)
-        response['request_time_cdf'] = []
-        for row in csv.DictReader(stdout):
-            row["Time in ms"] = float(row["Time in ms"])
-            response['request_time_cdf'].append(row)
-        if not response['request_time_cdf']:
-            print 'Bee %i lost sight of the target (connection timed out reading csv).' % params['i']
+        if work_queue is not None:
+            response = _combine_stages(result['stages'])
+            if response is not None:
+                response['batches'] = len(response.pop('stages'))
+        elif 'stages' in result:
+            response = _combine_stages(result['stages'])
+        else:
+            response = _read_result(result)
+
+        if response is None:
+            errors = _errors_of(result)
+            if errors:
+                print 'Bee %i could not attack with %s: %s' % (params['i'], params['engine'], errors)
+            else:
+                print 'Bee %i lost sight of the target (connection timed out running %s).' % (params['i'], params['engine'])
             return None
 
-        print 'Bee %i is out of ammo.' % params['i']
+        if result.get('endpoints'):
+            response['endpoints'] = _read_endpoints(result['endpoints'], response)
+
+        if result.get('timeseries'):
+            response['timeseries'] = TimeSeries.from_dict(result['timeseries'])
+
+        if warm_up is not None:
+            response['warm_up'] = warm_up
 
-        client.close()
+        if samples_file is not None:
+            samples_file.close()
+            response['num_samples'] = _collect_samples(samples_file.name, params)
+
+        if result.get('startAt') is not None:
+            response['start_skew'] = result['startedAt'] - result['startAt']
+            response['clock_offset'] = clock_offset
+
+        print 'Bee %i is out of ammo.' % params['i']
 
         return response
     except socket.error, e:
+        _sessions.discard(session_key)
+        _distributor.forget(session_key)
         return e
+    finally:
+        if client is not None:
+            _sessions.release(session_key)
+        # don't keep the rest of the swarm waiting for a bee that failed
+        params['barrier'].withdraw(params['i'])
+        if params.get('work_queue'):
+            # nor for the batch she was working on
+            params['work_queue'].fail(params['i'])
+
+
+def _collect_samples(local_path, params):
+    """
+    Add the raw samples a bee sent back to the swarm's file.
+    """
+    try:
+        with params['samples_lock']:
+            return samples.append(params['samples_filename'], local_path, bee=params['i'])
+    finally:
+        os.remove(local_path)
+
+
+def _launch(client, session_key, params, *args):
+    """
+    Run the agent on a bee, in one round trip if she holds the payloads already.
+
+    Otherwise they are uploaded and the agent launched again. Returns stdin, stderr
+    and the frames of the agent - None if the bee still lacks payloads.
+    """
+    bundle = params['agent_bundle']
+    bee_payloads = params.get('payloads') or [bundle]
+    command = agent.launch_command(bundle.remotePath, [p.remotePath for p in bee_payloads if p is not bundle], *args)
+
+    for attempt in range(2):
+        stdin, stdout, stderr = client.exec_command(command)
+        frames = agent.read_frames(stdout)
+        first = next(frames, None)
+        if first is None or first['type'] != 'missing':
+            return stdin, stderr, itertools.chain([first] if first else [], frames)
+
+        missing = first['paths'].split()
+        with params['dispatcher'].throttle():
+            # what we uploaded before is gone (a reboot empties /tmp)
+            _distributor.forget(session_key)
+            target = payloads.SftpTarget(client)
+            try:
+                _distributor.ensure(session_key, target, [p for p in bee_payloads if p.remotePath in missing])
+            finally:
+                target.close()
+
+    return None
+
+
+def _errors_of(result):
+    """
+    The last line of what went wrong on the bee, if the load generator said so.
+    """
+    for r in [result] + result.get('stages', []):
+        if r.get('errors') and r.get('summary') is None:
+            return r['errors'].strip().splitlines()[-1]
+
+    return ''
+
+
+def _read_result(result):
+    """
+    The numbers of one run of the load generator (None if there are none).
+    """
+    # the drivers on the bees report the same numbers whichever load generator ran
+    response = result.get('summary')
+
+    if response is not None:
+        response['request_time_histogram'] = LatencyHistogram.from_dict(result['histogram'])
+
+    return response
+
+
+def _combine_stages(stage_results):
+    """
+    The numbers of a bee that ran a load profile - in total and per stage.
+    """
+    stages = [_read_result(r) for r in stage_results]
+
+    if None in stages:
+        return None
+
+    for stage, stage_result in zip(stages, stage_results):
+        stage['elapsed'] = stage_result['elapsed']
+
+    histogram = LatencyHistogram.merged(s['request_time_histogram'] for s in stages)
+    complete_requests = sum(s['complete_requests'] for s in stages)
+    elapsed = sum(s['elapsed'] for s in stages)
+
+    response = {}
+    response['complete_requests'] = complete_requests
+    response['failed_requests'] = sum(s['failed_requests'] for s in stages)
+    response['requests_per_second'] = complete_requests / elapsed if elapsed else 0.0
+    response['ms_per_request'] = histogram.mean
+    response['request_time_histogram'] = histogram
+    response['stages'] = stages
+
+    return response
+
+
+def _read_endpoints(endpoints, response):
+    """
+    The numbers of a bee per endpoint of a scenario.
+    """
+    bee_endpoints = []
+    for endpoint in endpoints:
+        share = float(endpoint['complete']) / response['complete_requests'] if response['complete_requests'] else 0.0
+        bee_endpoints.append({
+            'name': endpoint['name'],
+            'complete_requests': endpoint['complete'],
+            'failed_requests': endpoint['failed'],
+            'requests_per_second': response['requests_per_second'] * share,
+            'request_time_histogram': LatencyHistogram.from_dict(endpoint['histogram'])
+        })
+
+    return bee_endpoints
 
 
 def _summarize_results(results, params, csv_filename):
@@ -312,7 +739,22 @@ def _summarize_results(results, params, csv_filename):
     summarized_results['mean_requests'] = sum(complete_results)
 
     complete_results = [r['ms_per_request'] for r in summarized_results['complete_bees']]
-    summarized_results['mean_response'] = sum(complete_results) / summarized_results['num_complete_bees']
+    summarized_results['mean_response'] = sum(complete_results) / max(summarized_results['num_complete_bees'], 1)
+
+    # how late each bee started after the common start (bees that were armed)
+    summarized_results['start_skews'] = [
+        (p['instance_id'], r['start_skew'], r['clock_offset'])
+        for r, p in zip(summarized_results['complete_bees'], summarized_results['complete_bees_params'])
+        if 'start_skew' in r]
+
+    if params[0].get('scenario_payload'):
+        summarized_results['endpoints'] = _summarize_endpoints(summarized_results['complete_bees'])
+
+    if params[0].get('profile'):
+        summarized_results['stages'] = _summarize_stages(summarized_results['complete_bees'], params[0]['profile'])
+
+    if params[0].get('rate'):
+        summarized_results['intended_rate'] = sum(p['rate'] for p in params)
 
     summarized_results['tpr_bounds'] = params[0]['tpr']
     summarized_results['rps_bounds'] = params[0]['rps']
@@ -324,18 +766,87 @@ def _summarize_results(results, params, csv_filename):
             summarized_results['performance_accepted'] = False
 
     if summarized_results['rps_bounds'] is not None:
-        if summarized_results['mean_requests'] > summarized_results['rps_bounds'] and summarized_results['performance_accepted'] is True or None:
+        # both bounds have to hold if both are given
+        if summarized_results['mean_requests'] > summarized_results['rps_bounds'] and summarized_results.get('performance_accepted', True):
             summarized_results['performance_accepted'] = True
         else:
             summarized_results['performance_accepted'] = False
 
-    summarized_results['request_time_cdf'] = _get_request_time_cdf(summarized_results['total_complete_requests'], summarized_results['complete_bees'])
+    summarized_results['request_time_histogram'] = LatencyHistogram.merged(
+        r['request_time_histogram'] for r in summarized_results['complete_bees'])
+    summarized_results['request_time_cdf'] = _get_request_time_cdf(summarized_results['request_time_histogram'])
+
+    # the bees' seconds line up by their clocks, so the series add up second by second
+    bee_series = [r['timeseries'] for r in summarized_results['complete_bees'] if 'timeseries' in r]
+    if bee_series:
+        summarized_results['timeseries'] = TimeSeries.merged(bee_series)
+
+    bee_warm_ups = [r['warm_up'] for r in summarized_results['complete_bees'] if r.get('warm_up')]
+    if bee_warm_ups:
+        summarized_results['warm_up'] = _summarize_warm_up(bee_warm_ups)
+
     if csv_filename:
-        _create_request_time_cdf_csv(results, summarized_results['complete_bees_params'], summarized_results['request_time_cdf'], csv_filename)
+        _create_request_time_cdf_csv(summarized_results['complete_bees'], summarized_results['complete_bees_params'], summarized_results['request_time_cdf'], csv_filename)
 
     return summarized_results
 
 
+def _summarize_stages(complete_bees, profile):
+    stages = []
+    for index, stage in enumerate(profile):
+        bee_stages = [r['stages'][index] for r in complete_bees]
+        summarized_stage = dict()
+        summarized_stage['name'] = stage.name
+        summarized_stage['concurrency'] = stage.concurrency
+        summarized_stage['rate'] = stage.rate
+        summarized_stage['duration'] = stage.duration
+        summarized_stage['total_complete_requests'] = sum(s['complete_requests'] for s in bee_stages)
+        summarized_stage['total_failed_requests'] = sum(s['failed_requests'] for s in bee_stages)
+        summarized_stage['mean_requests'] = sum(s['requests_per_second'] for s in bee_stages)
+        summarized_stage['request_time_histogram'] = LatencyHistogram.merged(s['request_time_histogram'] for s in bee_stages)
+        stages.append(summarized_stage)
+
+    return stages
+
+
+def _summarize_endpoints(complete_bees):
+    bee_endpoints = [r['endpoints'] for r in complete_bees if r.get('endpoints')]
+    endpoints = []
+    for same_endpoints in zip(*bee_endpoints):
+        summarized_endpoint = dict()
+        summarized_endpoint['name'] = same_endpoints[0]['name']
+        summarized_endpoint['total_complete_requests'] = sum(e['complete_requests'] for e in same_endpoints)
+        summarized_endpoint['total_failed_requests'] = sum(e['failed_requests'] for e in same_endpoints)
+        summarized_endpoint['mean_requests'] = sum(e['requests_per_second'] for e in same_endpoints)
+        summarized_endpoint['request_time_histogram'] = LatencyHistogram.merged(e['request_time_histogram'] for e in same_endpoints)
+        endpoints.append(summarized_endpoint)
+
+    return endpoints
+
+
+def _summarize_warm_up(bee_warm_ups):
+    """
+    The warm-up of the swarm - it took as long as the slowest bee, the hit rate of a url is the mean of the bees'.
+    """
+    urls = []
+    for same_urls in zip(*[w['urls'] for w in bee_warm_ups]):
+        hit_rates = [u['hitRate'] for u in same_urls if u['hitRate'] is not None]
+        latencies = [u['ms'] for u in same_urls if u['ms'] is not None]
+        urls.append(dict(
+            url=same_urls[0]['url'],
+            hit_rate=sum(hit_rates) / len(hit_rates) if hit_rates else None,
+            ms=sum(latencies) / len(latencies) if latencies else None,
+            rounds=max(u['rounds'] for u in same_urls),
+            warm_bees=sum(1 for u in same_urls if u['warm']),
+            errors=sorted(set(u['error'] for u in same_urls if u['error']))))
+
+    return dict(seconds=max(w['seconds'] for w in bee_warm_ups),
+                requests=sum(w['requests'] for w in bee_warm_ups),
+                failed=sum(w['failed'] for w in bee_warm_ups),
+                bees=len(bee_warm_ups),
+                urls=urls)
+
+
 def _create_request_time_cdf_csv(results, complete_bees_params, request_time_cdf, csv_filename):
     if csv_filename:
         with open(csv_filename, 'w') as stream:
@@ -344,32 +855,19 @@ def _create_request_time_cdf_csv(results, complete_bees_params, request_time_cdf
             for p in complete_bees_params:
                 header.append("bee %(instance_id)s [ms]" % p)
             writer.writerow(header)
+            bee_cdfs = [_get_request_time_cdf(r['request_time_histogram']) for r in results]
             for i in range(100):
                 row = [i, request_time_cdf[i]]
-                for r in results:
-                    row.append(r['request_time_cdf'][i]["Time in ms"])
+                for cdf in bee_cdfs:
+                    row.append(cdf[i])
                 writer.writerow(row)
 
 
-def _get_request_time_cdf(total_complete_requests, complete_bees):
-    # Recalculate the global cdf based on the csv files collected from
-    # ab. Can do this by sampling the request_time_cdfs for each of
-    # the completed bees in proportion to the number of
-    # complete_requests they have
-    n_final_sample = 100
-    sample_size = 100 * n_final_sample
-    n_per_bee = [int(r['complete_requests'] / total_complete_requests * sample_size)
-                 for r in complete_bees]
-    sample_response_times = []
-    for n, r in zip(n_per_bee, complete_bees):
-        cdf = r['request_time_cdf']
-        for i in range(n):
-            j = int(random.random() * len(cdf))
-            sample_response_times.append(cdf[j]["Time in ms"])
-    sample_response_times.sort()
-    request_time_cdf = sample_response_times[0:sample_size:sample_size / n_final_sample]
-
-    return request_time_cdf
+def _get_request_time_cdf(request_time_histogram):
+    # The global histogram is the exact sum of the histograms the bees
+    # built from their ab -g output, so reading the cdf from it is
+    # deterministic and accurate to the histogram's relative error
+    return request_time_histogram.percentiles(range(100))
 
 
 def _print_results(summarized_results):
@@ -391,6 +889,8 @@ def _print_results(summarized_results):
     print '     Failed requests:\t\t%i' % summarized_results['total_failed_requests']
 
     print '     Requests per second:\t%f [#/sec] (mean of bees)' % summarized_results['mean_requests']
+    if 'intended_rate' in summarized_results:
+        print '     Requests per second:\t%f [#/sec] (intended, latencies from intended send time)' % summarized_results['intended_rate']
     if 'rps_bounds' in summarized_results and summarized_results['rps_bounds'] is not None:
         print '     Requests per second:\t%f [#/sec] (upper bounds)' % summarized_results['rps_bounds']
 
@@ -400,6 +900,57 @@ def _print_results(summarized_results):
 
     print '     50%% responses faster than:\t%f [ms]' % summarized_results['request_time_cdf'][49]
     print '     90%% responses faster than:\t%f [ms]' % summarized_results['request_time_cdf'][89]
+    p99, p999, p9999 = summarized_results['request_time_histogram'].percentiles([99, 99.9, 99.99])
+    print '     99%% responses faster than:\t%f [ms]' % p99
+    print '     99.9%% responses faster than:\t%f [ms]' % p999
+    print '     99.99%% responses faster than:\t%f [ms]' % p9999
+
+    if summarized_results.get('endpoints'):
+        print '     Endpoints:\t\t\t[#/sec]\t\tp50 [ms]\tp99 [ms]\tfailed'
+        for endpoint in summarized_results['endpoints']:
+            p50, p99 = endpoint['request_time_histogram'].percentiles([50, 99])
+            print '       %-22s %f\t%f\t%f\t%i' % (
+                endpoint['name'][:22], endpoint['mean_requests'], p50, p99, endpoint['total_failed_requests'])
+
+    if summarized_results.get('stages'):
+        print '     Stages:\t\t\t[#/sec]\t\tp50 [ms]\tp99 [ms]\tfailed'
+        for stage in summarized_results['stages']:
+            p50, p99 = stage['request_time_histogram'].percentiles([50, 99])
+            print '       %-14s c=%-6i %s\t%f\t%f\t%i' % (
+                stage['name'], stage['concurrency'],
+                '%f' % stage['mean_requests'] + (' (of %.1f)' % stage['rate'] if stage['rate'] else ''),
+                p50, p99, stage['total_failed_requests'])
+
+    if summarized_results.get('timeseries'):
+        rows = summarized_results['timeseries'].rows()
+        slowest = max(rows, key=lambda row: row['p99'])
+        print '     Per second:\t\t\t%i [#/sec] (min), %i [#/sec] (max), %i seconds' % (
+            min(row['complete'] for row in rows), max(row['complete'] for row in rows), len(rows))
+        print '     Slowest second:\t\t%f [ms] (p99) at %is' % (slowest['p99'], slowest['elapsed'])
+
+    if summarized_results.get('work_queue'):
+        work_queue = summarized_results['work_queue']
+        batches = [work_queue.batches.get(p['i'], 0) for p in summarized_results['complete_bees_params']]
+        print '     Batches:\t\t\t%i of %i requests, %s per bee' % (sum(batches), work_queue.batchSize, _share(batches))
+        if work_queue.reassigned:
+            print '     Reassigned:\t\t\t%i requests (of lagging or lost bees)' % work_queue.reassigned
+        if not work_queue.finished:
+            print '     Not delivered:\t\t%i requests (no bee was left to take them)' % (work_queue.total - work_queue.done)
+
+    if summarized_results.get('warm_up'):
+        _print_warm_up(summarized_results['warm_up'])
+
+    if summarized_results.get('samples'):
+        print '     Raw samples:\t\t\t%i (one per request) in %s' % summarized_results['samples']
+
+    if summarized_results.get('forced_start'):
+        print '     Start:\t\t\tnot synchronized, released after %.0f seconds without %i bees (they started on arrival)' % summarized_results['forced_start']
+
+    if summarized_results.get('start_skews'):
+        skews = [skew for _, skew, _ in summarized_results['start_skews']]
+        print '     Start skew:\t\t\t%f [ms] (max), %f [ms] (spread)' % (max(skews) * 1000, (max(skews) - min(skews)) * 1000)
+        for instance_id, skew, clock_offset in summarized_results['start_skews']:
+            print '       Bee %s:\t%+f [ms] (clock offset %+f [ms])' % (instance_id, skew * 1000, clock_offset * 1000)
 
     if 'performance_accepted' in summarized_results:
         print '     Performance check:\t\t%s' % summarized_results['performance_accepted']
@@ -416,57 +967,282 @@ def _print_results(summarized_results):
         print 'Mission Assessment: Swarm annihilated target.'
 
 
-def attack(url, n, c, **options):
+def _print_warm_up(warm_up):
     """
-    Test the root url of this site.
+    Print how the warm-up went - none of it is in the results.
     """
-    username, key_name, zone, instance_ids = _read_server_list()
-    headers = options.get('headers', '')
-    csv_filename = options.get("csv_filename", '')
-    cookies = options.get('cookies', '')
-    post_file = options.get('post_file', '')
-    keep_alive = options.get('keep_alive', False)
-    basic_auth = options.get('basic_auth', '')
+    print '     Warm-up:\t\t\t%.1f seconds, %i requests (%i failed), not in the results' % (
+        warm_up['seconds'], warm_up['requests'], warm_up['failed'])
+    for url in warm_up['urls']:
+        if url['errors']:
+            state = 'failed: %s' % '; '.join(url['errors'])
+        elif url['hit_rate'] is not None:
+            state = '%.0f%% hits' % (url['hit_rate'] * 100)
+        elif url['ms'] is not None:
+            state = 'no cache headers, %f [ms]' % url['ms']
+        else:
+            state = 'no answer'
+        print '       %-30s %s after %i rounds, warm on %i of %i bees' % (
+            url['url'][-30:], state, url['rounds'], url['warm_bees'], warm_up['bees'])
 
-    if csv_filename:
+
+def _describe_plan(n, c, options):
+    """
+    How the target is attacked, in short - runs of the same plan are compared in the history.
+    """
+    plan = options.get('engine') or 'ab'
+
+    if options.get('profile'):
+        plan += ' profile ' + ','.join(
+            'c%i/%gs' % (stage.concurrency, stage.duration) + ('@%g/s' % stage.rate if stage.rate else '')
+            for stage in options['profile'])
+    else:
+        plan += ' -n %i -c %i' % (n, c)
+        if options.get('rate'):
+            plan += ' --rate %g' % options['rate']
+
+    if options.get('scenario'):
+        plan += ' scenario %s' % os.path.basename(options['scenario'])
+
+    return plan
+
+
+def _record_run(url, n, c, options, instances, summarized_results):
+    """
+    Store the attack in the history (see history.py) - returns the stored run.
+    """
+    bees = [history.BeeRun(p['i'], p['instance_id'], r['complete_requests'], r['failed_requests'],
+                           r['requests_per_second'], r['ms_per_request'], r['request_time_histogram'])
+            for r, p in zip(summarized_results['complete_bees'], summarized_results['complete_bees_params'])]
+    run = history.Run(url or os.path.abspath(options['scenario']), _describe_plan(n, c, options),
+                      len(instances), summarized_results['total_complete_requests'],
+                      summarized_results['total_failed_requests'], summarized_results['mean_requests'],
+                      summarized_results['mean_response'], summarized_results['request_time_histogram'],
+                      instanceType=getattr(instances[0], 'instance_type', None), bees=bees,
+                      perSecond=_per_second(summarized_results.get('timeseries')))
+    try:
+        store = history.RunStore()
         try:
-            stream = open(csv_filename, 'w')
-        except IOError, e:
-            raise IOError("Specified csv_filename='%s' is not writable. Check permissions or specify a different filename and try again." % csv_filename)
+            store.add(run)
+            return run
+        finally:
+            store.close()
+    except sqlite3.Error, e:
+        print 'bees: warning: the run could not be stored in the history: %s' % e
+
+
+def _per_second(series):
+    """
+    The requests of the swarm in each second of the attack, gaps included - None without a time series.
+    """
+    if not series:
+        return None
+    return [row['complete'] for row in series.rows(percents=())]
+
+
+def _check_gate(run, baseline_ref, tolerances):
+    """
+    Compare the run with a baseline from the history (see gate.py).
+
+    Returns False if it regressed significantly (or the baseline asked for isn't there), None if there is no previous run.
+    """
+    store = history.RunStore()
+    try:
+        baseline = _find_baseline(store, run, baseline_ref)
+    except ValueError, e:
+        print '     Gate:\t\t\t%s, failed' % e
+        return False
+    finally:
+        store.close()
+
+    if baseline is None:
+        print '     Gate:\t\t\tno baseline (%s) to compare with, passed' % baseline_ref
+        return None
+
+    verdicts = gate.check(baseline, run, tolerances)
+    print '     Gate against run %i:\tchange [95%% confidence interval] (tolerance)' % baseline.id
+    for verdict in verdicts:
+        if verdict.metric == 'failed':
+            print '       %-8s %+.2f [%+.2f, %+.2f] (%.2f) percentage points%s' % (
+                verdict.metric, verdict.change * 100, verdict.low * 100, verdict.high * 100,
+                verdict.tolerance * 100, ' REGRESSED' if verdict.regressed else '')
+        else:
+            print '       %-8s %+.1f%% [%+.1f%%, %+.1f%%] (%.1f%%)%s' % (
+                verdict.metric, (verdict.change - 1) * 100, (verdict.low - 1) * 100, (verdict.high - 1) * 100,
+                verdict.tolerance * 100, ' REGRESSED' if verdict.regressed else '')
+
+    return not any(verdict.regressed for verdict in verdicts)
+
+
+def _find_baseline(store, run, baseline_ref):
+    """
+    The run to compare with - None if there is no previous one, ValueError if the one asked for by number isn't in the history.
+    """
+    if baseline_ref == 'previous':
+        baseline = run and store.previous(run)
+        if baseline is not None:
+            baseline.bees = store.bees(baseline.id)
+        return baseline
+
+    try:
+        baseline = store.get(int(baseline_ref), withBees=True)
+    except ValueError:
+        raise ValueError('the run to compare with is its number or "previous", not %r' % baseline_ref)
+    if baseline is None:
+        raise ValueError('there is no run %s in the history to compare with' % baseline_ref)
+    return baseline
+
+
+def history_report(url=None, baseline_id=None, limit=10):
+    """
+    Compare the latest attack (on url) with a baseline - by default the run of the same plan before it.
+    """
+    store = history.RunStore()
+
+    try:
+        latest = store.latest(target=url)
+
+        if latest is None:
+            print 'No attacks in the history%s.' % (' on %s' % url if url else '')
+            return
+
+        print 'Latest attacks%s:' % (' on %s' % url if url else '')
+        for run in store.find(target=url, limit=limit):
+            print '  %5i  %s  %-30s  %-30s  %i bees  %f [#/sec]  %f [ms]' % (
+                run.id, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(run.started)),
+                run.target[:30], run.plan[:30], run.swarmSize, run.rps, run.meanMs)
+
+        if baseline_id is not None:
+            baseline = store.get(baseline_id)
+        else:
+            baseline = store.previous(latest)
+
+        if baseline is None:
+            print 'No baseline to compare run %i with (no earlier run of the same plan).' % latest.id
+            return
+
+        print 'Run %i compared with run %i:' % (latest.id, baseline.id)
+        for metric, before, after in history.compare(baseline, latest):
+            change = (after - before) / before * 100 if before else 0.0
+            print '     %-20s\t%f\t%f\t%+.1f%%' % (metric, before, after, change)
+    finally:
+        store.close()
+
+
+def _assemble_swarm():
+    """
+    The bees from the roster - (username, key_name, instances), None if there are none.
+    """
+    username, key_name, zones, instance_ids = _read_server_list()
 
     if not instance_ids:
         print 'No bees are ready to attack.'
-        return
+        return None
 
     print 'Connecting to the hive.'
 
-    ec2_connection = boto.ec2.connect_to_region(_get_region(zone))
-
     print 'Assembling bees.'
 
-    reservations = ec2_connection.get_all_instances(instance_ids=instance_ids)
+    instances = _in_each_region(zones, instance_ids, hive.describe_bees)
+
+    resting = [instance for instance in instances if instance.state != 'running']
+    if resting:
+        print 'bees: error: %i bees are not running (%s), "bees up" wakes stopped ones.' % (
+            len(resting), ', '.join(sorted(set(instance.state for instance in resting))))
+        return None
+
+    # bee i is the i-th of the roster, whatever region it flies in
+    order = dict((instance_id, i) for i, instance_id in enumerate(instance_ids))
+    instances.sort(key=lambda instance: order.get(instance.id))
 
-    instances = []
+    return username, key_name, instances
 
-    for reservation in reservations:
-        instances.extend(reservation.instances)
+
+def _warm_up_requests(url, options):
+    """
+    What the bees request to warm up - the url or every endpoint of the scenario, with the headers of the attack.
+    """
+    headers = [h.strip() for h in (options.get('headers') or '').split(';') if h.strip()]
+    # the same cookie as the attack, a cache might keep a copy per cookie
+    cookies = options.get('cookies') or ''
+    headers.append('Cookie: %ssessionid=NotARealSessionID;' % cookies if cookies else 'Cookie: sessionid=NotARealSessionID')
+    if options.get('basic_auth'):
+        headers.append('Authorization: Basic %s' % base64.b64encode(options['basic_auth']))
+
+    if options.get('scenario'):
+        return [dict(url=e.url, method=e.method, body=e.body,
+                     headers=headers + e.headers + (['Content-Type: %s' % e.contentType] if e.contentType else []))
+                for e in scenarios.load(options['scenario']).endpoints]
+
+    if options.get('post_file'):
+        # the bee posts the copy of the post file she got
+        headers.append('Content-Type: %s; charset=UTF-8' % options.get('mime_type', ''))
+    return [dict(url=url, headers=headers)]
+
+
+def _fight(url, n, c, username, key_name, instances, options, warm_up=True):
+    """
+    One attack of the swarm - the summarized results, None if it could not start.
+    """
+    headers = options.get('headers', '')
+    csv_filename = options.get("csv_filename", '')
+    timeseries_filename = options.get('timeseries_filename', '')
+    samples_filename = options.get('samples_filename', '')
+    cookies = options.get('cookies', '')
+    post_file = options.get('post_file', '')
+    fan_out = options.get('fan_out') or DEFAULT_FAN_OUT
+    upload_rate = options.get('upload_rate')
 
     instance_count = len(instances)
+    profile = options.get('profile')
+    scenario_payload = options.get('scenario') and payloads.load(options['scenario'], suffix='.json')
 
-    if n < instance_count * 2:
+    if profile:
+        try:
+            stages = [[stage.share(instance_count, i).asDict for stage in profile] for i in range(instance_count)]
+        except ValueError, e:
+            print 'bees: error: %s' % e
+            return None
+    elif n < instance_count * 2:
         print 'bees: error: the total number of requests must be at least %d (2x num. instances)' % (instance_count * 2)
-        return
-    if c < instance_count:
+        return None
+    elif c < instance_count:
         print 'bees: error: the number of concurrent requests must be at least %d (num. instances)' % instance_count
-        return
-    if n < c:
+        return None
+    elif n < c:
         print 'bees: error: the number of concurrent requests (%d) must be at most the same as number of requests (%d)' % (c, n)
-        return
-
-    requests_per_instance = int(float(n) / instance_count)
-    connections_per_instance = int(float(c) / instance_count)
-
-    print 'Each of %i bees will fire %s rounds, %s at a time.' % (instance_count, requests_per_instance, connections_per_instance)
+        return None
+
+    # the first bees take one more if it doesn't divide evenly, the total is exact
+    requests_per_instance = profiles.split(n, instance_count)
+    connections_per_instance = profiles.split(c, instance_count)
+    rate = options.get('rate')
+    rate_per_instance = rate and float(rate) / instance_count
+
+    # the bees warm up from where they are before they get ready, so it's not in the results;
+    # simulated bees leave the target alone
+    warm_up_seconds = options.get('warm_up', warmup.SECONDS)
+    warm_up_spec = None
+    if warm_up and warm_up_seconds and not os.environ.get(agent.SIMULATE_ENV):
+        warm_up_spec = dict(seconds=warm_up_seconds,
+                            concurrency=options.get('warm_up_concurrency') or warmup.CONCURRENCY,
+                            requests=_warm_up_requests(url, options))
+
+    work_queue = None
+    if options.get('batch') is not None and not profile:
+        # every bee gets a batch before the start
+        batch = min(options['batch'] or workqueue.batch_size(n, instance_count, max(connections_per_instance)),
+                    n // instance_count)
+        work_queue = workqueue.WorkQueue(n, batch, timeout=options.get('batch_timeout'))
+
+    if profile:
+        print 'Each of %i bees will fly a profile of %i stages over %i seconds.' % (instance_count, len(profile), sum(stage.duration for stage in profile))
+    elif work_queue:
+        print '%i bees will fire %i rounds in batches of %i, %s at a time, the faster ones more.' % (instance_count, n, work_queue.batchSize, _share(connections_per_instance))
+    elif rate:
+        print 'Each of %i bees will fire %s rounds, %.1f per second, at most %s at a time.' % (instance_count, _share(requests_per_instance), rate_per_instance, _share(connections_per_instance))
+    else:
+        print 'Each of %i bees will fire %s rounds, %s at a time.' % (instance_count, _share(requests_per_instance), _share(connections_per_instance))
 
     params = []
 
@@ -476,8 +1252,8 @@ def attack(url, n, c, **options):
             'instance_id': instance.id,
             'instance_name': instance.public_dns_name,
             'url': url,
-            'concurrent_requests': connections_per_instance,
-            'num_requests': requests_per_instance,
+            'concurrent_requests': connections_per_instance[i],
+            'num_requests': requests_per_instance[i],
             'username': username,
             'key_name': key_name,
             'headers': headers,
@@ -487,51 +1263,307 @@ def attack(url, n, c, **options):
             'mime_type': options.get('mime_type', ''),
             'tpr': options.get('tpr'),
             'rps': options.get('rps'),
-            'basic_auth': options.get('basic_auth')
+            'basic_auth': options.get('basic_auth'),
+            'engine': options.get('engine') or 'ab',
+            'pipeline': options.get('pipeline') or 1,
+            'rate': rate_per_instance,
+            'profile': profile,
+            'stages': profile and stages[i],
+            'scenario_payload': scenario_payload,
+            'work_queue': work_queue,
+            'warm_up': warm_up_spec
         })
 
-    print 'Stinging URL so it will be cached for the attack.'
+    print 'Organizing the swarm.'
+    # Bees report their progress while attacking, the view shows it live
+    progress_queue = Queue.Queue()
+    dispatcher = Dispatcher(fan_out)
+    # All bees get ready first, then they are released at the same moment
+    barrier = StartBarrier(len(params), lead=options.get('start_lead', 1.0),
+                           timeout=_barrier_timeout(len(params), fan_out, warm_up_spec))
+    _distributor.limit(upload_rate and upload_rate * 1024)
+    agent_bundle = payloads.Payload(agent.build_bundle(), name='agent', suffix='.zip')
+    post_payload = post_file and payloads.load(post_file)
+    samples_lock = threading.Lock()
+    for p in params:
+        p['samples_filename'] = samples_filename
+        p['samples_lock'] = samples_lock
+        p['progress_queue'] = progress_queue
+        p['dispatcher'] = dispatcher
+        p['barrier'] = barrier
+        p['agent_bundle'] = agent_bundle
+        p['post_payload'] = post_payload
+        p['payloads'] = [agent_bundle] + [pl for pl in (post_payload, scenario_payload) if pl]
+    view = SwarmView(len(params))
+    watcher = threading.Thread(target=view.follow, args=(progress_queue,))
+    watcher.daemon = True
+    watcher.start()
+
+    if work_queue:
+        over = threading.Event()
+        foreman = threading.Thread(target=_relieve_stragglers, args=(work_queue, params, over))
+        foreman.daemon = True
+        foreman.start()
+
+    # One thread per bee, all of them driven from this process
+    results = dispatcher.map(_attack, params)
+    if work_queue:
+        over.set()
+
+    progress_queue.put(None)
+    watcher.join()
 
-    request = urllib2.Request(url)
-    # Need to revisit to support all http verbs.
-    if post_file:
-        try:
-            with open(post_file, 'r') as content_file:
-                content = content_file.read()
-            request.add_data(content)
-        except IOError:
-            print 'bees: error: The post file you provided doesn\'t exist.'
+    summarized_results = _summarize_results(results, params, csv_filename)
+    if barrier.missing:
+        summarized_results['forced_start'] = (barrier.timeout, barrier.missing)
+    if work_queue:
+        summarized_results['work_queue'] = work_queue
+    if timeseries_filename and summarized_results.get('timeseries'):
+        timeseries.write(summarized_results['timeseries'], timeseries_filename)
+    if samples_filename:
+        summarized_results['samples'] = (sum(r.get('num_samples', 0) for r in summarized_results['complete_bees']), samples_filename)
+        if options.get('samples_csv_filename') and summarized_results['samples'][0]:
+            _export_samples(samples_filename, options['samples_csv_filename'])
+    return summarized_results
+
+
+def _export_samples(samples_filename, csv_filename):
+    """
+    Write the swarm's raw samples as csv, one row per request.
+    """
+    with samples.SampleReader(samples_filename) as reader:
+        with open(csv_filename, 'wb') as stream:
+            samples.write_csv(reader, stream)
+
+
+def _barrier_timeout(instance_count, fan_out, warm_up_spec):
+    """
+    How long the first bee to get ready waits for the rest: they connect and upload in waves of fan_out, then warm up - until the warm-up time is over and the round under way is done.
+    """
+    timeout = -(-instance_count // fan_out) * BEE_PREPARE_SECONDS
+    if warm_up_spec:
+        concurrency = warm_up_spec['concurrency']
+        per_round = len(warm_up_spec['requests']) * max(concurrency, warmup.PER_ROUND)
+        timeout += warm_up_spec['seconds'] + -(-per_round // concurrency) * warmup.TIMEOUT
+    return timeout
+
+
+def _share(per_instance):
+    """
+    What each bee gets, e.g. 33 or 33-34 if some get one more.
+    """
+    low, high = min(per_instance), max(per_instance)
+    return str(low) if low == high else '%i-%i' % (low, high)
+
+
+def _relieve_stragglers(work_queue, params, over):
+    """
+    Take their batch away from the bees that lag behind, until the attack is over.
+
+    The connection to such a bee is closed, which ends her part of the attack.
+    """
+    while not over.wait(workqueue.POLL):
+        for i in work_queue.overdue():
+            requests = work_queue.fail(i)
+            if requests:
+                print 'Bee %i is lagging behind, her %i rounds go to the others.' % (i, requests)
+                p = params[i]
+                _sessions.discard((p['instance_name'], p['username'], p['key_name']))
+
+
+def probe(url, slo, **options):
+    """
+    Search the highest load the target takes within the slo (see probe.py).
+    """
+    search = options.get('search') or 'concurrency'
+    step_duration = options.get('step_duration') or 20
+    # with a rate search the concurrency is a cap, it stays the same
+    concurrency = options.get('concurrency') or 0
+
+    swarm = _assemble_swarm()
+    if swarm is None:
+        return
+
+    username, key_name, instances = swarm
+    instance_count = len(instances)
+
+    if search == 'rate' and options.get('engine') != 'engine':
+        print 'bees: error: a rate search needs the engine (-E engine)'
+        return
+    if search == 'rate' and concurrency < instance_count:
+        print 'bees: error: the number of concurrent requests must be at least %d (num. instances)' % instance_count
+        return
+
+    # the first step warms up, the others find the caches warm
+    warmed_up = []
+
+    def measure(load):
+        if search == 'rate':
+            stage = profiles.Stage(concurrency, step_duration, rate=load, name='probe')
+        else:
+            stage = profiles.Stage(load, step_duration, name='probe')
+        print 'Probing with %s %s for %i seconds.' % (search, load, step_duration)
+        started = time.time()
+        summarized_results = _fight(url, 0, 0, username, key_name, instances,
+                                    dict(options, profile=[stage]), warm_up=not warmed_up)
+        duration = time.time() - started
+        warmed_up.append(load)
+        if summarized_results and summarized_results.get('warm_up'):
+            _print_warm_up(summarized_results['warm_up'])
+        if not summarized_results or not summarized_results['num_complete_bees']:
+            # nothing came back, which is as bad as it gets
+            return Measurement(load, 0.0, float('inf'), 1.0, duration)
+
+        complete = summarized_results['total_complete_requests']
+        return Measurement(
+            load, summarized_results['mean_requests'],
+            summarized_results['request_time_histogram'].percentile(slo.percent),
+            float(summarized_results['total_failed_requests']) / complete if complete else 1.0,
+            duration)
+
+    capacity = CapacitySearch(
+        measure, slo, options.get('start') or instance_count, limit=options.get('limit'),
+        minimum=instance_count if search == 'concurrency' else 1,
+        granularity=instance_count if search == 'concurrency' else 1,
+        precision=options.get('precision') or 0.05)
+    capacity.run()
+
+    print 'Probe complete.'
+    print '     Steps against %s:' % slo
+    for i, step in enumerate(capacity.steps):
+        print '       %2i  %s %-8s %f [#/sec]  p%g %f [ms]  %.2f%% failed  %s' % (
+            i + 1, search, step.load, step.rps, slo.percent, step.latency, step.errorRate * 100,
+            'ok' if step.ok else '; '.join(step.violations))
+    print '     Attack time:\t\t%i steps, %i seconds' % (len(capacity.steps), capacity.duration)
+
+    best = capacity.bestMeasurement
+    if best is None:
+        print 'The target does not meet the SLO (%s) at the lowest load (%s %s).' % (slo, search, capacity.steps[0].load)
+    else:
+        print 'Highest %s within the SLO (%s): %s (%f [#/sec])%s.' % (
+            search, slo, best.load, best.rps,
+            '' if capacity.worst is not None else ', the limit - it takes more')
+
+    print 'The swarm is awaiting new orders.'
+    return capacity
+
+
+def bake(name=None):
+    """
+    Bake an image of the first bee with the load generators installed - new bees are ready at once.
+    """
+    swarm = _assemble_swarm()
+    if swarm is None:
+        return
+
+    username, key_name, instances = swarm
+    instance = instances[0]
+    name = name or 'bees-%s' % time.strftime('%Y%m%d-%H%M%S')
+
+    # local bees use the tools of this machine, nothing to install there
+    if not localhive.is_local(instance.public_dns_name):
+        print 'Bee %s is installing the load generators.' % instance.id
+
+        with _sessions.using((instance.public_dns_name, username, key_name)) as client:
+            stdin, stdout, stderr = client.exec_command(agent.INSTALL_TOOLING)
+            output = stdout.read()
+        if agent.TOOLING_READY not in output:
+            print 'bees: error: installing the load generators failed:\n%s' % (stderr.read() or output)
             return
 
-    if cookies is not '':
-        request.add_header('Cookie', cookies)
+    print 'Baking image %s from bee %s.' % (name, instance.id)
 
-    if basic_auth is not '':
-        authentication = base64.encodestring(basic_auth).replace('\n', '')
-        request.add_header('Authorization', 'Basic %s' % authentication)
+    ec2_connection = _get_connection(instance.placement)
+    # the bee reboots, so the image is taken from a consistent file system
+    image_id = ec2_connection.create_image(
+        instance.id, name, description='bees with machine guns - ab and python3 installed')
 
-    # Ping url so it will be cached for testing
-    dict_headers = {}
-    if headers is not '':
-        dict_headers = headers = dict(j.split(':') for j in [i.strip() for i in headers.split(';') if i != ''])
+    print 'Waiting for image %s to be available...' % image_id
 
-    for key, value in dict_headers.iteritems():
-        request.add_header(key, value)
+    hive.wait_for_image(ec2_connection, image_id)
 
-    response = urllib2.urlopen(request)
-    response.read()
+    print 'Baked image %s, call up bees with "bees up -i %s".' % (image_id, image_id)
+    return image_id
 
-    print 'Organizing the swarm.'
-    # Spin up processes for connecting to EC2 instances
-    pool = Pool(len(params))
-    results = pool.map(_attack, params)
 
-    summarized_results = _summarize_results(results, params, csv_filename)
+def attack(url, n, c, **options):
+    """
+    Test the root url of this site.
+    """
+    csv_filename = options.get("csv_filename", '')
+    timeseries_filename = options.get('timeseries_filename', '')
+    samples_filename = options.get('samples_filename', '')
+    samples_csv_filename = options.get('samples_csv_filename', '')
+
+    if csv_filename:
+        try:
+            stream = open(csv_filename, 'w')
+        except IOError, e:
+            raise IOError("Specified csv_filename='%s' is not writable. Check permissions or specify a different filename and try again." % csv_filename)
+
+    if timeseries_filename:
+        try:
+            open(timeseries_filename, 'w').close()
+        except IOError, e:
+            raise IOError("Specified timeseries_filename='%s' is not writable. Check permissions or specify a different filename and try again." % timeseries_filename)
+
+    if samples_filename:
+        try:
+            # the samples of all bees are appended to it as they come in
+            open(samples_filename, 'w').close()
+        except IOError, e:
+            raise IOError("Specified samples_filename='%s' is not writable. Check permissions or specify a different filename and try again." % samples_filename)
+
+    if samples_csv_filename:
+        try:
+            open(samples_csv_filename, 'w').close()
+        except IOError, e:
+            raise IOError("Specified samples_csv_filename='%s' is not writable. Check permissions or specify a different filename and try again." % samples_csv_filename)
+
+    if options.get('gate') and options['gate'] != 'previous':
+        # only a previous run may be missing, without the baseline asked for the gate means nothing
+        store = history.RunStore()
+        try:
+            _find_baseline(store, None, options['gate'])
+        except ValueError, e:
+            print 'bees: error: %s' % e
+            sys.exit(1)
+        finally:
+            store.close()
+
+    swarm = _assemble_swarm()
+    if swarm is None:
+        return
+
+    username, key_name, instances = swarm
+    summarized_results = _fight(url, n, c, username, key_name, instances, options)
+    if summarized_results is None:
+        if options.get('gate'):
+            # an attack that didn't happen passes no gate
+            sys.exit(1)
+        return
+
     print 'Offensive complete.'
     _print_results(summarized_results)
 
+    gate_failure = None
+    if summarized_results['num_complete_bees']:
+        run = _record_run(url, n, c, options, instances, summarized_results)
+        if run is not None:
+            print 'Stored as run %i, see "bees history".' % run.id
+            if options.get('gate') and _check_gate(run, options['gate'], options.get('tolerances')) is False:
+                gate_failure = 'Your targets performance regressed significantly.'
+        elif options.get('gate'):
+            gate_failure = 'bees: error: the run is not in the history, so it can\'t pass the gate.'
+    elif options.get('gate'):
+        gate_failure = 'bees: error: no bee completed the attack, so it can\'t pass the gate.'
+
     print 'The swarm is awaiting new orders.'
 
+    if gate_failure:
+        print gate_failure
+        sys.exit(1)
+
     if 'performance_accepted' in summarized_results:
         if summarized_results['performance_accepted'] is False:
             print("Your targets performance tests did not meet our standard.")
@@ -539,4 +1571,3 @@ def attack(url, n, c, **options):
         else:
             print('Your targets performance tests meet our standards, the Queen sends her regards.')
             sys.exit(0)
-
@@ -14,16 +14,23 @@
 
 * output is logged instead of printed
 """
+import json
 import logging
-from multiprocessing import Pool
 import os
 import traceback
+import uuid
 
 import boto.ec2
 from plumbum.path import LocalPath, LocalWorkdir
-import plumbum.path.utils as plumbum_utils
 
+import agent
+import drivers
+from dispatch import Dispatcher, DEFAULT_FAN_OUT
+import hive
 import lib as beelib
+import localhive
+import payloads
+import profiles
 
 
 log = logging.getLogger('bees')
@@ -38,30 +45,33 @@ class Beekeeper(object):
 
     def up(self):
         self._find_bees()
+        if any(bee.state != 'running' for bee in self.swarm.instances):
+            self._wake_bees()
 
     def attack(self):
         instances = self.swarm.instances
         numInstances = len(instances)
-        pool = Pool(numInstances)
+        dispatcher = Dispatcher(self.cnf.fanOut)
+        DISTRIBUTOR.limit(self.cnf.uploadRate and self.cnf.uploadRate * 1024)
         battlePacks = []
-        for bee in instances:
-            fqdn = bee.public_dns_name
-            keyPath = self.cnf.KEY_PATH
-            username = self.cnf.username
-            battlePlan = BattlePlan(fqdn, keyPath, username,
-                                    armySize=numInstances)
-            battleCry = battlePlan.contrive()
-            log.info("bee %s will shout %s", bee.id, battleCry)
-            pack = BattlePack(beeId=bee.id, fqdn=fqdn, keyPath=keyPath,
-                              username=username, battleCry=battleCry)
+        for beeIndex, bee in enumerate(instances):
+            pack = BattlePack(beeId=bee.id, fqdn=bee.public_dns_name,
+                              keyPath=self.cnf.KEY_PATH,
+                              username=self.cnf.username,
+                              armySize=numInstances, beeIndex=beeIndex,
+                              throttle=dispatcher.throttle)
             battlePacks.append(pack)
-        results = pool.map(battlefield, battlePacks)
+        results = dispatcher.map(battlefield, battlePacks)
         for result in results:
             print beelib.oa(result)
 
-    def down(self):
+    def down(self, stop=False):
+        """terminate the swarm - or only stop it, the next up wakes it"""
         self._find_bees(nocreate=True)
-        self._scatter_bees()
+        if stop:
+            self._rest_bees()
+        else:
+            self._scatter_bees()
 
     def _find_bees(self, nocreate=False):
         if self.cnf.activeSwarmId:
@@ -84,18 +94,13 @@ class Beekeeper(object):
     def _weaponize_bees(self):
         log.info('waiting for bees to load their machine guns... ')
         instances = self.swarm.instances
-        while True:
-            beesIds = self.get_flying_bees_ids(instances)
-            beeCount = len(beesIds)
-            if len(beesIds) == len(instances):
-                self._connection.create_tags(beesIds, {"Name": "a bee!"})
-                self.cnf.activeSwarmId = self.swarm.id
-                self.cnf.save()
-                log.info('bees ready to attack: %s', beeCount)
-                print
-                break
-
-            print '.',
+        for bee in hive.wait_for_bees(self._connection, instances):
+            log.info('bee %s is ready', bee.id)
+        beesIds = [bee.id for bee in instances]
+        self._connection.create_tags(beesIds, {"Name": "a bee!"})
+        self.cnf.activeSwarmId = self.swarm.id
+        self.cnf.save()
+        log.info('bees ready to attack: %s', len(beesIds))
 
     def _invite_new_bee_friends(self):
         log.info("arming the bees ...")
@@ -116,6 +121,23 @@ class Beekeeper(object):
             if swarm.id == self.cnf.activeSwarmId:
                 return swarm
 
+    def _wake_bees(self):
+        log.info('waking up the resting bees ...')
+        ids = [bee.id for bee in self.swarm.instances]
+        # started bees get new addresses, so the swarm takes the fresh ones
+        self.swarm.instances = hive.wake(
+            self._connection, ids,
+            ready=lambda bee: log.info('bee %s is ready', bee.id))
+        if len(self.swarm.instances) < len(ids):
+            log.warning("%s bees are lost",
+                        len(ids) - len(self.swarm.instances))
+
+    def _rest_bees(self):
+        """stop the swarm - it stays the active one"""
+        ids = sorted([i.id for i in self.swarm.instances])
+        log.info('rest swarm %s', ids)
+        self._connection.stop_instances(instance_ids=ids)
+
     def _scatter_bees(self):
         """call off the swarm"""
         ids = sorted([i.id for i in self.swarm.instances])
@@ -128,12 +150,10 @@ class Beekeeper(object):
         self.cnf.save()
 
     def get_flying_bees_ids(self, instances):
-        instanceIds = []
-        for instance in instances:
-            instance.update()
-            if instance.state == 'running':
-                instanceIds.append(instance.id)
-        return instanceIds
+        described = hive.describe_bees(
+            self._connection, [instance.id for instance in instances])
+        return [instance.id for instance in described
+                if instance.state == 'running']
 
     def healthcheck(self):
         if not self.cnf.KEY_PATH:
@@ -142,25 +162,35 @@ class Beekeeper(object):
 
     def _get_connection(self, region):
         """ec2 connection object for commanding the swarm"""
+        if region == localhive.LOCAL_ZONE:
+            return localhive.LocalConnection()
+
         return boto.ec2.connect_to_region(region)
 
 
 class BattlePack(object):
-    """All a bee needs for battle on the other side of the process border"""
-    def __init__(self, beeId, fqdn, keyPath, username, battleCry):
+    """All a bee needs to prepare for battle and fight it in its thread"""
+    def __init__(self, beeId, fqdn, keyPath, username, armySize, throttle,
+                 beeIndex=0):
         self.beeId = beeId
         self.fqdn = fqdn
-        # stringify keyPath: multiprocessing borks on LocalPath objects
         self.keyPath = str(keyPath)
         self.username = username
-        self.battleCry = battleCry
+        self.armySize = armySize
+        self.beeIndex = beeIndex
+        self.throttle = throttle
 
 
 def battlefield(p):
-    """let the bee do the battle cry in an independent process"""
+    """let the bee contrive and do the battle cry (run by a Dispatcher)"""
     try:
-        bw = beelib.BeeWhisperer(p.fqdn, p.keyPath, p.username)
-        return bw.remote[p.battleCry.command](p.battleCry.specifics)
+        with p.throttle():
+            battlePlan = BattlePlan(p.fqdn, p.keyPath, p.username,
+                                    armySize=p.armySize, beeIndex=p.beeIndex)
+            battleCry = battlePlan.contrive()
+        log.info("bee %s will shout %s", p.beeId, battleCry)
+        with battlePlan.using_remote() as remote:
+            return remote[battleCry.command](battleCry.specifics)
     except:
         return traceback.format_exc()
 
@@ -180,7 +210,9 @@ class Config(beelib.BeeBrain):
         subnetId='',
         keyPath=None,
         username='newsapps',
-        activeSwarmId=None)
+        activeSwarmId=None,
+        fanOut=DEFAULT_FAN_OUT,
+        uploadRate=None)
 
     def __init__(self):
         super(Config, self).__init__(self.NAME)
@@ -195,15 +227,23 @@ class Config(beelib.BeeBrain):
         self._keyExt = self.DEFAULT_KEY_EXT
         self.username = self.DEFAULTS['username']
         self.activeSwarmId = self.DEFAULTS['activeSwarmId']
+        self.fanOut = self.DEFAULTS['fanOut']
+        self.uploadRate = self.DEFAULTS['uploadRate']  # KB/s
         self.load()
 
     @beelib.cached_property
     def REGION(self):
         """ region = zone without last letter """
+        if self.zone == localhive.LOCAL_ZONE:
+            return self.zone
+
         return self.zone[:-1]
 
     @beelib.cached_property
     def KEY_PATH(self):
+        if self.zone == localhive.LOCAL_ZONE:
+            return LocalPath(os.devnull)  # local bees need no key
+
         for candidate in self.KEY_SEARCH_PATHS:
             if candidate.exists():
                 return candidate
@@ -226,6 +266,10 @@ class Config(beelib.BeeBrain):
         return "%s-%s" % (self.KEY_NAME_PREFIX, self.REGION)
 
 
+DISTRIBUTOR = payloads.Distributor()
+"""knows which payloads the bees hold - shared by all battle plans"""
+
+
 class BattlePlan(beelib.BeeBrain, beelib.BeeWhisperer):
     NAME = 'bees_battle_plan.json'
     DEFAULTS = dict(
@@ -235,9 +279,18 @@ class BattlePlan(beelib.BeeBrain, beelib.BeeWhisperer):
         url='http://update-bridge-oliver-y5rxgpaear.elasticbeanstalk.com/',
         postfilePath='bees_post_data.json',
         mimeType='application/json;charset=UTF-8',
-        additionalOptions=['-r'])
-
-    def __init__(self, fqdn, keyFilePath, username, armySize):
+        additionalOptions=['-r'],
+        pipeline=1,
+        rate=None,
+        profile=None,
+        scenarioPath=None)
+    ENGINE = 'engine'
+    """command selecting the built-in engine (run by the agent) over ab"""
+    DIRECT = 'ab'
+    """the load generator that runs without the agent (if there is no
+    profile) - the others run through their driver (see :mod:`drivers`)"""
+
+    def __init__(self, fqdn, keyFilePath, username, armySize, beeIndex=0):
         beelib.BeeBrain.__init__(self, self.NAME)
         beelib.BeeWhisperer.__init__(self, fqdn, keyFilePath, username)
         self.url = self.DEFAULTS['url']
@@ -245,9 +298,17 @@ class BattlePlan(beelib.BeeBrain, beelib.BeeWhisperer):
         self.numberOfRequests = float(self.DEFAULTS['numberOfRequests'])
         self.concurrency = float(self.DEFAULTS['concurrency'])
         self.armySize = armySize
+        self.beeIndex = beeIndex
         self.postfilePath = self.DEFAULTS['postfilePath']
         self.mimeType = self.DEFAULTS['mimeType']
         self.additionalOptions = self.DEFAULTS['additionalOptions']
+        self.pipeline = self.DEFAULTS['pipeline']
+        self.rate = self.DEFAULTS['rate']
+        """requests per second of the whole swarm (engine only)"""
+        self.profile = self.DEFAULTS['profile']
+        """load profile declaration - see :mod:`profiles` (replaces -n/-c)"""
+        self.scenarioPath = self.DEFAULTS['scenarioPath']
+        """weighted mix of requests - see :mod:`scenarios` (replaces url)"""
         self.load()
         self.post_process()
         self._battleCry = BattleCry(self.command)
@@ -255,27 +316,79 @@ class BattlePlan(beelib.BeeBrain, beelib.BeeWhisperer):
     def post_process(self):
         if not os.path.isabs(self.postfilePath):
             self.postfilePath = self._workPath / self.postfilePath
+        if self.scenarioPath and not os.path.isabs(self.scenarioPath):
+            self.scenarioPath = self._workPath / self.scenarioPath
 
     def contrive(self):
-        instanceRequests = int(self.numberOfRequests / self.armySize)
-        instanceConcurrency = int(float(self.concurrency) / self.armySize)
-        self._battleCry.clarify(['-n', str(instanceRequests)])
-        self._battleCry.clarify(['-c', str(instanceConcurrency)])
-        self._create_exchange_file()
+        if self.command not in drivers.NAMES:
+            raise beelib.BeeSting("unknown load generator %s (one of %s)",
+                                  self.command, ', '.join(drivers.NAMES))
+
+        if self.scenarioPath and self.command != self.ENGINE:
+            raise beelib.BeeSting(
+                "scenarios need the engine, not %s", self.command)
+
+        if self.command != self.DIRECT or self.profile:
+            self._arm_agent()
+        if not self.profile:
+            # the first bees take one more if it doesn't divide evenly
+            instanceRequests = profiles.split(
+                int(self.numberOfRequests), self.armySize)[self.beeIndex]
+            instanceConcurrency = profiles.split(
+                int(self.concurrency), self.armySize)[self.beeIndex]
+            self._battleCry.clarify(['-n', str(instanceRequests)])
+            self._battleCry.clarify(['-c', str(instanceConcurrency)])
+        if self.command == self.DIRECT:
+            self._create_exchange_file()
         self._battleCry.clarify(self.additionalOptions)
         if self.postfilePath:
             self._prepare_post()
-        self._battleCry.clarify(self.url)
+        if self.scenarioPath:
+            self._prepare_scenario()
+        else:
+            self._battleCry.clarify(self.url)
         return self._battleCry
 
+    def _arm_agent(self):
+        """engine and profiles are run by the agent - make sure the bee has it"""
+        bundle = payloads.Payload(
+            agent.build_bundle(), name='agent', suffix='.zip')
+        DISTRIBUTOR.ensure(
+            self._sshKey, payloads.PlumbumTarget(self.remote), [bundle])
+        self._battleCry = BattleCry('python3')
+        self._battleCry.clarify([bundle.remotePath])
+        if self.profile:
+            stages = [stage.share(self.armySize, self.beeIndex).asDict
+                      for stage in profiles.expand(self.profile)]
+            self._battleCry.clarify(['--stages', json.dumps(stages)])
+        self._battleCry.clarify([self.command])
+        if self.command == self.ENGINE:
+            self._battleCry.clarify(['--pipeline', str(self.pipeline)])
+        if self.command == self.ENGINE and self.rate and not self.profile:
+            self._battleCry.clarify(
+                ['--rate', str(float(self.rate) / self.armySize)])
+
+    def _prepare_scenario(self):
+        payload = payloads.load(self.scenarioPath, suffix='.json')
+        DISTRIBUTOR.ensure(
+            self._sshKey, payloads.PlumbumTarget(self.remote), [payload])
+        # in place of the url - the agent puts the load of the stages before
+        # the last argument
+        self._battleCry.clarify(['--scenario', payload.remotePath,
+                                 '--seed', str(self.beeIndex), '--'])
+
     def _create_exchange_file(self):
-        tmpFilePath = self.remote['mktemp']().strip()
-        self._battleCry.clarify(['-e', tmpFilePath])
+        # named here rather than by a remote mktemp (a round trip) - ab
+        # creates it
+        self._battleCry.clarify(
+            ['-e', '/tmp/bees_ab_%s.csv' % uuid.uuid4().hex])
 
     def _prepare_post(self):
-        plumbum_utils.copy(self.postfilePath, self.remote.cwd)
+        payload = payloads.load(self.postfilePath)
+        DISTRIBUTOR.ensure(
+            self._sshKey, payloads.PlumbumTarget(self.remote), [payload])
         self._battleCry.clarify(['-T', self.mimeType, '-p',
-                                self.postfilePath.basename])
+                                payload.remotePath])
 
 
 class BattleCry(object):
@@ -0,0 +1,145 @@
+"""Driving the whole swarm from one process
+
+Bees spend nearly all of their time waiting for ssh, so there is no point in
+forking a process per bee: a thread with a small stack per bee does the same
+job for a fraction of the memory and without pickling anything.
+
+The expensive parts of the lifecycle (handshakes, uploads) are gated by a
+semaphore, so a thousand bees don't all hammer the CPU (and sshd's
+MaxStartups) at the same moment.
+"""
+import contextlib
+import logging
+import sys
+import threading
+import time
+
+
+log = logging.getLogger('bees.dispatch')
+
+DEFAULT_FAN_OUT = 64
+"""bees that may be connecting/uploading at the same time"""
+THREAD_STACK_SIZE = 256 * 1024
+"""plenty for waiting on sockets - the default is 8 MB on most linuxes"""
+
+
+class Dispatcher(object):
+    def __init__(self, fanOut=DEFAULT_FAN_OUT, maxWorkers=None,
+                 stackSize=THREAD_STACK_SIZE):
+        """
+        :param fanOut: max. number of bees inside :meth:`throttle`
+        :param maxWorkers: max. number of items processed at the same
+            time by :meth:`map` (None: all of them - needed for attacks)
+        """
+        self.fanOut = fanOut
+        self.maxWorkers = maxWorkers
+        self.stackSize = stackSize
+        self._gate = threading.BoundedSemaphore(fanOut)
+
+    @contextlib.contextmanager
+    def throttle(self):
+        """wrap the expensive bits of a bee's lifecycle in this"""
+        with self._gate:
+            yield
+
+    def map(self, func, items):
+        """call func for every item concurrently; results in item order
+
+        Like ``Pool.map`` the first exception raised by `func` is re-raised
+        after all items have been processed.
+        """
+        items = list(items)
+        results = [None] * len(items)
+        errors = []
+        work = iter(enumerate(items))
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                with lock:
+                    try:
+                        index, item = next(work)
+                    except StopIteration:
+                        return
+
+                try:
+                    results[index] = func(item)
+                except Exception:
+                    log.debug("bee %s failed", index, exc_info=True)
+                    errors.append(sys.exc_info())
+
+        numWorkers = min(len(items), self.maxWorkers or len(items))
+        threads = []
+        oldStackSize = threading.stack_size(self.stackSize)
+        try:
+            for _ in range(numWorkers):
+                thread = threading.Thread(target=worker)
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+        finally:
+            threading.stack_size(oldStackSize)
+        for thread in threads:
+            thread.join()
+        if errors:
+            excType, excValue, excTraceback = errors[0]
+            raise excType, excValue, excTraceback
+
+        return results
+
+
+class StartBarrier(object):
+    """Release all bees at one common wall-clock instant
+
+    Every bee either arrives (it is prepared and waits for the start signal)
+    or withdraws (it failed on the way). When the last one is in, everybody
+    gets the same start time, `lead` seconds in the future, so the start
+    signal can reach all bees before it is due. Bees that are still not
+    prepared after `timeout` seconds are not waited for any longer - they
+    start as they arrive, which :attr:`missing` tells.
+    """
+    def __init__(self, parties, lead=1.0, timeout=120, clock=time.time):
+        self.parties = parties
+        self.lead = lead
+        self.timeout = timeout
+        self.startAt = None
+        self.missing = 0
+        """bees not waited for because the timeout forced the release"""
+        self._clock = clock
+        self._deadline = clock() + timeout
+        self._arrived = set()
+        self._withdrawn = set()
+        self._condition = threading.Condition()
+
+    def arrive(self, bee):
+        """wait for the others - returns the common start time"""
+        with self._condition:
+            self._arrived.add(bee)
+            self._maybe_release()
+            while self.startAt is None:
+                remaining = self._deadline - self._clock()
+                if remaining <= 0:
+                    self.missing = self.parties - len(self._arrived)
+                    log.warning("released after %s s without %s bees",
+                                self.timeout, self.missing)
+                    self._release()
+                    break
+
+                self._condition.wait(remaining)
+            return self.startAt
+
+    def withdraw(self, bee):
+        """bee won't make it (no-op if it arrived or withdrew already)"""
+        with self._condition:
+            if bee not in self._arrived and bee not in self._withdrawn:
+                self._withdrawn.add(bee)
+                self.parties -= 1
+                self._maybe_release()
+
+    def _maybe_release(self):
+        if self.startAt is None and len(self._arrived) >= self.parties:
+            self._release()
+
+    def _release(self):
+        self.startAt = self._clock() + self.lead
+        self._condition.notify_all()
@@ -0,0 +1,440 @@
+"""Load generator drivers - the tools a bee can attack with
+
+The swarm speaks ab: the agent gets ab's arguments (-n, -c, -t, -k, -H, -C,
+-A, -p, -T and the URL last) whichever tool it runs. A driver turns them
+into the command line of its tool, follows what the tool writes while it
+runs and makes one normalized result of it::
+
+    dict(exitCode=0, errors='',
+         summary=dict(complete_requests=..., failed_requests=...,
+                      requests_per_second=..., ms_per_request=...),
+         histogram=..., timeseries=..., startAt=..., startedAt=...)
+
+so the commander reads every tool the same way.
+
+A request failed if it got no response or a status of 400 and above
+(:func:`failed`) - whichever tool ran, so failed requests, the gate and the
+history mean the same for all of them:
+
+* ``ab`` - the arguments are its own; the numbers come from its report,
+  the latencies from its ``-g`` file (which has no failures). Its report
+  can't tell a redirect from an error, so for ab every non-2xx response
+  counts (ab's length mismatches don't)
+* ``wrk`` - runs for a time, a script stops each thread after its share of
+  -n and prints the percentiles the histogram is made from (so there is no
+  time series and no raw samples)
+* ``hey`` - writes one csv line per request, but only once it is done
+  (connection errors are not in there - with -n they are the requests
+  without a line)
+* ``engine`` - the built-in one (python 3), which reports like this anyway
+
+wrk and hey tell nothing while they run, so there is no live progress with
+them - only a heartbeat every progress interval that says the bee is busy.
+"""
+import base64
+import optparse
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+from beeswithmachineguns import samples
+from beeswithmachineguns.profiles import split
+from beeswithmachineguns.histogram import LatencyHistogram
+from beeswithmachineguns.timeseries import TimeSeries
+
+
+AB_HEARTBEAT = re.compile(r'Completed (\d+) requests')
+AB_MS_PER_REQUEST = re.compile(r'Time per request:\s+([0-9.]+) \[ms\] \(mean\)')
+AB_REQUESTS_PER_SECOND = re.compile(
+    r'Requests per second:\s+([0-9.]+) \[#/sec\] \(mean\)')
+AB_FAILED = re.compile(r'Failed requests:\s+([0-9]+)')
+AB_FAILED_AS = re.compile(
+    r'\(Connect: ([0-9]+), Receive: ([0-9]+), Length: [0-9]+, '
+    r'Exceptions: ([0-9]+)\)')
+AB_WRITE_ERRORS = re.compile(r'Write errors:\s+([0-9]+)')
+AB_NON_2XX = re.compile(r'Non-2xx responses:\s+([0-9]+)')
+AB_COMPLETE = re.compile(r'Complete requests:\s+([0-9]+)')
+WRK_PREFIX = 'BEES-WRK '
+WRK_PERCENTS = list(range(1, 100)) + [99.5, 99.9, 99.99, 100]
+WRK_LONGEST = 24 * 3600
+"""seconds wrk runs for if only -n is given - the script stops it"""
+WRK_SCRIPT = """
+local limits = {%(limits)s}
+local started = 0
+local answered = 0
+
+function setup(thread)
+  started = started + 1
+  thread:set("limit", limits[started] or 0)
+end
+
+function init(args)
+  %(body)s
+end
+
+%(response)s
+
+function done(summary, latency, requests)
+  local errors = summary.errors
+  io.write(string.format("%(prefix)stotal %%d %%d %%d\\n", summary.requests,
+    summary.duration, errors.connect + errors.read + errors.write +
+    errors.status + errors.timeout))
+  io.write(string.format("%(prefix)smean %%f\\n", latency.mean))
+  for _, percent in ipairs({%(percents)s}) do
+    io.write(string.format("%(prefix)sp %%g %%d\\n", percent,
+      latency:percentile(percent)))
+  end
+end
+"""
+WRK_LIMIT = """function response(status, headers, body)
+  answered = answered + 1
+  if answered >= limit then
+    wrk.thread:stop()
+  end
+end"""
+"""stops each thread after its share of -n - only with -n, as wrk reads
+the bodies if there is a response function"""
+WRK_POST = """local f = io.open("%(path)s", "rb")
+  wrk.method = "POST"
+  wrk.body = f:read("*a")
+  f:close()"""
+
+
+class _ArgumentParser(optparse.OptionParser):
+    def error(self, msg):
+        raise ValueError(msg)
+
+
+def failed(status):
+    """the rule every driver counts failed requests by"""
+    return status == samples.NO_STATUS or status >= 400
+
+
+def parse_args(args):
+    """ab's arguments -> options, URL"""
+    parser = _ArgumentParser(add_help_option=False)
+    parser.add_option('-n', dest='requests', type='int', default=None)
+    parser.add_option('-c', dest='concurrency', type='int', default=1)
+    parser.add_option('-t', dest='timelimit', type='float', default=None)
+    parser.add_option('-k', dest='keepAlive', action='store_true',
+                      default=False)
+    parser.add_option('-H', dest='headers', action='append', default=[])
+    parser.add_option('-C', dest='cookies', action='append', default=[])
+    parser.add_option('-A', dest='basicAuth')
+    parser.add_option('-p', dest='postFile')
+    parser.add_option('-T', dest='contentType')
+    parser.add_option('-r', dest='ignored', action='store_true')
+    options, args = parser.parse_args(args)
+    if len(args) != 1:
+        raise ValueError('exactly one URL needed, got %r' % args)
+
+    if options.requests is None and not options.timelimit:
+        options.requests = 1
+    return options, args[0]
+
+
+def headers(options):
+    """the headers of ab's -H, -C, -A and -T as ``Name: value``"""
+    result = list(options.headers)
+    if options.cookies:
+        result.append('Cookie: %s' % '; '.join(options.cookies))
+    if options.basicAuth:
+        credentials = base64.b64encode(options.basicAuth.encode('utf-8'))
+        result.append('Authorization: Basic %s' % credentials.decode('ascii'))
+    if options.postFile and options.contentType:
+        result.append('Content-Type: %s' % options.contentType)
+    return result
+
+
+def parse_ab_report(report):
+    """the numbers of ab's report - None if there are none"""
+    msPerRequest = AB_MS_PER_REQUEST.search(report)
+    if not msPerRequest:
+        return None
+
+    # without a response or not 2xx - a different length is no failure
+    failedAs = AB_FAILED_AS.search(report)
+    if failedAs:
+        failedRequests = sum(int(n) for n in failedAs.groups())
+    else:
+        failedRequests = int(AB_FAILED.search(report).group(1))
+    for pattern in (AB_WRITE_ERRORS, AB_NON_2XX):
+        match = pattern.search(report)
+        failedRequests += int(match.group(1)) if match else 0
+    return dict(
+        complete_requests=int(AB_COMPLETE.search(report).group(1)),
+        failed_requests=failedRequests,
+        requests_per_second=float(
+            AB_REQUESTS_PER_SECOND.search(report).group(1)),
+        ms_per_request=float(msPerRequest.group(1)))
+
+
+class Driver(object):
+    """runs one load generator and reads what it reports"""
+    name = None
+    silent = False
+    """the tool writes nothing until it is done - send heartbeats"""
+
+    def __init__(self, args):
+        """
+        :param args: ab's arguments, the URL last
+        """
+        self.args = list(args)
+        self.histogram = LatencyHistogram()
+        self.series = TimeSeries()
+        self.writer = None
+        self.progress = None
+        self.reported = 0
+        """requests already counted in the progress"""
+        self.failed = 0
+        self.startedAt = None
+
+    def command(self, workDir):
+        """the tool's command line - files can go to `workDir`"""
+        raise NotImplementedError
+
+    def follow(self, line):
+        """a line of the tool's output, as it comes - False if it is not
+        one the driver understands (those go to :meth:`finish`)"""
+        return False
+
+    def finish(self, output, workDir, elapsed):
+        """the summary (None if there is none) once the tool is done
+
+        :param output: the lines :meth:`follow` didn't understand
+        """
+        raise NotImplementedError
+
+    def record(self, at, latency, failed=False, status=samples.NO_STATUS):
+        """one request, sent at `at` (epoch seconds), that took `latency` ms"""
+        self.histogram.record(latency)
+        self.series.record(at, latency, failed)
+        self.failed += bool(failed)
+        if self.writer:
+            self.writer.record(at, latency, status)
+
+    def run(self, progress, release=None, samplesPath=None):
+        """run the tool - returns the normalized result
+
+        :param release: blocks until the tool may start (see
+            :func:`agent.wait_for_go`) and returns the intended start time
+        :param samplesPath: append the raw samples to this file
+        """
+        self.progress = progress
+        self.writer = samplesPath and samples.SampleWriter(samplesPath)
+        workDir = tempfile.mkdtemp(prefix='bees_')
+        try:
+            command = self.command(workDir)
+            startAt = release() if release else None
+            self.startedAt = time.time()
+            try:
+                process = subprocess.Popen(
+                    command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                    universal_newlines=True)
+            except OSError as e:
+                # most likely the tool isn't installed on this bee
+                return dict(exitCode=127, summary=None,
+                            errors='%s: %s' % (command[0], e),
+                            histogram=self.histogram.asDict,
+                            timeseries=self.series.asDict,
+                            startAt=startAt, startedAt=self.startedAt)
+
+            done = threading.Event()
+            if self.silent:
+                heart = threading.Thread(target=_beat, args=(progress, done))
+                heart.daemon = True
+                heart.start()
+            unread = []
+            try:
+                for line in iter(process.stdout.readline, ''):
+                    if not self.follow(line):
+                        unread.append(line)
+                exitCode = process.wait()
+            finally:
+                done.set()
+            summary = self.finish(''.join(unread), workDir,
+                                  time.time() - self.startedAt)
+        finally:
+            shutil.rmtree(workDir, ignore_errors=True)
+            if self.writer:
+                self.writer.close()
+        progress.add(complete=max(0, self.histogram.total - self.reported),
+                     failed=self.failed)
+        progress.maybe_emit(force=True)
+        return dict(exitCode=exitCode, summary=summary,
+                    errors=''.join(unread[-20:]) if exitCode or not summary
+                    else '',
+                    histogram=self.histogram.asDict,
+                    timeseries=self.series.asDict,
+                    startAt=startAt, startedAt=self.startedAt)
+
+    def _summary(self, complete, elapsed):
+        return dict(complete_requests=complete, failed_requests=self.failed,
+                    requests_per_second=complete / elapsed if elapsed else 0,
+                    ms_per_request=self.histogram.mean)
+
+
+class AbDriver(Driver):
+    name = 'ab'
+
+    def command(self, workDir):
+        self.gnuplotPath = os.path.join(workDir, 'ab.tsv')
+        return ['ab', '-r', '-g', self.gnuplotPath] + self.args
+
+    def follow(self, line):
+        match = AB_HEARTBEAT.search(line)
+        if not match:
+            return False
+
+        self.progress.add(complete=int(match.group(1)) - self.reported)
+        self.reported = int(match.group(1))
+        return True
+
+    def finish(self, output, workDir, elapsed):
+        if os.path.exists(self.gnuplotPath):
+            with open(self.gnuplotPath) as f:
+                next(f, None)  # header
+                for line in f:
+                    # starttime, seconds (epoch), ctime, dtime, ttime, wait
+                    fields = line.split('\t')
+                    if len(fields) > 4:
+                        self.record(int(fields[1]), float(fields[4]))
+        return parse_ab_report(output)
+
+
+class WrkDriver(Driver):
+    name = 'wrk'
+    silent = True
+    total = duration = mean = None
+
+    def command(self, workDir):
+        options, url = parse_args(self.args)
+        threads = min(options.concurrency, _cpu_count())
+        limits = ([] if options.timelimit else
+                  split(options.requests, threads))
+        scriptPath = os.path.join(workDir, 'bees.lua')
+        with open(scriptPath, 'w') as f:
+            f.write(WRK_SCRIPT % dict(
+                limits=', '.join(str(l) for l in limits),
+                body=WRK_POST % dict(path=str(options.postFile))
+                if options.postFile else '',
+                response=WRK_LIMIT if limits else '',
+                percents=', '.join('%g' % p for p in WRK_PERCENTS),
+                prefix=WRK_PREFIX))
+        command = ['wrk', '-c', str(options.concurrency), '-t', str(threads),
+                   '-d', '%gs' % (options.timelimit or WRK_LONGEST),
+                   '--timeout', '30s', '-s', scriptPath]
+        requestHeaders = headers(options)
+        if not options.keepAlive:
+            requestHeaders.append('Connection: close')
+        for header in requestHeaders:
+            command += ['-H', header]
+        return command + [url]
+
+    def follow(self, line):
+        if not line.startswith(WRK_PREFIX):
+            return False
+
+        words = line[len(WRK_PREFIX):].split()
+        if words[0] == 'total':
+            self.total, self.duration, self.failed = [int(w) for w in
+                                                      words[1:4]]
+        elif words[0] == 'mean':
+            self.mean = float(words[1]) / 1000
+        elif words[0] == 'p':
+            # as many requests as the percent covers, with its latency
+            percent, latency = float(words[1]), int(words[2]) / 1000.0
+            covered = int(round(self.total * percent / 100))
+            if covered > self.histogram.total:
+                self.histogram.record(latency, covered - self.histogram.total)
+        return True
+
+    def finish(self, output, workDir, elapsed):
+        if self.total is None:
+            return None
+
+        summary = self._summary(self.total, self.duration / 1e6)
+        summary['ms_per_request'] = self.mean
+        return summary
+
+
+class HeyDriver(Driver):
+    name = 'hey'
+    silent = True
+
+    def command(self, workDir):
+        options, url = parse_args(self.args)
+        command = ['hey', '-c', str(options.concurrency), '-o', 'csv']
+        if options.timelimit:
+            command += ['-z', '%gs' % options.timelimit]
+        else:
+            command += ['-n', str(options.requests)]
+        for header in headers(options):
+            command += ['-H', header]
+        if options.postFile:
+            command += ['-m', 'POST', '-D', options.postFile]
+        if not options.keepAlive:
+            command.append('-disable-keepalive')
+        return command + [url]
+
+    def follow(self, line):
+        # response-time,DNS+dialup,DNS,Request-write,Response-delay,
+        # Response-read,status-code,offset (seconds)
+        fields = line.split(',')
+        if len(fields) != 8 or not fields[6].isdigit():
+            return False
+
+        status = int(fields[6])
+        self.record(self.startedAt + float(fields[7]),
+                    float(fields[0]) * 1000, failed(status), status)
+        return True
+
+    def finish(self, output, workDir, elapsed):
+        if not self.histogram.total:
+            return None
+
+        options, _ = parse_args(self.args)
+        complete = self.histogram.total
+        if not options.timelimit and options.requests > complete:
+            # no line for the ones without a response
+            unanswered = options.requests - complete
+            self.failed += unanswered
+            self.series.record_failures(time.time(), unanswered)
+            complete = options.requests
+        return self._summary(complete, elapsed)
+
+
+class EngineDriver(Driver):
+    name = 'engine'
+
+    def run(self, progress, release=None, samplesPath=None):
+        from beeswithmachineguns import engine  # python 3 only
+        return engine.run(self.args, progress, release, samplesPath)
+
+
+DRIVERS = dict((d.name, d) for d in (AbDriver, WrkDriver, HeyDriver,
+                                     EngineDriver))
+NAMES = ('ab', 'wrk', 'hey', 'engine')
+
+
+def run(name, args, progress, release=None, samplesPath=None):
+    """run the load generator `name` with ab's `args` - the normalized
+    result (a generator for the agent, see :func:`agent.run_stages`)"""
+    return DRIVERS[name](args).run(progress, release, samplesPath)
+
+
+def _beat(progress, done):
+    while not done.wait(progress.interval):
+        progress.maybe_emit(force=True)
+
+
+def _cpu_count():
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
@@ -0,0 +1,508 @@
+"""The bees' own load generator
+
+asyncio based, one worker process per core, HTTP/1.1 with keep-alive and
+optional pipelining. Understands the options of ab that the bees use (plus a
+few of its own), so the commander builds the same command line for both::
+
+    python bees_agent.zip engine -n 10000 -c 100 -k --pipeline 4 http://x/
+
+A request failed if it got no response or a status of 400 and above, as
+with every other load generator (see :mod:`drivers`).
+
+With ``--scenario`` it draws every request from a weighted mix of endpoints
+(see :mod:`scenarios`) and reports the numbers per endpoint, too.
+
+With ``--rate`` it works open loop: requests are due at a constant rate no
+matter how fast the target answers, and each latency is measured from the
+moment the request was due, not from when a connection was free to send it.
+That way a slow target shows up as queueing delay in the percentiles instead
+of silently lowering the load (coordinated omission).
+
+Runs on the bees as part of the agent bundle and needs python 3.5+ there
+(uses uvloop if the bee has it).
+"""
+import asyncio
+import base64
+import functools
+import multiprocessing
+import optparse
+import os
+import random
+import ssl
+import time
+import traceback
+from queue import Empty
+from urllib.parse import urlsplit
+
+from beeswithmachineguns import drivers, samples, scenarios
+from beeswithmachineguns.histogram import LatencyHistogram
+from beeswithmachineguns.profiles import split
+from beeswithmachineguns.timeseries import TimeSeries
+
+
+DEFAULT_TIMEOUT = 30
+WORKER_POLL = 1.0
+"""seconds between looks at the worker processes while waiting for them"""
+UNLIMITED = 2 ** 62
+"""number of requests when only a time limit is given"""
+NETWORK_ERRORS = (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError,
+                  asyncio.LimitOverrunError, ValueError)
+
+
+class Target(object):
+    """where to send what - the request is rendered once, sent many times"""
+    def __init__(self, url, headers=(), body=None, contentType=None,
+                 keepAlive=False, method=None):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.tls = parts.scheme == 'https'
+        self.port = parts.port or (443 if self.tls else 80)
+        self.address = (self.host, self.port, self.tls)
+        self.keepAlive = keepAlive
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        method = method or ('POST' if body is not None else 'GET')
+        self.method = method
+        lines = ['%s %s HTTP/1.1' % (method, path),
+                 'Host: %s' % parts.netloc,
+                 'User-Agent: beeswithmachineguns',
+                 'Accept: */*']
+        if not keepAlive:
+            lines.append('Connection: close')
+        if body is not None:
+            lines.append('Content-Type: %s' % (contentType or 'text/plain'))
+            lines.append('Content-Length: %s' % len(body))
+        lines.extend(headers)
+        self.request = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+        if body is not None:
+            self.request += body
+
+    def open_connection(self):
+        context = ssl.create_default_context() if self.tls else None
+        if context:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        return asyncio.open_connection(self.host, self.port, ssl=context)
+
+
+async def read_response(reader, head=False):
+    """read one response, return (status, connection still usable)
+
+    :param head: the request was a HEAD - the response has no body
+    """
+    lines = (await reader.readuntil(b'\r\n\r\n')).split(b'\r\n')
+    version, status = lines[0].split(None, 2)[:2]
+    status = int(status)
+    if 100 <= status < 200 and status != 101:
+        # an interim response, the real one follows
+        return await read_response(reader, head)
+
+    keepAlive = version == b'HTTP/1.1'
+    length = None
+    chunked = False
+    for line in lines[1:]:
+        name, _, value = line.partition(b':')
+        name = name.strip().lower()
+        value = value.strip().lower()
+        if name == b'content-length':
+            length = int(value)
+        elif name == b'transfer-encoding':
+            chunked = value == b'chunked'
+        elif name == b'connection':
+            keepAlive = value == b'keep-alive'
+    if head or status < 200 or status in (204, 304):
+        pass  # no body, whatever the headers say
+    elif chunked:
+        while True:
+            size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+            if not size:
+                while await reader.readuntil(b'\r\n') != b'\r\n':
+                    pass  # trailers
+                break
+
+            await reader.readexactly(size + 2)
+    elif length is not None:
+        await reader.readexactly(length)
+    else:
+        # a body without a length ends with the connection
+        await reader.read()
+        keepAlive = False
+    return status, keepAlive
+
+
+class Worker(object):
+    """one event loop driving `concurrency` connections"""
+    def __init__(self, targets, numRequests, concurrency, pipeline=1,
+                 timeout=DEFAULT_TIMEOUT, rate=None, duration=None,
+                 pick=None, samples=None):
+        """
+        :param targets: list of :class:`Target` - usually just one
+        :param rate: requests per second (open loop) - None: closed loop
+        :param duration: seconds after which no new requests are sent
+        :param pick: returns the index of the target for the next request
+        :param samples: :class:`samples.SampleWriter` for the raw samples
+        """
+        self.targets = targets
+        self.pick = pick or (lambda: 0)
+        self.samples = samples
+        self.numRequests = numRequests
+        self.remaining = numRequests
+        self.concurrency = concurrency
+        self.pipeline = pipeline if targets[0].keepAlive and not rate else 1
+        self.timeout = timeout
+        self.rate = rate
+        self.duration = duration
+        self.deadline = None
+        self.backlog = 0
+        """max. number of due requests waiting for a free connection"""
+        self.complete = 0
+        self.failed = 0
+        self.histogram = LatencyHistogram()
+        self.window = LatencyHistogram()
+        """latencies since the last progress report"""
+        self.timeseries = TimeSeries()
+        self.epoch = time.time() - time.perf_counter()
+        """add to a perf_counter() time to get the time of the clock"""
+        self.endpoints = None
+        """complete, failed and histogram per target (if more than one)"""
+        if len(targets) > 1:
+            self.endpoints = [dict(complete=0, failed=0,
+                                   histogram=LatencyHistogram())
+                              for _ in targets]
+
+    def record(self, index, status, latency, sentAt):
+        """:param sentAt: perf_counter() time the request was (due to be) sent"""
+        self.complete += 1
+        failed = drivers.failed(status)
+        if failed:
+            self.failed += 1
+        self.histogram.record(latency)
+        self.window.record(latency)
+        self.timeseries.record(self.epoch + sentAt, latency, failed)
+        if self.samples:
+            self.samples.record(self.epoch + sentAt, latency, status)
+        if self.endpoints:
+            endpoint = self.endpoints[index]
+            endpoint['complete'] += 1
+            endpoint['failed'] += failed
+            endpoint['histogram'].record(latency)
+
+    def record_errors(self, index, count):
+        self.complete += count
+        self.failed += count
+        now = time.time()
+        self.timeseries.record_failures(now, count)
+        if self.samples:
+            for _ in range(count):
+                self.samples.record(now, 0, samples.NO_STATUS)
+        if self.endpoints:
+            self.endpoints[index]['complete'] += count
+            self.endpoints[index]['failed'] += count
+
+    async def run(self):
+        if self.duration:
+            self.deadline = time.perf_counter() + self.duration
+        if self.rate:
+            due = asyncio.Queue()
+            await asyncio.gather(self.schedule(due), *[
+                self.connection(due) for _ in range(self.concurrency)])
+        else:
+            await asyncio.gather(*[self.connection()
+                                   for _ in range(self.concurrency)])
+
+    async def schedule(self, due):
+        """put the intended send time of every request into `due` on time"""
+        start = time.perf_counter()
+        scheduled = 0
+        numRequests = self.numRequests
+        if self.duration:
+            numRequests = min(numRequests, int(self.duration * self.rate))
+        while scheduled < numRequests:
+            now = time.perf_counter()
+            until = min(numRequests, int((now - start) * self.rate) + 1)
+            while scheduled < until:
+                due.put_nowait(start + scheduled / self.rate)
+                scheduled += 1
+            self.backlog = max(self.backlog, due.qsize())
+            await asyncio.sleep(start + scheduled / self.rate - now)
+        for _ in range(self.concurrency):
+            due.put_nowait(None)
+
+    async def connection(self, due=None):
+        """requests one after the other (pipelined: the same one in a batch)"""
+        reader = writer = address = None
+        while True:
+            if due is not None:
+                intended = await due.get()
+                if intended is None:
+                    break
+
+                batch = 1
+            elif self.remaining > 0 and not self.expired:
+                batch = min(self.pipeline, self.remaining)
+                self.remaining -= batch
+            else:
+                break
+
+            index = self.pick()
+            target = self.targets[index]
+            answered = 0
+            keepAlive = False
+            try:
+                if writer is not None and address != target.address:
+                    writer.close()
+                    writer = None
+                if writer is None:
+                    reader, writer = await asyncio.wait_for(
+                        target.open_connection(), self.timeout)
+                    address = target.address
+                start = time.perf_counter() if due is None else intended
+                writer.write(target.request * batch)
+                while answered < batch:
+                    status, keepAlive = await asyncio.wait_for(
+                        read_response(reader, target.method == 'HEAD'),
+                        self.timeout)
+                    keepAlive = keepAlive and target.keepAlive
+                    self.record(index, status,
+                                (time.perf_counter() - start) * 1000, start)
+                    answered += 1
+                    if not keepAlive:
+                        break
+
+                # the server may close early - unanswered ones go back
+                if due is None:
+                    self.remaining += batch - answered
+            except NETWORK_ERRORS:
+                self.record_errors(index, batch - answered)
+                keepAlive = False
+            if not keepAlive and writer is not None:
+                writer.close()
+                writer = None
+        if writer is not None:
+            writer.close()
+
+    @property
+    def expired(self):
+        return self.deadline is not None and time.perf_counter() >= self.deadline
+
+    async def report(self, queue, interval):
+        lastComplete = lastFailed = 0
+        while True:
+            await asyncio.sleep(interval)
+            window, self.window = self.window, LatencyHistogram()
+            queue.put(('progress', (self.complete - lastComplete,
+                                    self.failed - lastFailed,
+                                    window.asDict)))
+            lastComplete, lastFailed = self.complete, self.failed
+
+
+def _work(targets, table, numRequests, concurrency, options, queue, go,
+          seed, samplesPath=None):
+    """body of a worker process - starts when `go` is set, puts its result
+    (or what went wrong) on `queue`
+
+    :param table: :class:`scenarios.AliasTable` to pick the targets with
+    :param samplesPath: file of its own for the raw samples
+    """
+    try:
+        _attack(targets, table, numRequests, concurrency, options, queue, go,
+                seed, samplesPath)
+    except Exception:
+        queue.put(('error', traceback.format_exc()))
+
+
+def _attack(targets, table, numRequests, concurrency, options, queue, go,
+            seed, samplesPath):
+    try:
+        import uvloop
+        loop = uvloop.new_event_loop()
+    except ImportError:
+        loop = asyncio.new_event_loop()
+    rate = options.rate and options.rate * numRequests / options.requests
+    pick = None
+    if table is not None:
+        pick = functools.partial(table.pick, random.Random(seed).random)
+    writer = samplesPath and samples.SampleWriter(samplesPath)
+    worker = Worker(targets, numRequests, concurrency, options.pipeline,
+                    options.timeout, rate, options.timelimit, pick, writer)
+    go.wait()
+    reporter = loop.create_task(worker.report(queue, options.interval))
+    start = time.time()
+    loop.run_until_complete(worker.run())
+    end = time.time()
+    reporter.cancel()
+    if writer:
+        writer.close()
+    endpoints = worker.endpoints and [
+        dict(e, histogram=e['histogram'].asDict) for e in worker.endpoints]
+    queue.put(('result', dict(
+        complete=worker.complete, failed=worker.failed, start=start,
+        end=end, backlog=worker.backlog, histogram=worker.histogram.asDict,
+        window=worker.window.asDict, endpoints=endpoints,
+        timeseries=worker.timeseries.asDict)))
+
+
+def parse_args(argv):
+    parser = optparse.OptionParser(
+        usage='%prog [options] URL|--scenario SCENARIO_FILE')
+    parser.add_option('-n', dest='requests', type='int', default=None)
+    parser.add_option('-c', dest='concurrency', type='int', default=1)
+    parser.add_option('-k', dest='keepAlive', action='store_true',
+                      default=False)
+    parser.add_option('-H', dest='headers', action='append', default=[])
+    parser.add_option('-C', dest='cookies', action='append', default=[])
+    parser.add_option('-A', dest='basicAuth')
+    parser.add_option('-p', dest='postFile')
+    parser.add_option('-T', dest='contentType')
+    parser.add_option('-t', dest='timelimit', type='float', default=None,
+                      help='seconds to send requests for (-n is a max. then)')
+    parser.add_option('-r', dest='ignored', action='store_true',
+                      help='accepted for compatibility with ab')
+    parser.add_option('--pipeline', type='int', default=1,
+                      help='requests in flight per keep-alive connection')
+    parser.add_option('--workers', type='int', default=None,
+                      help='worker processes (default: one per core)')
+    parser.add_option('--timeout', type='float', default=DEFAULT_TIMEOUT)
+    parser.add_option('--rate', type='float', default=None,
+                      help='requests per second (open loop, latency counted '
+                           'from when each request was due)')
+    parser.add_option('--interval', type='float', default=1.0)
+    parser.add_option('--scenario', default=None,
+                      help='json file with a weighted mix of requests')
+    parser.add_option('--seed', type='int', default=None,
+                      help='seed for drawing from the mix')
+    options, args = parser.parse_args(argv)
+    if len(args) != (0 if options.scenario else 1):
+        parser.error('exactly one URL or a scenario needed')
+
+    if options.requests is None:
+        options.requests = UNLIMITED if options.timelimit else 1
+
+    return options, args[0] if args else None
+
+
+def build_targets(options, url):
+    """targets and the scenario they are drawn from (None: just the url)"""
+    headers = list(options.headers)
+    if options.cookies:
+        headers.append('Cookie: %s' % '; '.join(options.cookies))
+    if options.basicAuth:
+        credentials = base64.b64encode(options.basicAuth.encode('utf-8'))
+        headers.append('Authorization: Basic %s' % credentials.decode())
+    if options.scenario:
+        scenario = scenarios.load(options.scenario)
+        return [Target(e.url, headers + e.headers,
+                       None if e.body is None else e.body.encode('utf-8'),
+                       e.contentType, options.keepAlive, e.method)
+                for e in scenario.endpoints], scenario
+
+    body = None
+    if options.postFile:
+        with open(options.postFile, 'rb') as f:
+            body = f.read()
+    return [Target(url, headers, body, options.contentType,
+                   options.keepAlive)], None
+
+
+def run(argv, progress, release=None, samplesPath=None):
+    """run the engine, feeding `progress`; return the normalized result
+
+    :param release: blocks until the load may start and returns the intended
+        start time - the workers are forked before, so they start at once
+    :param samplesPath: append the raw samples to this file
+    """
+    options, url = parse_args(argv)
+    targets, scenario = build_targets(options, url)
+    table = scenario and scenario.table
+    numWorkers = min(options.workers or os.cpu_count() or 1,
+                     options.concurrency, options.requests)
+    queue = multiprocessing.Queue()
+    go = multiprocessing.Event()
+    # one file per worker, appended to the one asked for in the end
+    parts = [samplesPath and '%s.%i' % (samplesPath, index)
+             for index in range(numWorkers)]
+    workers = [multiprocessing.Process(
+        target=_work,
+        args=(targets, table, numRequests, concurrency, options, queue, go,
+              None if options.seed is None else options.seed * 1000 + index,
+              parts[index]))
+        for index, (numRequests, concurrency) in enumerate(zip(
+            split(options.requests, numWorkers),
+            split(options.concurrency, numWorkers)))]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+    startAt = release() if release else None
+    startedAt = time.time()
+    go.set()
+    results = []
+    reported = [0, 0]
+    error = None
+    while len(results) < len(workers) and error is None:
+        try:
+            kind, payload = queue.get(timeout=WORKER_POLL)
+        except Empty:
+            # a worker that died can't say so
+            dead = [w for w in workers if w.exitcode]
+            if dead or not any(w.is_alive() for w in workers):
+                error = 'worker process died (exit code %s)' % (
+                    dead[0].exitcode if dead else 0)
+            continue
+
+        if kind == 'progress':
+            complete, failed, window = payload
+            progress.add(complete, failed, LatencyHistogram.from_dict(window))
+            reported[0] += complete
+            reported[1] += failed
+        elif kind == 'error':
+            error = payload
+        else:
+            results.append(payload)
+    if error is not None:
+        for worker in workers:
+            worker.terminate()
+    for worker in workers:
+        worker.join()
+    for part in parts:
+        if part and os.path.exists(part):
+            if error is None:
+                samples.append(samplesPath, part)
+            os.remove(part)
+    if error is not None:
+        return dict(exitCode=1, errors=error, summary=None, endpoints=None,
+                    histogram=LatencyHistogram().asDict,
+                    timeseries=TimeSeries().asDict,
+                    startAt=startAt, startedAt=startedAt)
+
+    histogram = LatencyHistogram.merged(
+        LatencyHistogram.from_dict(r['histogram']) for r in results)
+    complete = sum(r['complete'] for r in results)
+    failed = sum(r['failed'] for r in results)
+    duration = max(r['end'] for r in results) - min(r['start'] for r in results)
+    progress.add(complete - reported[0], failed - reported[1],
+                 LatencyHistogram.merged(LatencyHistogram.from_dict(r['window'])
+                                         for r in results))
+    progress.maybe_emit(force=True)
+    endpoints = None
+    if scenario:
+        endpoints = scenarios.merge_endpoint_stats(
+            r['endpoints'] for r in results)
+        for endpoint, stats in zip(scenario.endpoints, endpoints):
+            stats['name'] = endpoint.name
+    series = TimeSeries.merged(
+        TimeSeries.from_dict(r['timeseries']) for r in results)
+    return dict(
+        exitCode=0,
+        endpoints=endpoints,
+        histogram=histogram.asDict,
+        timeseries=series.asDict,
+        startAt=startAt,
+        startedAt=startedAt,
+        summary=dict(
+            complete_requests=complete,
+            failed_requests=failed,
+            requests_per_second=complete / duration if duration else 0.0,
+            ms_per_request=histogram.mean,
+            intended_rate=options.rate,
+            max_backlog=max(r['backlog'] for r in results)))
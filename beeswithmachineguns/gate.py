@@ -0,0 +1,229 @@
+"""Statistical performance gate - is this run significantly worse?
+
+Compares the latest run with a baseline run from the history, metric by
+metric, each with a tolerance of its own::
+
+    p50=10%,p99=25%,rps=10%,failed=1%
+
+Latency percentiles and throughput are compared as the ratio latest /
+baseline, the failure rate as the difference in percentage points. For
+each a bootstrap confidence interval is calculated and a metric only counts
+as regressed if the whole interval is beyond the tolerance - so noise
+alone doesn't fail the gate, and neither does a change within the
+tolerance.
+
+The runs are resampled from what is stored anyway: the latencies from the
+histograms (Poisson bootstrap - every bucket count is drawn from a Poisson
+distribution with that count as mean, which is as good as resampling the
+requests one by one for the numbers of a load test), the throughput from
+the requests of each full second (resampled with replacement, so one bee
+is as good as many) and the failure rate from the counts. Runs without a
+time series (wrk) or too short for one fall back to resampling the
+throughput of their bees.
+"""
+import logging
+import math
+import random
+
+
+log = logging.getLogger('bees.gate')
+
+DEFAULT_TOLERANCES = dict(p50=0.10, p90=0.15, p99=0.25, rps=0.10,
+                          failed=0.01)
+ROUNDS = 1000
+CONFIDENCE = 0.95
+
+
+class Verdict(object):
+    def __init__(self, metric, baseline, latest, change, low, high,
+                 tolerance, regressed):
+        """
+        :param change: ratio latest / baseline (difference for failed)
+        :param low: lower end of the confidence interval of the change
+        :param high: upper end of the confidence interval of the change
+        """
+        self.metric = metric
+        self.baseline = baseline
+        self.latest = latest
+        self.change = change
+        self.low = low
+        self.high = high
+        self.tolerance = tolerance
+        self.regressed = regressed
+
+    def __repr__(self):
+        return '<Verdict %s %s [%s, %s]%s>' % (
+            self.metric, self.change, self.low, self.high,
+            ' REGRESSED' if self.regressed else '')
+
+
+def parse_tolerances(spec):
+    """``p50=10%,p99=0.25,rps=10%`` -> {'p50': 0.1, ...} (with defaults)"""
+    tolerances = dict(DEFAULT_TOLERANCES)
+    for setting in (spec or '').split(','):
+        if not setting.strip():
+            continue
+
+        name, _, value = setting.partition('=')
+        name, value = name.strip(), value.strip()
+        if name != 'rps' and name != 'failed' and not _is_percentile(name):
+            raise ValueError("unknown metric %r (p<percent>, rps or failed)" %
+                             name)
+
+        if value.endswith('%'):
+            tolerances[name] = float(value[:-1]) / 100
+        else:
+            tolerances[name] = float(value)
+        if tolerances[name] < 0:
+            raise ValueError("the tolerance of %s can't be negative: %s" %
+                             (name, value))
+    return tolerances
+
+
+def _is_percentile(name):
+    try:
+        return name.startswith('p') and 0 < float(name[1:]) <= 100
+    except ValueError:
+        return False
+
+
+def poisson(rand, mean):
+    if mean <= 0:
+        return 0
+
+    if mean > 30:
+        return max(0, int(round(rand.gauss(mean, math.sqrt(mean)))))
+
+    # Knuth
+    limit = math.exp(-mean)
+    count = 0
+    product = rand.random()
+    while product > limit:
+        count += 1
+        product *= rand.random()
+    return count
+
+
+class _Distribution(object):
+    """the buckets of a histogram, ready to be resampled"""
+    def __init__(self, histogram):
+        buckets = sorted(histogram.counts.items())
+        self.values = [0.0] + [histogram.bucket_value(i) for i, _ in buckets]
+        self.counts = [histogram.zeroCount] + [c for _, c in buckets]
+
+    def percentiles(self, percents, counts=None):
+        counts = self.counts if counts is None else counts
+        total = sum(counts)
+        if not total:
+            return [0.0] * len(percents)
+
+        results = []
+        for percent in percents:
+            rank = max(1, int(math.ceil(round(percent * total / 100.0, 6))))
+            seen = 0
+            for value, count in zip(self.values, counts):
+                seen += count
+                if seen >= rank:
+                    results.append(value)
+                    break
+        return results
+
+    def resample(self, rand):
+        return [poisson(rand, c) for c in self.counts]
+
+
+class _Throughput(object):
+    """the throughput of a run, ready to be resampled"""
+    def __init__(self, run):
+        # the first and the last second are only partly in the attack
+        perSecond = [float(c) for c in (run.perSecond or [])[1:-1]]
+        if len(perSecond) > 1 and sum(perSecond):
+            self.values = perSecond
+            self.scale = run.rps / (sum(perSecond) / len(perSecond))
+        else:
+            self.values = [b.rps for b in run.bees] or [run.rps]
+            self.scale = None
+
+    def resample(self, rand):
+        values = [rand.choice(self.values) for _ in self.values]
+        if self.scale is None:
+            # the throughput of the swarm is the sum of its bees'
+            return sum(values)
+
+        # how much the mean of the seconds varies, around the run's rps
+        return sum(values) / len(values) * self.scale
+
+
+def _interval(values, confidence):
+    values = sorted(values)
+    tail = (1 - confidence) / 2
+    low = values[int(tail * (len(values) - 1))]
+    high = values[int(math.ceil((1 - tail) * (len(values) - 1)))]
+    return low, high
+
+
+def _ratio(latest, baseline):
+    return latest / baseline if baseline else (1.0 if not latest else
+                                               float('inf'))
+
+
+def _failed_rate(failed, complete):
+    return float(failed) / complete if complete else 0.0
+
+
+def check(baseline, latest, tolerances=None, rounds=ROUNDS,
+          confidence=CONFIDENCE, seed=0):
+    """compare two runs (see :class:`history.Run`) - a verdict per metric"""
+    tolerances = DEFAULT_TOLERANCES if tolerances is None else tolerances
+    rand = random.Random(seed)
+    percentiles = sorted((float(name[1:]), name) for name in tolerances
+                         if _is_percentile(name))
+    percents = [p for p, _ in percentiles]
+    before = _Distribution(baseline.histogram)
+    after = _Distribution(latest.histogram)
+    beforeRps = _Throughput(baseline)
+    afterRps = _Throughput(latest)
+    ratios = dict((name, []) for _, name in percentiles)
+    ratios['rps'] = []
+    ratios['failed'] = []
+    for _ in range(rounds):
+        for (_, name), b, a in zip(
+                percentiles,
+                before.percentiles(percents, before.resample(rand)),
+                after.percentiles(percents, after.resample(rand))):
+            ratios[name].append(_ratio(a, b))
+        ratios['rps'].append(_ratio(afterRps.resample(rand),
+                                    beforeRps.resample(rand)))
+        ratios['failed'].append(
+            _resampled_failed_rate(rand, latest) -
+            _resampled_failed_rate(rand, baseline))
+
+    verdicts = []
+    for (_, name), b, a in zip(percentiles, before.percentiles(percents),
+                               after.percentiles(percents)):
+        low, high = _interval(ratios[name], confidence)
+        verdicts.append(Verdict(name, b, a, _ratio(a, b), low, high,
+                                tolerances[name],
+                                low > 1 + tolerances[name]))
+    if 'rps' in tolerances:
+        low, high = _interval(ratios['rps'], confidence)
+        verdicts.append(Verdict('rps', baseline.rps, latest.rps,
+                                _ratio(latest.rps, baseline.rps), low, high,
+                                tolerances['rps'],
+                                high < 1 - tolerances['rps']))
+    if 'failed' in tolerances:
+        low, high = _interval(ratios['failed'], confidence)
+        b = _failed_rate(baseline.failed, baseline.complete)
+        a = _failed_rate(latest.failed, latest.complete)
+        verdicts.append(Verdict('failed', b, a, a - b, low, high,
+                                tolerances['failed'],
+                                low > tolerances['failed']))
+    for verdict in verdicts:
+        log.debug("%s", verdict)
+    return verdicts
+
+
+def _resampled_failed_rate(rand, run):
+    failed = poisson(rand, run.failed)
+    ok = poisson(rand, run.complete - run.failed)
+    return _failed_rate(failed, failed + ok)
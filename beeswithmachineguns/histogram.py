@@ -0,0 +1,163 @@
+"""Compact latency histograms with a fixed relative error
+
+Values are sorted into logarithmic buckets: bucket ``i`` holds all values in
+``(gamma ** (i - 1), gamma ** i]`` with ``gamma = (1 + e) / (1 - e)``, so
+every value reported back is within the relative error ``e`` of the
+recorded one, no matter if it is 0.3 ms or 30 s.
+
+Only occupied buckets are stored, histograms from different bees are merged
+exactly by adding up their counts and any percentile can be read off in a
+single pass over the (few hundred) buckets.
+"""
+import collections
+import math
+
+
+DEFAULT_RELATIVE_ERROR = 0.01
+
+
+class LatencyHistogram(object):
+    def __init__(self, relativeError=DEFAULT_RELATIVE_ERROR):
+        if not 0 < relativeError < 1:
+            raise ValueError("relative error must be in (0, 1): %s" %
+                             relativeError)
+
+        self.relativeError = relativeError
+        self.counts = {}
+        """bucket index -> number of recorded values"""
+        self.zeroCount = 0
+        """values <= 0 (e.g. ab rounding very fast responses down)"""
+        self.sum = 0.0
+        self._gamma = (1 + relativeError) / (1 - relativeError)
+        self._logGamma = math.log(self._gamma)
+
+    def __len__(self):
+        return self.total
+
+    def __eq__(self, other):
+        return (isinstance(other, LatencyHistogram) and
+                self.relativeError == other.relativeError and
+                self.zeroCount == other.zeroCount and
+                self.counts == other.counts)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '<%s n=%s buckets=%s e=%s>' % (
+            self.__class__.__name__, self.total, len(self.counts),
+            self.relativeError)
+
+    @property
+    def total(self):
+        return self.zeroCount + sum(self.counts.values())
+
+    @property
+    def mean(self):
+        total = self.total
+        return self.sum / total if total else 0.0
+
+    def bucket_index(self, value):
+        return int(math.ceil(math.log(value) / self._logGamma))
+
+    def bucket_value(self, index):
+        """representative value of a bucket (within the relative error)"""
+        return 2 * self._gamma ** index / (self._gamma + 1)
+
+    def record(self, value, count=1):
+        self.sum += value * count
+        if value <= 0:
+            self.zeroCount += count
+            return
+
+        self.add_bucket(self.bucket_index(value), count)
+
+    def record_many(self, values):
+        """record a whole column of values (e.g. a typed array) at once -
+        they are mapped to their buckets and counted without a call into
+        python for each one"""
+        positive = list(filter((0.0).__lt__, values))
+        self.zeroCount += len(values) - len(positive)
+        self.sum += math.fsum(values)
+        # the same as bucket_index: log(value) / log(gamma), rounded up
+        indices = map(int, map(math.ceil, map(
+            self._logGamma.__rtruediv__, map(math.log, positive))))
+        for index, count in collections.Counter(indices).items():
+            self.add_bucket(index, count)
+
+    def add_bucket(self, index, count):
+        """add `count` values to the bucket `index` - the one place counts
+        grow, whether recorded here or merged from elsewhere (e.g. a bee)"""
+        self.counts[index] = self.counts.get(index, 0) + count
+
+    def merge(self, other):
+        """add all counts of `other` to this histogram (exact)"""
+        if other.relativeError != self.relativeError:
+            raise ValueError("can't merge histograms with different "
+                             "relative errors (%s != %s)" %
+                             (self.relativeError, other.relativeError))
+
+        for index, count in other.counts.items():
+            self.add_bucket(index, count)
+        self.zeroCount += other.zeroCount
+        self.sum += other.sum
+        return self
+
+    @classmethod
+    def merged(cls, histograms, relativeError=DEFAULT_RELATIVE_ERROR):
+        """new histogram holding the sum of all given histograms"""
+        histograms = list(histograms)
+        if histograms:
+            relativeError = histograms[0].relativeError
+        result = cls(relativeError)
+        for histogram in histograms:
+            result.merge(histogram)
+        return result
+
+    def percentile(self, percent):
+        return self.percentiles([percent])[0]
+
+    def percentiles(self, percents):
+        """values below which `percents` of all recorded values fall
+
+        :param percents: iterable of floats in [0, 100]
+        :returns: list of values in the same order as `percents`
+        """
+        percents = list(percents)
+        total = self.total
+        if not total:
+            return [0.0] * len(percents)
+
+        # rounding first keeps e.g. 99.9 % of 20000 from becoming 19981
+        ranks = sorted((max(1, int(math.ceil(round(p * total / 100.0, 6)))),
+                        pos) for pos, p in enumerate(percents))
+        results = [0.0] * len(percents)
+        buckets = iter(sorted(self.counts.items()))
+        seen = self.zeroCount
+        value = 0.0
+        for rank, pos in ranks:
+            while seen < rank:
+                index, count = next(buckets)
+                seen += count
+                value = self.bucket_value(index)
+            results[pos] = value
+        return results
+
+    @property
+    def asDict(self):
+        """json compatible representation (see :meth:`from_dict`)"""
+        return dict(
+            relativeError=self.relativeError,
+            zeroCount=self.zeroCount,
+            sum=self.sum,
+            counts=[[index, count]
+                    for index, count in sorted(self.counts.items())])
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls(data['relativeError'])
+        histogram.zeroCount = data['zeroCount']
+        histogram.sum = data['sum']
+        for index, count in data['counts']:
+            histogram.add_bucket(int(index), count)
+        return histogram
@@ -0,0 +1,212 @@
+"""The history of all attacks - to see what changed since the last one
+
+Every attack is stored in a local sqlite database: what was attacked
+(target), how (plan - generator, load and profile or scenario), with which
+swarm (size, instance type), the totals, the merged latency histogram, the
+requests of each second (where the generator has a time series) and the
+numbers of each bee.
+
+Runs are indexed by target, plan and time, so finding the latest run of a
+plan or the one before it stays a matter of milliseconds with thousands of
+runs stored. ``bees history`` compares the latest run with a baseline.
+"""
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from beeswithmachineguns.histogram import LatencyHistogram
+
+
+log = logging.getLogger('bees.history')
+
+HISTORY_PATH = os.path.expanduser('~/.bees_history.sqlite')
+PERCENTS = (50, 90, 99, 99.9)
+"""latency percentiles compared between runs"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    target TEXT NOT NULL,
+    plan TEXT NOT NULL,
+    started REAL NOT NULL,
+    swarmSize INTEGER NOT NULL,
+    instanceType TEXT,
+    complete INTEGER NOT NULL,
+    failed INTEGER NOT NULL,
+    rps REAL NOT NULL,
+    meanMs REAL NOT NULL,
+    histogram TEXT NOT NULL,
+    perSecond TEXT
+);
+CREATE INDEX IF NOT EXISTS runsByPlan ON runs (target, plan, started);
+CREATE INDEX IF NOT EXISTS runsByStart ON runs (started);
+CREATE TABLE IF NOT EXISTS bees (
+    runId INTEGER NOT NULL REFERENCES runs (id),
+    bee INTEGER NOT NULL,
+    instanceId TEXT,
+    complete INTEGER NOT NULL,
+    failed INTEGER NOT NULL,
+    rps REAL NOT NULL,
+    meanMs REAL NOT NULL,
+    histogram TEXT NOT NULL,
+    PRIMARY KEY (runId, bee)
+);
+"""
+RUN_FIELDS = ('target', 'plan', 'started', 'swarmSize', 'instanceType',
+              'complete', 'failed', 'rps', 'meanMs')
+BEE_FIELDS = ('bee', 'instanceId', 'complete', 'failed', 'rps', 'meanMs')
+
+
+class BeeRun(object):
+    """what one bee did in a run"""
+    def __init__(self, bee, instanceId, complete, failed, rps, meanMs,
+                 histogram):
+        self.bee = bee
+        self.instanceId = instanceId
+        self.complete = complete
+        self.failed = failed
+        self.rps = rps
+        self.meanMs = meanMs
+        self.histogram = histogram
+
+
+class Run(object):
+    def __init__(self, target, plan, swarmSize, complete, failed, rps,
+                 meanMs, histogram, instanceType=None, started=None,
+                 bees=(), id=None, perSecond=None):
+        """
+        :param plan: how the target was attacked - runs with the same plan
+            are compared with each other
+        :param histogram: :class:`LatencyHistogram` of the whole swarm
+        :param bees: list of :class:`BeeRun`
+        :param perSecond: requests of the swarm in each second of the
+            attack (None if the generator has no time series)
+        """
+        self.id = id
+        self.target = target
+        self.plan = plan
+        self.started = time.time() if started is None else started
+        self.swarmSize = swarmSize
+        self.instanceType = instanceType
+        self.complete = complete
+        self.failed = failed
+        self.rps = rps
+        self.meanMs = meanMs
+        self.histogram = histogram
+        self.bees = list(bees)
+        self.perSecond = perSecond
+
+    def __repr__(self):
+        return '<Run %s %s %s>' % (self.id, self.target, self.plan)
+
+    @property
+    def failedRatio(self):
+        return float(self.failed) / self.complete if self.complete else 0.0
+
+
+class RunStore(object):
+    def __init__(self, path=None):
+        self.path = path or HISTORY_PATH
+        self.connection = sqlite3.connect(self.path)
+        self.connection.executescript(SCHEMA)
+        columns = [row[1] for row in self.connection.execute(
+            'PRAGMA table_info(runs)')]
+        if 'perSecond' not in columns:
+            # a history from before the time series were kept
+            with self.connection:
+                self.connection.execute(
+                    'ALTER TABLE runs ADD COLUMN perSecond TEXT')
+
+    def close(self):
+        self.connection.close()
+
+    def add(self, run):
+        """store the run (and its bees) - returns its id"""
+        with self.connection:
+            cursor = self.connection.execute(
+                'INSERT INTO runs (%s, histogram, perSecond) VALUES (%s)' % (
+                    ', '.join(RUN_FIELDS), ', '.join('?' * (
+                        len(RUN_FIELDS) + 2))),
+                [getattr(run, f) for f in RUN_FIELDS] +
+                [json.dumps(run.histogram.asDict),
+                 None if run.perSecond is None else
+                 json.dumps(run.perSecond)])
+            run.id = cursor.lastrowid
+            self.connection.executemany(
+                'INSERT INTO bees (runId, %s, histogram) VALUES (%s)' % (
+                    ', '.join(BEE_FIELDS), ', '.join('?' * (
+                        len(BEE_FIELDS) + 2))),
+                [[run.id] + [getattr(b, f) for f in BEE_FIELDS] +
+                 [json.dumps(b.histogram.asDict)] for b in run.bees])
+        log.debug("stored %s", run)
+        return run.id
+
+    def get(self, runId, withBees=False):
+        runs = self._select('WHERE id = ?', [runId], 1)
+        if not runs:
+            return None
+
+        if withBees:
+            runs[0].bees = self.bees(runId)
+        return runs[0]
+
+    def latest(self, target=None, plan=None):
+        runs = self.find(target, plan, limit=1)
+        return runs[0] if runs else None
+
+    def previous(self, run):
+        """the run of the same plan against the same target before `run`"""
+        runs = self._select(
+            'WHERE target = ? AND plan = ? AND started < ? '
+            'ORDER BY started DESC', [run.target, run.plan, run.started], 1)
+        return runs[0] if runs else None
+
+    def find(self, target=None, plan=None, since=None, limit=20):
+        """newest runs first"""
+        conditions = []
+        values = []
+        for column, value in (('target', target), ('plan', plan)):
+            if value is not None:
+                conditions.append('%s = ?' % column)
+                values.append(value)
+        if since is not None:
+            conditions.append('started >= ?')
+            values.append(since)
+        where = 'WHERE %s ' % ' AND '.join(conditions) if conditions else ''
+        return self._select(where + 'ORDER BY started DESC', values, limit)
+
+    def bees(self, runId):
+        rows = self.connection.execute(
+            'SELECT %s, histogram FROM bees WHERE runId = ? ORDER BY bee' %
+            ', '.join(BEE_FIELDS), [runId])
+        return [BeeRun(*(list(row[:-1]) + [
+            LatencyHistogram.from_dict(json.loads(row[-1]))]))
+            for row in rows]
+
+    def _select(self, clause, values, limit):
+        rows = self.connection.execute(
+            'SELECT id, %s, histogram, perSecond FROM runs %s LIMIT ?' % (
+                ', '.join(RUN_FIELDS), clause), list(values) + [limit])
+        runs = []
+        for row in rows:
+            fields = dict(zip(RUN_FIELDS, row[1:-2]))
+            fields['histogram'] = LatencyHistogram.from_dict(
+                json.loads(row[-2]))
+            fields['perSecond'] = row[-1] and json.loads(row[-1])
+            runs.append(Run(id=row[0], **fields))
+        return runs
+
+
+def compare(baseline, latest, percents=PERCENTS):
+    """(metric, baseline value, latest value) - all the numbers that count"""
+    rows = [('requests per second', baseline.rps, latest.rps),
+            ('mean [ms]', baseline.meanMs, latest.meanMs),
+            ('failed [%]', baseline.failedRatio * 100,
+             latest.failedRatio * 100)]
+    for percent, before, after in zip(
+            percents, baseline.histogram.percentiles(percents),
+            latest.histogram.percentiles(percents)):
+        rows.append(('p%s [ms]' % percent, before, after))
+    return rows
@@ -0,0 +1,396 @@
+"""Talking to the hive (EC2) on behalf of the whole swarm at once
+
+Everything in here works on the swarm as a whole instead of bee by bee: one
+describe call per tick covers every bee that is still of interest.
+
+Stopped bees keep their place in the roster and are started again by the
+next ``bees up`` (:func:`wake`) - much faster than launching new ones, and
+faster still from an image baked with the load generators installed.
+
+A swarm can span several zones and regions (``us-east-1a:20,eu-west-1b:10``).
+Each region is provisioned in a thread of its own, and a zone that has no
+capacity left for the instance type hands its bees over to the other zones
+of the region.
+"""
+import collections
+import logging
+import threading
+import time
+
+from boto.exception import EC2ResponseError
+
+from dispatch import Dispatcher
+import lib as beelib
+import localhive
+
+
+log = logging.getLogger('bees.hive')
+
+THROTTLE_ERROR_CODES = ('RequestLimitExceeded', 'Throttling')
+"""EC2 telling us to slow down"""
+UNKNOWN_YET_ERROR_CODES = ('InvalidInstanceID.NotFound',)
+"""eventual consistency: freshly launched bees are not always known yet"""
+MAX_IDS_PER_CALL = 500
+CAPACITY_ERROR_CODES = ('InsufficientInstanceCapacity',
+                        'InsufficientHostCapacity', 'InsufficientCapacity',
+                        'Unsupported')
+"""the zone can't take (more of) the instance type right now"""
+RESTING_STATES = ('stopping', 'stopped')
+LOST_STATES = ('shutting-down', 'terminated')
+
+
+def region_of(zone):
+    """us-east-1d -> us-east-1"""
+    if zone == localhive.LOCAL_ZONE or 'gov' in zone:
+        return zone
+
+    return zone[:-1]
+
+
+class Placement(object):
+    """bees wanted in a zone"""
+    def __init__(self, zone, count):
+        self.zone = zone
+        self.count = count
+
+    def __repr__(self):
+        return '<Placement %s: %s>' % (self.zone, self.count)
+
+    def __eq__(self, other):
+        return (self.zone, self.count) == (other.zone, other.count)
+
+    @property
+    def region(self):
+        return region_of(self.zone)
+
+
+def parse_placements(spec, count):
+    """``us-east-1a:20,eu-west-1b`` -> list of :class:`Placement`
+
+    Zones without a count of their own share `count` evenly.
+    """
+    placements = []
+    shared = []
+    for entry in spec.split(','):
+        if not entry.strip():
+            continue
+
+        zone, _, zoneCount = entry.partition(':')
+        zone = zone.strip()
+        if zone in [p.zone for p in placements]:
+            raise ValueError("zone %s is listed twice" % zone)
+
+        if zoneCount.strip():
+            zoneCount = int(zoneCount)
+            if zoneCount < 1:
+                raise ValueError("zone %s: at least one bee please" % zone)
+        else:
+            zoneCount = None
+            shared.append(len(placements))
+        placements.append(Placement(zone, zoneCount))
+    if not placements:
+        raise ValueError("no zone given")
+
+    if shared:
+        if count < len(shared):
+            raise ValueError("%s bees can't be shared by %s zones" %
+                             (count, len(shared)))
+
+        share, rest = divmod(count, len(shared))
+        for i, index in enumerate(shared):
+            placements[index].count = share + (1 if i < rest else 0)
+    return placements
+
+
+def parse_images(spec):
+    """``ami-1`` or ``us-east-1=ami-1,eu-west-1=ami-2`` -> {region: image}
+
+    An image without region is the one for all other regions (key None).
+    """
+    images = {}
+    for entry in spec.split(','):
+        if not entry.strip():
+            continue
+
+        region, _, image = entry.rpartition('=')
+        images[region.strip() or None] = image.strip()
+    return images
+
+
+class Launch(object):
+    """what came of provisioning a swarm"""
+    def __init__(self):
+        self.instances = []
+        """all launched, running or not"""
+        self.ready = []
+        self.shortfall = {}
+        """zone -> number of bees that found no place"""
+        self.errors = {}
+        """region -> exception that stopped its provisioning"""
+
+
+def launch(connect, placements, runInstances, tags=None, ready=None,
+           timeout=None, fallback=True):
+    """Launch the placements and wait for the bees to be running
+
+    The regions are provisioned concurrently. Bees that don't fit into their
+    zone are launched in the other zones of the region (the listed ones
+    first), unless `fallback` is off.
+
+    :param connect: region -> EC2 connection
+    :param runInstances: (connection, zone, count) -> reservation of 1 to
+        `count` instances (EC2's ``min_count=1, max_count=count``)
+    :param ready: called with each bee as soon as it is running (one at a
+        time)
+    :returns: :class:`Launch` - an error in one region doesn't keep the
+        others from flying
+    """
+    regions = collections.OrderedDict()
+    for placement in placements:
+        regions.setdefault(placement.region, []).append(placement)
+    result = Launch()
+    lock = threading.Lock()
+
+    def launched(instances):
+        with lock:
+            result.instances.extend(instances)
+
+    def provision(region):
+        try:
+            connection = connect(region)
+            instances = []
+
+            def regionLaunched(regionInstances):
+                instances.extend(regionInstances)
+                launched(regionInstances)
+
+            shortfall = launch_in_region(connection, regions[region],
+                                         runInstances, regionLaunched,
+                                         fallback)
+            with lock:
+                result.shortfall.update(shortfall)
+            if not instances:
+                return
+
+            for instance in wait_for_bees(connection, instances,
+                                          timeout=timeout):
+                with lock:
+                    result.ready.append(instance)
+                    if ready:
+                        ready(instance)
+            if tags:
+                connection.create_tags([i.id for i in instances], tags)
+        except Exception as e:
+            log.debug("provisioning %s failed", region, exc_info=True)
+            with lock:
+                result.errors[region] = e
+
+    Dispatcher().map(provision, list(regions))
+    return result
+
+
+def launch_in_region(connection, placements, runInstances, launched,
+                     fallback=True):
+    """launch the placements of one region, zone by zone
+
+    :param launched: called with the instances of each reservation
+    :returns: zone -> number of bees that found no place
+    """
+    exhausted = set()
+    availableZones = None
+    shortfall = {}
+    for placement in placements:
+        missing = placement.count
+        candidates = [placement.zone]
+        if fallback:
+            candidates += [p.zone for p in placements
+                           if p.zone != placement.zone]
+        index = 0
+        while missing and index < len(candidates):
+            zone = candidates[index]
+            index += 1
+            if zone not in exhausted:
+                try:
+                    reservation = runInstances(connection, zone, missing)
+                except EC2ResponseError as e:
+                    if e.error_code not in CAPACITY_ERROR_CODES:
+                        raise
+
+                    log.warning("%s has no room for %s more bees (%s)",
+                                zone, missing, e.error_code)
+                    exhausted.add(zone)
+                else:
+                    launched(reservation.instances)
+                    missing -= len(reservation.instances)
+                    if missing:
+                        log.warning("%s had room for %s bees only", zone,
+                                    len(reservation.instances))
+                        exhausted.add(zone)
+            if (missing and fallback and index == len(candidates) and
+                    availableZones is None):
+                availableZones = available_zones(connection)
+                candidates += [z for z in availableZones
+                               if z not in candidates]
+        if missing:
+            shortfall[placement.zone] = missing
+    return shortfall
+
+
+def available_zones(connection):
+    return sorted(zone.name for zone in connection.get_all_zones()
+                  if zone.state == 'available')
+
+
+class Backoff(object):
+    """Adaptive poll interval
+
+    Starts fast, grows while nothing happens, grows faster when EC2
+    throttles us and snaps back to the initial interval on progress.
+    """
+    def __init__(self, initial=1.0, maximum=15.0, factor=1.5):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.delay = initial
+
+    def progress(self):
+        self.delay = self.initial
+
+    def idle(self):
+        self.delay = min(self.delay * self.factor, self.maximum)
+
+    def throttled(self):
+        self.delay = min(self.delay * self.factor * 2, self.maximum)
+
+
+def describe_bees(connection, instanceIds):
+    """fetch current state of all given bees in as few calls as possible"""
+    instanceIds = list(instanceIds)
+    instances = []
+    for start in range(0, len(instanceIds), MAX_IDS_PER_CALL):
+        chunk = instanceIds[start:start + MAX_IDS_PER_CALL]
+        instances.extend(connection.get_only_instances(instance_ids=chunk))
+    return instances
+
+
+def wait_for_bees(connection, instances, state='running', timeout=None,
+                  backoff=None, sleep=time.sleep):
+    """Yield each instance as soon as it reached `state`
+
+    The passed instance objects are updated in place, so callers see the
+    same state (ip, dns name, ...) as after ``instance.update()``.
+
+    :param timeout: seconds to wait overall (None: wait forever)
+    :raises BeeSting: if the timeout expires before all bees are ready
+    """
+    pending = dict((instance.id, instance) for instance in instances)
+    backoff = backoff or Backoff()
+    deadline = timeout and time.time() + timeout
+    while pending:
+        try:
+            described = describe_bees(connection, pending.keys())
+        except EC2ResponseError as e:
+            if e.error_code in THROTTLE_ERROR_CODES:
+                backoff.throttled()
+                log.warning("throttled by EC2 - polling every %.1f s",
+                            backoff.delay)
+            elif e.error_code in UNKNOWN_YET_ERROR_CODES:
+                backoff.idle()
+                log.debug("bees not known yet: %s", e.message)
+            else:
+                raise
+
+        else:
+            ready = []
+            for instance in described:
+                bee = pending.get(instance.id)
+                if bee is None:
+                    continue
+
+                bee._update(instance)
+                if bee.state == state:
+                    ready.append(bee)
+            for bee in ready:
+                del pending[bee.id]
+                yield bee
+
+            if ready:
+                backoff.progress()
+            else:
+                backoff.idle()
+            if not pending:
+                break
+
+        if deadline and time.time() + backoff.delay > deadline:
+            raise beelib.BeeSting(
+                "%s bees not %s after %s s: %s", len(pending), state,
+                timeout, sorted(pending))
+
+        log.debug("%s bees not %s yet - next look in %.1f s",
+                  len(pending), state, backoff.delay)
+        sleep(backoff.delay)
+
+
+def wake(connection, instanceIds, ready=None, timeout=None, sleep=time.sleep):
+    """Start the stopped bees (and those still stopping) again
+
+    :param ready: called with each bee as soon as it is running
+    :returns: the running bees - terminated ones are gone for good
+    """
+    bees = describe_bees(connection, instanceIds)
+    lost = [b for b in bees if b.state in LOST_STATES]
+    if lost:
+        log.warning("%s bees are lost: %s", len(lost),
+                    sorted(b.id for b in lost))
+    stopping = [b for b in bees if b.state == 'stopping']
+    if stopping:
+        # can't be started before they are stopped
+        list(wait_for_bees(connection, stopping, 'stopped', timeout=timeout,
+                           sleep=sleep))
+    resting = [b for b in bees if b.state in RESTING_STATES]
+    if resting:
+        connection.start_instances(instance_ids=[b.id for b in resting])
+        log.info("started %s bees", len(resting))
+    awake = []
+    for bee in wait_for_bees(connection,
+                             [b for b in bees if b.state not in LOST_STATES],
+                             timeout=timeout, sleep=sleep):
+        awake.append(bee)
+        if ready:
+            ready(bee)
+    return awake
+
+
+def wait_for_image(connection, imageId, timeout=None, backoff=None,
+                   sleep=time.sleep):
+    """wait until a freshly created image can be launched
+
+    :raises BeeSting: if creating the image failed or took too long
+    """
+    backoff = backoff or Backoff(initial=5.0, maximum=30.0)
+    deadline = timeout and time.time() + timeout
+    while True:
+        try:
+            image = connection.get_image(imageId)
+        except EC2ResponseError as e:
+            if e.error_code in THROTTLE_ERROR_CODES:
+                backoff.throttled()
+            elif e.error_code.startswith('InvalidAMIID'):
+                # not known yet
+                backoff.idle()
+            else:
+                raise
+
+        else:
+            if image.state == 'available':
+                return image
+
+            if image.state == 'failed':
+                raise beelib.BeeSting("creating image %s failed", imageId)
+
+            backoff.idle()
+        if deadline and time.time() + backoff.delay > deadline:
+            raise beelib.BeeSting("image %s not available after %s s",
+                                  imageId, timeout)
+
+        sleep(backoff.delay)
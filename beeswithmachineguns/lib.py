@@ -9,6 +9,9 @@ import sys
 from plumbum import LocalPath, SshMachine
 from plumbum.path import LocalWorkdir
 
+import localhive
+import sessions
+
 
 log = logging.getLogger('bees.lib')
 
@@ -96,26 +99,44 @@ class BeeBrain(object):
         return value
 
 
+def _open_remote(sshKey):
+    sshKwargs = dict(sshKey)
+    if localhive.is_local(sshKwargs['host']):
+        return localhive.LocalMachine()
+
+    sshKwargs['ssh_opts'] = (['-oStrictHostKeyChecking=no'] +
+                             sessions.CONTROL_MASTER_OPTS)
+    sshKwargs['scp_opts'] = sshKwargs['ssh_opts']
+    log.debug(str(sshKwargs))
+    return SshMachine(**sshKwargs)
+
+
+REMOTES = sessions.close_at_exit(
+    sessions.SessionPool(_open_remote, sessions.plumbum_is_alive))
+"""remote machines shared by all whisperers of this process"""
+
+
 class BeeWhisperer(object):
-    """Whisper commands to your bees"""
+    """Whisper commands to your bees
+
+    All whisperers talking to the same bee share one (pooled) remote.
+    """
     def __init__(self, fqdn, keyPath, username):
         self.fqdn = fqdn
         self.keyPath = keyPath
         self.username = username
-        self._sshKwargs = dict(
-            host=self.fqdn, user=self.username, keyfile=self.keyPath,
-            ssh_opts=['-oStrictHostKeyChecking=no'])
-
-    def __del__(self):
-        try:
-            self.remote.close()
-        except:
-            pass
+        self._sshKey = (
+            ('host', self.fqdn), ('user', self.username),
+            ('keyfile', self.keyPath and str(self.keyPath)))
 
-    @cached_property
+    @property
     def remote(self):
-        log.debug(str(self._sshKwargs))
-        return SshMachine(**self._sshKwargs)
+        return REMOTES.get(self._sshKey)
+
+    def using_remote(self):
+        """the remote, kept from being closed as idle in the ``with`` block
+        (e.g. for a long attack)"""
+        return REMOTES.using(self._sshKey)
 
 
 SPECIAL_ATTR_NAMES = [
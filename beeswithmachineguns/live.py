@@ -0,0 +1,79 @@
+"""Swarm wide live view of an attack in progress
+
+The bees send progress frames (see :mod:`agent`), the view keeps the latest
+frame per bee and renders a one line summary of the whole swarm every
+interval, no matter how many frames arrived in between.
+"""
+import sys
+import time
+
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+
+from histogram import LatencyHistogram
+
+
+class SwarmView(object):
+    def __init__(self, numBees, interval=1.0, out=None):
+        self.numBees = numBees
+        self.interval = interval
+        self.out = out or sys.stdout
+        self.latest = {}
+        """bee -> latest progress frame"""
+        self._lastTotal = 0
+        self._lastRender = None
+
+    def update(self, bee, frame):
+        self.latest[bee] = frame
+
+    @property
+    def complete(self):
+        return sum(f['complete'] for f in self.latest.values())
+
+    @property
+    def failed(self):
+        return sum(f['failed'] for f in self.latest.values())
+
+    def recent_histogram(self, now):
+        """merged latency windows of all bees that reported lately"""
+        windows = [LatencyHistogram.from_dict(f['histogram'])
+                   for f in self.latest.values()
+                   if 'histogram' in f and now - f['t'] < 2 * self.interval]
+        return LatencyHistogram.merged(windows) if windows else None
+
+    def render(self, now=None):
+        now = now or time.time()
+        complete = self.complete
+        elapsed = now - self._lastRender if self._lastRender else None
+        rate = (complete - self._lastTotal) / elapsed if elapsed else 0
+        self._lastTotal = complete
+        self._lastRender = now
+        line = ('Swarm: %i/%i bees reporting, %i requests done (%.0f/s), '
+                '%i failed' % (len(self.latest), self.numBees, complete,
+                               rate, self.failed))
+        histogram = self.recent_histogram(now)
+        if histogram:
+            p50, p99 = histogram.percentiles([50, 99])
+            line += ', p50 %.1f ms, p99 %.1f ms' % (p50, p99)
+        return line
+
+    def follow(self, queue):
+        """consume (bee, frame) tuples from `queue` until it yields None"""
+        nextRender = time.time() + self.interval
+        while True:
+            try:
+                item = queue.get(timeout=max(0, nextRender - time.time()))
+            except Empty:
+                item = ()
+            if item is None:
+                return
+
+            if item:
+                self.update(*item)
+            if time.time() >= nextRender:
+                if self.latest:
+                    self.out.write('     %s\n' % self.render())
+                    self.out.flush()
+                nextRender += self.interval
@@ -0,0 +1,287 @@
+"""A hive on this machine - rehearsing attacks without EC2
+
+Choose the zone ``local`` (``bees up -z local -s 500 -k none``, or
+``"zone": "local"`` in bees_config.json) and the commands work as usual,
+only the bees are processes on this box:
+
+* :class:`LocalConnection` stands in for boto's EC2 connection and keeps the
+  swarm in a json file, so ``up``, ``attack``, ``report`` and ``down`` can
+  run in different processes just like with EC2
+* :class:`LocalClient` (for paramiko) and :class:`LocalMachine` (for plumbum)
+  stand in for ssh - commands run in a local shell, files go to the local
+  file system (payloads are stored by hash, so the bees can share them)
+
+Each bee runs the real agent, so the whole orchestration path is exercised.
+To leave the target alone (or to have none), set :data:`agent.SIMULATE_ENV`,
+e.g. ``BEES_SIMULATE="latency=20,failures=0.01"`` - the bees then make up
+log-normally distributed latencies (median in ms) and failures instead of
+sending requests.
+"""
+import json
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+
+
+log = logging.getLogger('bees.localhive')
+
+LOCAL_ZONE = 'local'
+LOCAL_DOMAIN = 'bees.local'
+STATE_PATH = os.path.expanduser('~/.bees_local_hive.json')
+
+
+def is_local(host):
+    return bool(host) and host.endswith('.' + LOCAL_DOMAIN)
+
+
+class LocalInstance(object):
+    def __init__(self, id, state='pending', reservationId=None, tags=None):
+        self.id = id
+        self.state = state
+        self.reservation_id = reservationId
+        self.tags = tags or {}
+        self.public_dns_name = '%s.%s' % (id, LOCAL_DOMAIN)
+        self.ip_address = '127.0.0.1'
+        self.private_ip_address = '127.0.0.1'
+        self.placement = LOCAL_ZONE
+        self.instance_type = 'local'
+
+    def __repr__(self):
+        return '<LocalInstance %s %s>' % (self.id, self.state)
+
+    def _update(self, updated):
+        self.__dict__.update(updated.__dict__)
+
+
+class LocalImage(object):
+    def __init__(self, id, name, state='available'):
+        self.id = id
+        self.name = name
+        self.state = state
+
+
+class LocalReservation(object):
+    def __init__(self, id, instances):
+        self.id = id
+        self.instances = instances
+
+
+class LocalConnection(object):
+    """the parts of boto's EC2Connection the bees use"""
+    def __init__(self, statePath=None, bootTime=0.0, clock=time.time):
+        """
+        :param statePath: where the swarm is kept (default: STATE_PATH)
+        :param bootTime: seconds a bee is pending after launch
+        """
+        self.statePath = statePath or STATE_PATH
+        self.bootTime = bootTime
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def run_instances(self, image_id=None, min_count=1, max_count=1,
+                      **kwargs):
+        reservationId = 'r-%s' % uuid.uuid4().hex[:8]
+        ids = [self._new_id() for _ in range(max_count)]
+        with self._lock:
+            state = self._load()
+            for id in ids:
+                state[id] = dict(reservationId=reservationId,
+                                 launchTime=self._clock(), tags={})
+            self._save(state)
+        log.debug("launched %s local bees in %s", max_count, reservationId)
+        return LocalReservation(reservationId, self.get_only_instances(ids))
+
+    def get_only_instances(self, instance_ids=None):
+        with self._lock:
+            state = self._load()
+        ids = sorted(state) if instance_ids is None else instance_ids
+        return [self._instance(i, state[i]) for i in ids if i in state]
+
+    def get_all_reservations(self, instance_ids=None):
+        reservations = {}
+        for instance in self.get_only_instances(instance_ids):
+            reservations.setdefault(instance.reservation_id, []).append(
+                instance)
+        return [LocalReservation(id, instances)
+                for id, instances in sorted(reservations.items())]
+
+    get_all_instances = get_all_reservations
+
+    def get_all_security_groups(self):
+        return []
+
+    def create_tags(self, resource_ids, tags):
+        with self._lock:
+            state = self._load()
+            for id in resource_ids:
+                if id in state:
+                    state[id]['tags'].update(tags)
+            self._save(state)
+
+    def terminate_instances(self, instance_ids=None):
+        with self._lock:
+            state = self._load()
+            terminated = [self._instance(i, state.pop(i))
+                          for i in (instance_ids or list(state))
+                          if i in state]
+            self._save(state)
+        for instance in terminated:
+            instance.state = 'terminated'
+        return terminated
+
+    def stop_instances(self, instance_ids=None, force=False):
+        with self._lock:
+            state = self._load()
+            stopped = [i for i in instance_ids if i in state]
+            for id in stopped:
+                state[id]['stopped'] = True
+            self._save(state)
+        return self.get_only_instances(stopped)
+
+    def start_instances(self, instance_ids=None):
+        with self._lock:
+            state = self._load()
+            started = [i for i in instance_ids if i in state]
+            for id in started:
+                # booting takes as long as after the launch
+                state[id]['stopped'] = False
+                state[id]['launchTime'] = self._clock()
+            self._save(state)
+        return self.get_only_instances(started)
+
+    def create_image(self, instance_id, name, description=None,
+                     no_reboot=False):
+        # local bees all run on this machine, there is nothing to bake
+        return 'ami-%s' % uuid.uuid4().hex[:8]
+
+    def get_image(self, image_id):
+        return LocalImage(image_id, image_id)
+
+    def _instance(self, id, entry):
+        booted = self._clock() - entry['launchTime'] >= self.bootTime
+        if entry.get('stopped'):
+            instanceState = 'stopped'
+        else:
+            instanceState = 'running' if booted else 'pending'
+        return LocalInstance(id, instanceState, entry['reservationId'],
+                             dict(entry['tags']))
+
+    def _new_id(self):
+        return 'i-%s' % uuid.uuid4().hex[:8]
+
+    def _load(self):
+        if not os.path.exists(self.statePath):
+            return {}
+
+        with open(self.statePath) as f:
+            return json.load(f)
+
+    def _save(self, state):
+        tmpPath = self.statePath + '.tmp'
+        with open(tmpPath, 'w') as f:
+            json.dump(state, f)
+        os.rename(tmpPath, self.statePath)
+
+
+class _Lines(object):
+    """line by line - iterating a pipe directly would wait for a full buffer"""
+    def __init__(self, f):
+        self.f = f
+
+    def __iter__(self):
+        return iter(self.f.readline, '')
+
+    def read(self):
+        return self.f.read()
+
+
+class LocalSftp(object):
+    """the parts of paramiko's SFTPClient the bees use"""
+    def stat(self, path):
+        try:
+            return os.stat(path)
+        except OSError as e:
+            raise IOError(e.errno, e.strerror, path)
+
+    def mkdir(self, path):
+        try:
+            os.mkdir(path)
+        except OSError as e:
+            raise IOError(e.errno, e.strerror, path)
+
+    def open(self, path, mode='r'):
+        return open(path, mode)
+
+    def get(self, remotePath, localPath):
+        shutil.copyfile(remotePath, localPath)
+
+    def rename(self, oldPath, newPath):
+        if os.path.exists(newPath):
+            raise IOError("%s exists" % newPath)
+
+        os.rename(oldPath, newPath)
+
+    def remove(self, path):
+        os.remove(path)
+
+    def close(self):
+        pass
+
+
+class LocalClient(object):
+    """the parts of paramiko's SSHClient the bees use - on this machine"""
+    def __init__(self, name):
+        self.name = name
+        self._processes = []
+
+    def exec_command(self, command):
+        process = subprocess.Popen(
+            command, shell=True, stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True)
+        self._processes = [p for p in self._processes if p.poll() is None]
+        self._processes.append(process)
+        return process.stdin, _Lines(process.stdout), _Lines(process.stderr)
+
+    def open_sftp(self):
+        return LocalSftp()
+
+    def get_transport(self):
+        return self
+
+    # transport
+
+    def is_active(self):
+        return True
+
+    def send_ignore(self):
+        pass
+
+    def set_keepalive(self, interval):
+        pass
+
+    def close(self):
+        for process in self._processes:
+            if process.poll() is None:
+                process.terminate()
+        self._processes = []
+
+
+class LocalMachine(object):
+    """the parts of plumbum's SshMachine the bees use - on this machine"""
+    def __init__(self):
+        from plumbum import local
+        self._local = local
+
+    def __getitem__(self, command):
+        return self._local[command]
+
+    def popen(self, command, **kwargs):
+        return self._local['sh']['-c', command].popen(**kwargs)
+
+    def close(self):
+        pass
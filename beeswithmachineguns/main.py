@@ -3,6 +3,15 @@ from urlparse import urlparse
 from optparse import OptionParser, OptionGroup
 
 import bees
+import dispatch
+import drivers
+import gate
+import hive
+import probe
+import profiles
+import scenarios
+import warmup
+import workqueue
 
 
 usage = """\
@@ -19,7 +28,11 @@ commands:
   up      Start a batch of load testing servers.
   attack  Begin the attack on a specific url.
   down    Shutdown and deactivate the load testing servers.
-  report  Report the status of the load testing servers.
+  bake    Bake an image with the load generators installed.
+  report  Report the status of the load testing servers and how ready
+          each is to attack (ssh, load generators, cpu, network).
+  probe   Search the highest load the target takes within an SLO.
+  history Compare the latest attack with an earlier one.
 """
 
 
@@ -54,11 +67,18 @@ def parse_options():
                         action='store', dest='zone', type='string',
                         default='us-east-1d',
                         help="The availability zone to start the instances "
-                             "in (default: us-east-1d).")
+                             "in - or several zones, in any regions, with a "
+                             "number of bees each, e.g. us-east-1a:20,"
+                             "us-east-1b:20,eu-west-1a:10 (zones without a "
+                             "number share -s). Bees that find no room in "
+                             "their zone move to the other zones of the "
+                             "region (default: us-east-1d).")
     up_group.add_option('-i', '--instance', metavar="INSTANCE", nargs=1,
                         action='store', dest='instance', type='string',
                         default='ami-ff17fb96',
-                        help="The instance-id to use for each server from ("
+                        help="The instance-id to use for each server from, "
+                             "per region for a swarm in several regions, "
+                             "e.g. us-east-1=ami-1,eu-west-1=ami-2 ("
                              "default: ami-ff17fb96).")
     up_group.add_option('-t', '--type', metavar="TYPE", nargs=1,
                         action='store', dest='type', type='string',
@@ -130,6 +150,25 @@ def parse_options():
                             default='',
                             help="Store the distribution of results in a csv "
                                  "file for all completed bees (default: '').")
+    attack_group.add_option('-o', '--timeseries', metavar="FILENAME", nargs=1,
+                            action='store', dest='timeseries_filename',
+                            type='string', default='',
+                            help="Store requests, failures and latency "
+                                 "percentiles of the swarm per second in a "
+                                 "csv file (json if it ends with .json) "
+                                 "(default: '').")
+    attack_group.add_option('-x', '--samples', metavar="FILENAME", nargs=1,
+                            action='store', dest='samples_filename',
+                            type='string', default='',
+                            help="Store the raw samples - time, latency, "
+                                 "status and bee of every single request - "
+                                 "in a binary file, see samples.py "
+                                 "(default: '').")
+    attack_group.add_option('--samples-csv', metavar="FILENAME", nargs=1,
+                            action='store', dest='samples_csv_filename',
+                            type='string', default='',
+                            help="Also export the raw samples of -x to a csv "
+                                 "file, one row per request (default: '').")
 
     # Optional
     attack_group.add_option('-T', '--tpr', metavar='TPR', nargs=1,
@@ -151,9 +190,186 @@ def parse_options():
                             default='', type='string',
                             help='BASIC authentication credentials, format '
                                  'auth-username:password (default: None).')
-
+    attack_group.add_option('-F', '--fan-out', metavar='FAN_OUT', nargs=1,
+                            action='store', dest='fan_out',
+                            default=dispatch.DEFAULT_FAN_OUT, type='int',
+                            help='The number of bees that may be connecting '
+                                 'or uploading at the same time (default: '
+                                 '%i).' % dispatch.DEFAULT_FAN_OUT)
+    attack_group.add_option('-E', '--engine', metavar='ENGINE', nargs=1,
+                            action='store', dest='engine', default='ab',
+                            type='choice', choices=list(drivers.NAMES),
+                            help='The load generator the bees use: %s - '
+                                 'engine is the built-in one (needs python 3 '
+                                 'on the bees), the others have to be '
+                                 'installed there - report checks the bees '
+                                 'for it. wrk and hey tell nothing until '
+                                 'they are done, so the live view only shows '
+                                 'their bees as busy (default: ab).' %
+                                 ', '.join(drivers.NAMES))
+    attack_group.add_option('-P', '--pipeline', metavar='PIPELINE', nargs=1,
+                            action='store', dest='pipeline', default=1,
+                            type='int',
+                            help='Requests in flight per keep-alive '
+                                 'connection, engine only (default: 1).')
+    attack_group.add_option('-r', '--rate', metavar='RATE', nargs=1,
+                            action='store', dest='rate', default=None,
+                            type='string',
+                            help='Total requests per second of the whole '
+                                 'swarm, e.g. 20000/s. Runs open loop: '
+                                 'latencies count from when a request was '
+                                 'due. Engine only (default: None).')
+    attack_group.add_option('-B', '--upload-rate', metavar='UPLOAD_RATE',
+                            nargs=1, action='store', dest='upload_rate',
+                            default=None, type='int',
+                            help='Cap for the bandwidth used by all uploads '
+                                 'to the bees together in KB/s (default: '
+                                 'None).')
+    attack_group.add_option('-L', '--profile', metavar='PROFILE', nargs=1,
+                            action='store', dest='profile', default=None,
+                            type='string',
+                            help='JSON file with a load profile (ramp, step '
+                                 'or spike) the swarm runs as one attack in '
+                                 'stages - replaces -n and -c (default: '
+                                 'None).')
+    attack_group.add_option('-S', '--scenario', metavar='SCENARIO', nargs=1,
+                            action='store', dest='scenario', default=None,
+                            type='string',
+                            help='JSON file with a weighted mix of requests '
+                                 '(urls, methods, bodies) to attack instead '
+                                 'of -u. Engine only (default: None).')
+
+    attack_group.add_option('-Q', '--work-queue', action='store_true',
+                            dest='work_queue', default=False,
+                            help='Hand out the requests in batches on '
+                                 'demand instead of a fixed share per bee, '
+                                 'so faster bees take more and the batches '
+                                 'of lost or lagging bees go to the others '
+                                 '(default: False).')
+    attack_group.add_option('--batch', metavar='REQUESTS', nargs=1,
+                            action='store', dest='batch', default=None,
+                            type='int',
+                            help='Requests per batch of the work queue, '
+                                 'implies -Q (default: a few batches per '
+                                 'bee).')
+    attack_group.add_option('--batch-timeout', metavar='SECONDS', nargs=1,
+                            action='store', dest='batch_timeout',
+                            default=None, type='float',
+                            help='Seconds a batch may take before it goes '
+                                 'to another bee (default: %g times as long '
+                                 'as usual).' % workqueue.STRAGGLER_FACTOR)
+    attack_group.add_option('-W', '--warm-up', metavar='SECONDS', nargs=1,
+                            action='store', dest='warm_up',
+                            default=warmup.SECONDS, type='float',
+                            help='Longest the bees warm up the caches before '
+                                 'the attack, requesting every url of it '
+                                 'until the hit rates settle - not in the '
+                                 'results, 0 to skip (default: %g).' %
+                                 warmup.SECONDS)
+    attack_group.add_option('--warm-up-concurrency', metavar='CONCURRENCY',
+                            nargs=1, action='store',
+                            dest='warm_up_concurrency',
+                            default=warmup.CONCURRENCY, type='int',
+                            help='Requests at a time of each bee while '
+                                 'warming up (default: %i).' %
+                                 warmup.CONCURRENCY)
+
+    attack_group.add_option('-G', '--gate', metavar='RUN', nargs=1,
+                            action='store', dest='gate', default=None,
+                            type='string',
+                            help='Compare the attack with a run from the '
+                                 'history (its number or "previous" for the '
+                                 'last one of the same plan) and exit with 1 '
+                                 'if it is significantly worse (default: '
+                                 'None).')
+    attack_group.add_option('--tolerance', metavar='TOLERANCES', nargs=1,
+                            action='store', dest='tolerance', default=None,
+                            type='string',
+                            help='How much worse each metric may get before '
+                                 'the gate fails, e.g. p50=10%%,p99=25%%,'
+                                 'rps=10%%,failed=1%% (default: %s).' %
+                                 ','.join('%s=%g%%' % (k, v * 100) for k, v in
+                                          sorted(gate.DEFAULT_TOLERANCES.items())))
     parser.add_option_group(attack_group)
 
+    probe_group = OptionGroup(parser, "probe",
+                              """Attack in steps of growing load - first
+                              doubling it, then bisecting - until the
+                              highest load within the SLO is found. Uses
+                              the options of attack (but -n, -r, -L).""")
+    probe_group.add_option('--slo', metavar='SLO', nargs=1,
+                           action='store', dest='slo', default=None,
+                           type='string',
+                           help='What the target has to meet, e.g. '
+                                'p99<250ms,errors<1%.')
+    probe_group.add_option('--search', metavar='SEARCH', nargs=1,
+                           action='store', dest='search',
+                           default='concurrency', type='choice',
+                           choices=probe.SEARCHES,
+                           help='Search the concurrency or the request rate '
+                                '(engine only, -c is the cap then) '
+                                '(default: concurrency).')
+    probe_group.add_option('--start', metavar='LOAD', nargs=1,
+                           action='store', dest='start', default=None,
+                           type='int',
+                           help='The load of the first step (default: one '
+                                'per bee).')
+    probe_group.add_option('--limit', metavar='LOAD', nargs=1,
+                           action='store', dest='limit', default=None,
+                           type='int',
+                           help='The highest load to try (default: None).')
+    probe_group.add_option('--step', metavar='SECONDS', nargs=1,
+                           action='store', dest='step_duration', default=20,
+                           type='int',
+                           help='How long each step attacks (default: 20).')
+    probe_group.add_option('--precision', metavar='PRECISION', nargs=1,
+                           action='store', dest='precision', default=5,
+                           type='float',
+                           help='Stop when the highest load within the SLO '
+                                'and the lowest beyond it are this close, '
+                                'in percent (default: 5).')
+    parser.add_option_group(probe_group)
+
+    down_group = OptionGroup(parser, "down",
+                             """Stopped bees stay in the roster and the
+                             next up starts them again, which is a lot
+                             faster than calling up new ones.""")
+    down_group.add_option('--stop', action='store_true', dest='stop',
+                          default=False,
+                          help='Only stop the bees instead of terminating '
+                               'them (default: False).')
+    parser.add_option_group(down_group)
+
+    bake_group = OptionGroup(parser, "bake",
+                             """Install the load generators (ab, python3
+                             for the engine) on the first bee and make an
+                             image of it (in its region) to call up new
+                             bees from with -i.""")
+    bake_group.add_option('--name', metavar="NAME", nargs=1,
+                          action='store', dest='image_name', type='string',
+                          default=None,
+                          help='Name of the image (default: '
+                               'bees-<date>-<time>).')
+    parser.add_option_group(bake_group)
+
+    history_group = OptionGroup(parser, "history",
+                                """Every attack is stored in a local
+                                database (~/.bees_history.sqlite). Compare
+                                the latest attack (on the url given with
+                                -u) with the one of the same plan before it
+                                or any other run.""")
+    history_group.add_option('-b', '--baseline', metavar='RUN', nargs=1,
+                             action='store', dest='baseline', default=None,
+                             type='int',
+                             help='The run to compare the latest attack '
+                                  'with (default: the one before it).')
+    history_group.add_option('-N', '--runs', metavar='RUNS', nargs=1,
+                             action='store', dest='runs', default=10,
+                             type='int',
+                             help='Number of latest attacks to list '
+                                  '(default: 10).')
+    parser.add_option_group(history_group)
+
     (options, args) = parser.parse_args()
 
     if len(args) <= 0:
@@ -172,20 +388,99 @@ def parse_options():
                   'Please note that port 22 (SSH) is not normally open on ' \
                   'this group. You will need to use to the EC2 tools to ' \
                   'open it before you will be able to attack.'
+        try:
+            placements = hive.parse_placements(options.zone, options.servers)
+        except ValueError, e:
+            parser.error('Can\'t read the zones: %s' % e)
+        images = hive.parse_images(options.instance)
+        if None not in images:
+            without_image = sorted(set(p.region for p in placements
+                                       if p.region not in images))
+            if without_image:
+                parser.error('Please give an image (-i) for %s' %
+                             ', '.join(without_image))
+        if options.subnet and len(placements) > 1:
+            parser.error('A subnet lives in one zone, please give only one '
+                         'zone with -v')
         bees.up(options.servers, options.group, options.zone, options.instance,
                 options.type, options.login, options.key, options.subnet)
     elif command == 'attack':
-        if not options.url:
+        if options.scenario:
+            try:
+                scenarios.load(options.scenario)
+            except (IOError, ValueError, KeyError, TypeError), e:
+                parser.error('Can\'t read the scenario %s: %s' %
+                             (options.scenario, e))
+            if options.engine != 'engine':
+                parser.error('%s attacks one url only, please use the '
+                             'built-in engine with -E engine for a '
+                             'scenario' % options.engine)
+        elif not options.url:
             parser.error('To run an attack you need to specify a url with -u')
 
-        parsed = urlparse(options.url)
-        if not parsed.scheme:
-            parsed = urlparse("http://" + options.url)
-
-        if not parsed.path:
-            parser.error(
-                'It appears your URL lacks a trailing slash, this will '
-                'disorient the bees. Please try again with a trailing slash.')
+        if options.url:
+            parsed = urlparse(options.url)
+            if not parsed.scheme:
+                parsed = urlparse("http://" + options.url)
+
+            if not parsed.path:
+                parser.error(
+                    'It appears your URL lacks a trailing slash, this will '
+                    'disorient the bees. Please try again with a trailing '
+                    'slash.')
+
+        rate = None
+        if options.rate:
+            try:
+                rate = float(options.rate.rstrip('/s'))
+            except ValueError:
+                parser.error('Please give the rate as requests per second, '
+                             'e.g. 20000/s')
+            if options.engine != 'engine':
+                parser.error('%s can\'t keep a constant rate, please use '
+                             'the built-in engine with -E engine' %
+                             options.engine)
+
+        profile = None
+        if options.profile:
+            try:
+                profile = profiles.load(options.profile)
+            except (IOError, ValueError, KeyError), e:
+                parser.error('Can\'t read the profile %s: %s' %
+                             (options.profile, e))
+            if rate:
+                parser.error('The stages of a profile bring their own rate, '
+                             'please don\'t use -r with -L')
+            if (any(stage.rate for stage in profile) and
+                    options.engine != 'engine'):
+                parser.error('%s can\'t keep a constant rate, please use '
+                             'the built-in engine with -E engine' %
+                             options.engine)
+
+        batch = None
+        if options.work_queue or options.batch is not None:
+            if profile:
+                parser.error('The stages of a profile run for a time, '
+                             'please don\'t use -Q with -L')
+            if options.batch is not None and options.batch < 1:
+                parser.error('Please give at least one request per batch')
+            batch = options.batch or 0
+
+        if options.samples_csv_filename and not options.samples_filename:
+            parser.error('The csv export is of the raw samples, please '
+                         'store them with -x as well')
+
+        _check_warm_up(parser, options)
+
+        tolerances = None
+        if options.gate:
+            if options.gate != 'previous' and not options.gate.isdigit():
+                parser.error('Please give the run to compare with as its '
+                             'number or "previous"')
+            try:
+                tolerances = gate.parse_tolerances(options.tolerance)
+            except ValueError, e:
+                parser.error('Can\'t read the tolerances: %s' % e)
 
         additional_options = dict(
             cookies=options.cookies,
@@ -194,18 +489,81 @@ def parse_options():
             keep_alive=options.keep_alive,
             mime_type=options.mime_type,
             csv_filename=options.csv_filename,
+            timeseries_filename=options.timeseries_filename,
+            samples_filename=options.samples_filename,
+            samples_csv_filename=options.samples_csv_filename,
             tpr=options.tpr,
             rps=options.rps,
-            basic_auth=options.basic_auth
+            basic_auth=options.basic_auth,
+            fan_out=options.fan_out,
+            upload_rate=options.upload_rate,
+            engine=options.engine,
+            pipeline=options.pipeline,
+            rate=rate,
+            profile=profile,
+            scenario=options.scenario,
+            batch=batch,
+            batch_timeout=options.batch_timeout,
+            warm_up=options.warm_up,
+            warm_up_concurrency=options.warm_up_concurrency,
+            gate=options.gate,
+            tolerances=tolerances
         )
 
         bees.attack(options.url, options.number, options.concurrent,
                     **additional_options)
 
+    elif command == 'probe':
+        if not options.url:
+            parser.error('To probe you need to specify a url with -u')
+        if not options.slo:
+            parser.error('To probe you need to specify an SLO with --slo, '
+                         'e.g. p99<250ms,errors<1%')
+        try:
+            slo = probe.Slo.parse(options.slo)
+        except ValueError, e:
+            parser.error('Can\'t read the SLO: %s' % e)
+        if options.search == 'rate' and options.engine != 'engine':
+            parser.error('%s can\'t keep a constant rate, please use '
+                         'the built-in engine with -E engine' %
+                         options.engine)
+        _check_warm_up(parser, options)
+
+        bees.probe(options.url, slo,
+                   cookies=options.cookies,
+                   headers=options.headers,
+                   post_file=options.post_file,
+                   keep_alive=options.keep_alive,
+                   mime_type=options.mime_type,
+                   basic_auth=options.basic_auth,
+                   fan_out=options.fan_out,
+                   upload_rate=options.upload_rate,
+                   engine=options.engine,
+                   pipeline=options.pipeline,
+                   warm_up=options.warm_up,
+                   warm_up_concurrency=options.warm_up_concurrency,
+                   search=options.search,
+                   concurrency=options.concurrent,
+                   start=options.start,
+                   limit=options.limit,
+                   step_duration=options.step_duration,
+                   precision=options.precision / 100)
     elif command == 'down':
-        bees.down()
+        bees.down(options.stop)
+    elif command == 'bake':
+        bees.bake(options.image_name)
     elif command == 'report':
-        bees.report()
+        bees.report(options.fan_out, options.engine)
+    elif command == 'history':
+        bees.history_report(options.url, options.baseline, options.runs)
+
+
+def _check_warm_up(parser, options):
+    if options.warm_up < 0:
+        parser.error('Please give the warm-up in seconds, 0 to skip it')
+    if options.warm_up_concurrency < 1:
+        parser.error('Please give at least one request at a time for the '
+                     'warm-up')
 
 
 def main():
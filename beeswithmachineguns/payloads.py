@@ -0,0 +1,192 @@
+"""Getting files onto the bees - once per bee and content
+
+Payloads (post files, the agent bundle, ...) live on the bees under the hash
+of their content. Before uploading, the distributor asks the bee if it
+already holds that hash and remembers what each bee holds, so a payload
+travels to every bee exactly once per campaign (and not at all while the
+bee keeps it from an earlier one).
+
+Uploads from all bee threads share one optional bandwidth cap.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+
+
+log = logging.getLogger('bees.payloads')
+
+REMOTE_PAYLOAD_DIR = '/tmp/bees_payloads'
+CHUNK_SIZE = 32 * 1024
+
+
+class Payload(object):
+    def __init__(self, data, name='', suffix=''):
+        self.data = data
+        self.name = name
+        self.digest = hashlib.sha256(data).hexdigest()
+        self.remotePath = '%s/%s%s' % (REMOTE_PAYLOAD_DIR, self.digest, suffix)
+
+    def __repr__(self):
+        return '<Payload %s %s (%s bytes)>' % (
+            self.name, self.digest[:12], len(self.data))
+
+    def __len__(self):
+        return len(self.data)
+
+    @classmethod
+    def from_file(cls, path, suffix=''):
+        with open(path, 'rb') as f:
+            return cls(f.read(), name=os.path.basename(path), suffix=suffix)
+
+
+_loaded = {}
+
+
+def load(path, suffix=''):
+    """payload from a file - read and hashed only once while unchanged"""
+    path = os.path.abspath(str(path))
+    stat = os.stat(path)
+    key = (path, stat.st_mtime, stat.st_size, suffix)
+    if key not in _loaded:
+        _loaded[key] = Payload.from_file(path, suffix)
+    return _loaded[key]
+
+
+class RateLimit(object):
+    """hands out time slots so all callers together stay below the rate"""
+    def __init__(self, bytesPerSecond, clock=time.time, sleep=time.sleep):
+        self.bytesPerSecond = float(bytesPerSecond)
+        self._clock = clock
+        self._sleep = sleep
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def consume(self, numBytes):
+        with self._lock:
+            now = self._clock()
+            start = max(now, self._next)
+            self._next = start + numBytes / self.bytesPerSecond
+        if start > now:
+            self._sleep(start - now)
+
+
+class SftpTarget(object):
+    """a bee reached through a paramiko client"""
+    def __init__(self, client):
+        self.client = client
+        self._sftp = None
+
+    @property
+    def sftp(self):
+        if self._sftp is None:
+            self._sftp = self.client.open_sftp()
+        return self._sftp
+
+    def has(self, payload):
+        try:
+            return self.sftp.stat(payload.remotePath).st_size == len(payload)
+        except IOError:
+            return False
+
+    def write(self, payload, chunks):
+        try:
+            self.sftp.mkdir(REMOTE_PAYLOAD_DIR)
+        except IOError:
+            pass  # already there
+        tmpPath = '%s.%s' % (payload.remotePath, uuid.uuid4().hex)
+        f = self.sftp.open(tmpPath, 'wb')
+        try:
+            for chunk in chunks:
+                f.write(chunk)
+        finally:
+            f.close()
+        try:
+            self.sftp.rename(tmpPath, payload.remotePath)
+        except IOError:
+            # someone else was faster - same content, so just clean up
+            self.sftp.remove(tmpPath)
+
+    def close(self):
+        if self._sftp is not None:
+            self._sftp.close()
+
+
+class PlumbumTarget(object):
+    """a bee reached through a plumbum remote machine"""
+    def __init__(self, remote):
+        self.remote = remote
+
+    def has(self, payload):
+        try:
+            size = self.remote['stat']('-c', '%s', payload.remotePath)
+            return int(size) == len(payload)
+        except Exception:
+            return False
+
+    def write(self, payload, chunks):
+        tmpPath = '%s.%s' % (payload.remotePath, uuid.uuid4().hex)
+        proc = self.remote.popen('mkdir -p %s && cat > %s && mv %s %s' % (
+            REMOTE_PAYLOAD_DIR, tmpPath, tmpPath, payload.remotePath))
+        for chunk in chunks:
+            proc.stdin.write(chunk)
+        proc.stdin.close()
+        if proc.wait() != 0:
+            raise IOError("upload of %s failed: %s" %
+                          (payload, proc.stderr.read()))
+
+    def close(self):
+        pass
+
+
+class Distributor(object):
+    def __init__(self, bytesPerSecond=None):
+        """
+        :param bytesPerSecond: cap for all uploads together (None: no cap)
+        """
+        self.rateLimit = None
+        self.limit(bytesPerSecond)
+        self._delivered = set()
+        self._lock = threading.Lock()
+
+    def limit(self, bytesPerSecond):
+        self.rateLimit = bytesPerSecond and RateLimit(bytesPerSecond)
+
+    def holds(self, beeKey, payload):
+        return (beeKey, payload.digest) in self._delivered
+
+    def ensure(self, beeKey, target, payloads):
+        """make sure the bee holds all payloads
+
+        :param target: :class:`SftpTarget` or :class:`PlumbumTarget`
+        :returns: number of payloads that actually had to be uploaded
+        """
+        uploaded = 0
+        for payload in payloads:
+            if self.holds(beeKey, payload):
+                continue
+
+            if target.has(payload):
+                log.debug("%s already holds %s", beeKey, payload)
+            else:
+                log.debug("uploading %s to %s", payload, beeKey)
+                target.write(payload, self._chunks(payload))
+                uploaded += 1
+            with self._lock:
+                self._delivered.add((beeKey, payload.digest))
+        return uploaded
+
+    def forget(self, beeKey):
+        """bee is gone or was replaced: check again next time"""
+        with self._lock:
+            self._delivered = set(
+                d for d in self._delivered if d[0] != beeKey)
+
+    def _chunks(self, payload):
+        for start in range(0, len(payload), CHUNK_SIZE):
+            chunk = payload.data[start:start + CHUNK_SIZE]
+            if self.rateLimit:
+                self.rateLimit.consume(len(chunk))
+            yield chunk
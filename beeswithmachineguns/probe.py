@@ -0,0 +1,180 @@
+"""Capacity search - the highest load the target takes within its SLO
+
+``bees probe`` attacks in steps of a fixed duration with the swarm that is
+up (connections and uploads are reused from step to step). The load -
+concurrency, or the request rate with the engine - doubles from step to
+step until the SLO is violated, then the last load that met it and the
+first that didn't are bisected until they are within the precision::
+
+    bees probe -u http://x/ --slo "p99<250ms,errors<1%" --step 20
+
+Loads are rounded to the granularity (e.g. the number of bees) and never
+measured twice, so the search takes a handful of steps: about
+log2(capacity / start) to find the bounds and log2(1 / precision) to
+narrow them down.
+"""
+import logging
+import re
+
+
+log = logging.getLogger('bees.probe')
+
+SEARCHES = ('concurrency', 'rate')
+SLO_CRITERION = re.compile(
+    r'^\s*(?:p(?P<percent>[0-9.]+)\s*<\s*(?P<ms>[0-9.]+)\s*ms'
+    r'|errors\s*<\s*(?P<errors>[0-9.]+)\s*%)\s*$')
+
+
+class Slo(object):
+    def __init__(self, latency=None, percent=99.0, errorRate=None):
+        """
+        :param latency: max. latency (ms) at the percentile `percent`
+        :param errorRate: max. fraction of failed requests
+        """
+        self.latency = latency
+        self.percent = percent
+        self.errorRate = errorRate
+
+    def __repr__(self):
+        criteria = []
+        if self.latency is not None:
+            criteria.append('p%g<%gms' % (self.percent, self.latency))
+        if self.errorRate is not None:
+            criteria.append('errors<%g%%' % (self.errorRate * 100))
+        return ','.join(criteria)
+
+    @classmethod
+    def parse(cls, spec):
+        """from ``p99<250ms,errors<1%``"""
+        slo = cls()
+        for criterion in spec.split(','):
+            match = SLO_CRITERION.match(criterion)
+            if not match:
+                raise ValueError("can't read %r (p<percent><<ms>ms or "
+                                 "errors<<percent>%%)" % criterion)
+
+            if match.group('errors'):
+                slo.errorRate = float(match.group('errors')) / 100
+            else:
+                slo.percent = float(match.group('percent'))
+                slo.latency = float(match.group('ms'))
+        if slo.latency is None and slo.errorRate is None:
+            raise ValueError("the SLO needs a latency or an error rate")
+
+        return slo
+
+    def violations(self, measurement):
+        """what is wrong with the measurement - empty if it met the SLO"""
+        violations = []
+        if self.latency is not None and measurement.latency >= self.latency:
+            violations.append('p%g %.1f ms >= %g ms' % (
+                self.percent, measurement.latency, self.latency))
+        if (self.errorRate is not None and
+                measurement.errorRate >= self.errorRate):
+            violations.append('%.2f%% errors >= %g%%' % (
+                measurement.errorRate * 100, self.errorRate * 100))
+        return violations
+
+
+class Measurement(object):
+    def __init__(self, load, rps, latency, errorRate, duration=0.0):
+        """
+        :param latency: latency (ms) at the percentile of the SLO
+        :param duration: seconds the step took
+        """
+        self.load = load
+        self.rps = rps
+        self.latency = latency
+        self.errorRate = errorRate
+        self.duration = duration
+        self.violations = []
+
+    @property
+    def ok(self):
+        return not self.violations
+
+    def __repr__(self):
+        return '<Measurement %s: %.1f/s %.1f ms %.2f%%%s>' % (
+            self.load, self.rps, self.latency, self.errorRate * 100,
+            '' if self.ok else ' violated')
+
+
+class CapacitySearch(object):
+    def __init__(self, measure, slo, start, limit=None, minimum=1,
+                 granularity=1, growth=2.0, precision=0.05, maxSteps=16):
+        """
+        :param measure: load -> :class:`Measurement` (one attack step)
+        :param start: first load to try
+        :param limit: highest load to try (None: no limit)
+        :param minimum: lowest possible load (e.g. one per bee)
+        :param granularity: loads are multiples of this
+        :param precision: stop when the bounds are this close (relative)
+        """
+        self.measure = measure
+        self.slo = slo
+        self.start = start
+        self.limit = limit
+        self.minimum = minimum
+        self.granularity = granularity
+        self.growth = growth
+        self.precision = precision
+        self.maxSteps = maxSteps
+        self.steps = []
+        self.best = None
+        """highest load that met the SLO"""
+        self.worst = None
+        """lowest load that violated it"""
+
+    @property
+    def duration(self):
+        return sum(m.duration for m in self.steps)
+
+    @property
+    def bestMeasurement(self):
+        for measurement in self.steps:
+            if measurement.load == self.best:
+                return measurement
+
+    def run(self):
+        load = self._round(self.start)
+        while load is not None and len(self.steps) < self.maxSteps:
+            measurement = self.measure(load)
+            measurement.violations = self.slo.violations(measurement)
+            self.steps.append(measurement)
+            log.info("step %s: %s %s", len(self.steps), measurement,
+                     '; '.join(measurement.violations))
+            if measurement.ok:
+                self.best = max(load, self.best or load)
+            else:
+                self.worst = min(load, self.worst or load)
+            load = self.next_load()
+        return self
+
+    def next_load(self):
+        """the load of the next step, None if the search is done"""
+        if self.worst is None:
+            if self.limit is not None and self.best >= self.limit:
+                return None
+
+            load = self._round(self.best * self.growth)
+            if self.limit is not None:
+                load = min(load, self.limit)
+            return load
+
+        low = self.minimum if self.best is None else self.best
+        if self.best is None and self.worst <= self.minimum:
+            return None
+
+        if self.worst - low <= max(self.granularity, self.precision * low):
+            return None
+
+        load = self._round((low + self.worst) / 2.0)
+        measured = set(m.load for m in self.steps)
+        if load in measured or not low <= load < self.worst:
+            return None
+
+        return load
+
+    def _round(self, load):
+        rounded = int(round(float(load) / self.granularity)) * self.granularity
+        return max(self.minimum, rounded)
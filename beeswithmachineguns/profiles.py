@@ -0,0 +1,126 @@
+"""Load profiles - one continuous attack in stages
+
+A profile is declared as a dict (in the battle plan or a json file of its
+own) and expanded into stages, each holding the load for a while::
+
+    {"shape": "ramp", "from": 100, "to": 2000, "duration": 600, "steps": 10}
+    {"shape": "spike", "base": 100, "peak": 2000, "duration": 300,
+     "spikeAt": 120, "spikeDuration": 30}
+    {"shape": "step", "stages": [{"concurrency": 100, "duration": 60},
+                                 {"concurrency": 400, "duration": 60}]}
+
+Ramps and spikes change the concurrency - with ``"of": "rate"`` they change
+the (engine only) request rate instead, at a fixed ``"concurrency"``.
+
+Every bee gets its share of each stage (:meth:`Stage.share`) and runs all
+of them back to back in one session, so there is no teardown in between.
+"""
+import json
+
+
+SHAPES = ('ramp', 'step', 'spike')
+
+
+class Stage(object):
+    def __init__(self, concurrency, duration, rate=None, requests=None,
+                 name=''):
+        """
+        :param concurrency: connections of the whole swarm
+        :param duration: seconds the stage lasts
+        :param rate: requests per second of the whole swarm (open loop)
+        :param requests: max. requests of the whole swarm in this stage
+        """
+        self.concurrency = int(concurrency)
+        self.duration = float(duration)
+        self.rate = rate and float(rate)
+        self.requests = requests and int(requests)
+        self.name = name
+
+    def __repr__(self):
+        return '<Stage %s: c=%s %ss%s>' % (
+            self.name, self.concurrency, self.duration,
+            ' %s/s' % self.rate if self.rate else '')
+
+    def __eq__(self, other):
+        return self.asDict == other.asDict
+
+    def share(self, armySize, index):
+        """the part of this stage the bee with `index` has to carry"""
+        if self.concurrency < armySize:
+            raise ValueError(
+                "stage %s: concurrency %s is less than one per bee (%s)" %
+                (self.name, self.concurrency, armySize))
+
+        concurrency = split(self.concurrency, armySize)[index]
+        rate = self.rate and self.rate * concurrency / self.concurrency
+        requests = self.requests and split(self.requests, armySize)[index]
+        return Stage(concurrency, self.duration, rate, requests, self.name)
+
+    @property
+    def asDict(self):
+        return dict(concurrency=self.concurrency, duration=self.duration,
+                    rate=self.rate, requests=self.requests, name=self.name)
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d['concurrency'], d['duration'], d.get('rate'),
+                   d.get('requests'), d.get('name', ''))
+
+
+def split(total, numParts):
+    """split total into numParts integers that add up to total exactly"""
+    share, rest = divmod(total, numParts)
+    return [share + (1 if i < rest else 0) for i in range(numParts)]
+
+
+def expand(profile):
+    """list of stages from a profile declaration"""
+    shape = profile.get('shape')
+    if shape not in SHAPES:
+        raise ValueError("unknown profile shape %r (one of %s)" %
+                         (shape, ', '.join(SHAPES)))
+
+    if shape == 'step':
+        stages = [Stage.from_dict(s) for s in profile['stages']]
+        for index, stage in enumerate(stages):
+            stage.name = stage.name or 'step %s' % (index + 1)
+        return stages
+
+    of = profile.get('of', 'concurrency')
+    if of not in ('concurrency', 'rate'):
+        raise ValueError("a profile changes concurrency or rate, not %r" % of)
+
+    if shape == 'ramp':
+        steps = int(profile.get('steps', 10))
+        start, end = profile['from'], profile['to']
+        values = [start + (end - start) * float(i) / max(steps - 1, 1)
+                  for i in range(steps)]
+        durations = [float(profile['duration']) / steps] * steps
+        names = ['ramp %s/%s' % (i + 1, steps) for i in range(steps)]
+    else:
+        duration = float(profile['duration'])
+        spikeAt = float(profile.get('spikeAt', duration / 3))
+        spikeDuration = float(profile.get('spikeDuration', duration / 3))
+        rest = duration - spikeAt - spikeDuration
+        if rest < 0:
+            raise ValueError("spike ends after the profile (%ss)" % duration)
+
+        values = [profile['base'], profile['peak'], profile['base']]
+        durations = [spikeAt, spikeDuration, rest]
+        names = ['before spike', 'spike', 'after spike']
+    stages = []
+    for value, duration, name in zip(values, durations, names):
+        if not duration:
+            continue
+
+        if of == 'concurrency':
+            stages.append(Stage(int(round(value)), duration, name=name))
+        else:
+            stages.append(Stage(profile['concurrency'], duration, value,
+                                name=name))
+    return stages
+
+
+def load(path):
+    with open(path) as f:
+        return expand(json.load(f))
@@ -0,0 +1,234 @@
+"""Raw samples - one record per request, in columns
+
+For when the histograms are not enough and every single request is needed:
+when it was sent (epoch seconds), how long it took (ms), the status it got
+and which bee sent it. A million requests take 16 MB.
+
+The file is a sequence of blocks after a magic number. Each block holds a
+number of samples, column after column, in fixed width little endian::
+
+    'BEESAMP1' | 'BLK ' count | time (f8) * count | latency (f4) * count |
+                                status (u2) * count | bee (u2) * count | ...
+
+So a file is written incrementally (a block whenever the buffer is full)
+and simply appended to another one, and a reader maps the file into memory
+and turns each column of a block directly into a typed array - there is
+never a python object per sample.
+
+Status 0 means there is none: no response, or the generator doesn't tell
+(ab).
+"""
+import array
+import csv
+import functools
+import itertools
+import mmap
+import operator
+import os
+import struct
+import sys
+
+from beeswithmachineguns.histogram import LatencyHistogram
+
+
+MAGIC = b'BEESAMP1'
+BLOCK = struct.Struct('<4sI')
+BLOCK_TAG = b'BLK '
+COLUMNS = (('time', 'd'), ('latency', 'f'), ('status', 'H'), ('bee', 'H'))
+NO_STATUS = 0
+BLOCK_SIZE = 65536
+"""samples per block - what a writer keeps in memory"""
+_SWAP = sys.byteorder != 'little'
+
+
+def _to_bytes(column):
+    if _SWAP:
+        column = array.array(column.typecode, column)
+        column.byteswap()
+    return column.tostring() if sys.version_info[0] < 3 else column.tobytes()
+
+
+def _from_bytes(typecode, data):
+    column = array.array(typecode)
+    if sys.version_info[0] < 3:
+        column.fromstring(data)
+    else:
+        column.frombytes(data)
+    if _SWAP:
+        column.byteswap()
+    return column
+
+
+def _block_length(count):
+    return BLOCK.size + count * sum(
+        array.array(typecode).itemsize for _, typecode in COLUMNS)
+
+
+class SampleWriter(object):
+    """appends samples to a file, one block at a time"""
+    def __init__(self, path, bee=0, blockSize=BLOCK_SIZE):
+        self.path = path
+        self.bee = bee
+        self.blockSize = blockSize
+        self.count = 0
+        self._f = open(path, 'ab')
+        if self._f.tell() == 0:
+            self._f.write(MAGIC)
+        self._reset()
+
+    def _reset(self):
+        self._columns = dict((name, array.array(typecode))
+                             for name, typecode in COLUMNS)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def record(self, at, latency, status=NO_STATUS):
+        columns = self._columns
+        columns['time'].append(at)
+        columns['latency'].append(latency)
+        columns['status'].append(status)
+        columns['bee'].append(self.bee)
+        self.count += 1
+        if len(columns['time']) >= self.blockSize:
+            self.flush()
+
+    def write_block(self, count, data):
+        """write `count` samples already in columns (bytes per column)"""
+        self._f.write(BLOCK.pack(BLOCK_TAG, count))
+        for name, _ in COLUMNS:
+            self._f.write(data[name])
+
+    def flush(self):
+        count = len(self._columns['time'])
+        if count:
+            self.write_block(count, dict(
+                (name, _to_bytes(self._columns[name])) for name, _ in COLUMNS))
+            self._reset()
+        self._f.flush()
+
+    def close(self):
+        if self._f.closed:
+            return
+
+        self.flush()
+        self._f.close()
+
+
+class Block(object):
+    def __init__(self, data, offset, count):
+        self.count = count
+        self._data = data
+        self._offsets = {}
+        position = offset + BLOCK.size
+        for name, typecode in COLUMNS:
+            length = count * array.array(typecode).itemsize
+            self._offsets[name] = (typecode, position, position + length)
+            position += length
+
+    def __len__(self):
+        return self.count
+
+    def raw(self, name):
+        _, start, end = self._offsets[name]
+        return self._data[start:end]
+
+    def column(self, name):
+        """the column as a typed array"""
+        typecode, start, end = self._offsets[name]
+        return _from_bytes(typecode, self._data[start:end])
+
+
+class SampleReader(object):
+    """reads a sample file through a memory map"""
+    def __init__(self, path):
+        self.path = path
+        self._f = open(path, 'rb')
+        size = os.fstat(self._f.fileno()).st_size
+        self._data = (mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+                      if size else b'')
+        if self._data[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError("%s is no sample file" % path)
+
+        self._blocks = []
+        position = len(MAGIC)
+        while position < size:
+            tag, count = BLOCK.unpack_from(self._data, position)
+            end = position + _block_length(count)
+            if tag != BLOCK_TAG or end > size:
+                # the writer did not get to finish the last block
+                break
+
+            self._blocks.append((position, count))
+            position = end
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return sum(count for _, count in self._blocks)
+
+    def blocks(self):
+        for offset, count in self._blocks:
+            yield Block(self._data, offset, count)
+
+    def column(self, name):
+        """one column of all samples (as typed array - 2 to 8 bytes each)"""
+        typecode = dict(COLUMNS)[name]
+        result = array.array(typecode)
+        for block in self.blocks():
+            result.extend(block.column(name))
+        return result
+
+    def histogram(self, bee=None, relativeError=None):
+        """latencies of all samples (or those of one bee)"""
+        histogram = (LatencyHistogram(relativeError) if relativeError
+                     else LatencyHistogram())
+        for block in self.blocks():
+            latencies = block.column('latency')
+            if bee is not None:
+                ofBee = map(functools.partial(operator.eq, bee),
+                            block.column('bee'))
+                latencies = list(itertools.compress(latencies, ofBee))
+            histogram.record_many(latencies)
+        return histogram
+
+    def close(self):
+        if hasattr(self._data, 'close'):
+            self._data.close()
+        self._f.close()
+
+
+def append(path, sourcePath, bee=None):
+    """append all samples of the file at `sourcePath` to the one at `path`
+
+    :param bee: set the bee of all appended samples (e.g. when collecting
+        the files of the bees on the commander)
+    :returns: number of samples appended
+    """
+    count = 0
+    with SampleReader(sourcePath) as source:
+        with SampleWriter(path) as writer:
+            for block in source.blocks():
+                data = dict((name, block.raw(name)) for name, _ in COLUMNS)
+                if bee is not None:
+                    data['bee'] = _to_bytes(array.array('H', [bee]) *
+                                            len(block))
+                writer.write_block(len(block), data)
+                count += len(block)
+    return count
+
+
+def write_csv(reader, stream):
+    """all samples as csv rows, written block by block"""
+    writer = csv.writer(stream)
+    writer.writerow([name for name, _ in COLUMNS])
+    for block in reader.blocks():
+        writer.writerows(zip(*[block.column(name) for name, _ in COLUMNS]))
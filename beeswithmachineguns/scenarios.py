@@ -0,0 +1,129 @@
+"""Weighted mixes of requests
+
+A scenario file lists the endpoints to attack and how often each of them is
+hit relative to the others::
+
+    {"requests": [
+        {"name": "home", "url": "http://x/", "weight": 10},
+        {"name": "search", "url": "http://x/search?q=bee", "weight": 3},
+        {"name": "login", "url": "http://x/login", "method": "POST",
+         "body": "{\\"user\\": \\"bee\\"}", "contentType": "application/json",
+         "headers": ["X-Bee: yes"], "weight": 1}]}
+
+Every bee gets the whole file and draws its requests from the mix with a
+seed of its own (Vose's alias method: one random index and one coin flip per
+request, no matter how many endpoints there are). The counts of the swarm
+are split over the bees as usual, so together they follow the weights.
+"""
+import json
+import random
+
+from beeswithmachineguns.histogram import LatencyHistogram
+
+
+class AliasTable(object):
+    """Vose's alias method - O(n) setup, O(1) weighted picks"""
+    def __init__(self, weights):
+        weights = [float(w) for w in weights]
+        total = sum(weights)
+        if not weights or total <= 0 or min(weights) < 0:
+            raise ValueError("weights need to be >= 0 and > 0 in total: %s" %
+                             weights)
+
+        numEntries = len(weights)
+        scaled = [w * numEntries / total for w in weights]
+        self.probability = [1.0] * numEntries
+        self.alias = list(range(numEntries))
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            self.probability[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] += scaled[less] - 1
+            (small if scaled[more] < 1 else large).append(more)
+
+    def __len__(self):
+        return len(self.probability)
+
+    def pick(self, rand):
+        """index of an entry - `rand` returns floats in [0, 1)"""
+        index = int(rand() * len(self.probability))
+        if rand() < self.probability[index]:
+            return index
+
+        return self.alias[index]
+
+
+class Endpoint(object):
+    def __init__(self, url, weight=1, method=None, body=None,
+                 contentType=None, headers=(), name=None):
+        self.url = url
+        self.weight = weight
+        self.method = method
+        self.body = body
+        self.contentType = contentType
+        self.headers = list(headers)
+        self.name = name or url
+
+    @property
+    def asDict(self):
+        return dict(url=self.url, weight=self.weight, method=self.method,
+                    body=self.body, contentType=self.contentType,
+                    headers=self.headers, name=self.name)
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d['url'], d.get('weight', 1), d.get('method'),
+                   d.get('body'), d.get('contentType'), d.get('headers', ()),
+                   d.get('name'))
+
+
+class Scenario(object):
+    def __init__(self, endpoints):
+        self.endpoints = endpoints
+        self.table = AliasTable([e.weight for e in endpoints])
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    def picker(self, seed=None):
+        """function returning the index of the next endpoint to hit"""
+        rand = random.Random(seed).random
+        table = self.table
+        return lambda: table.pick(rand)
+
+    @property
+    def asDict(self):
+        return dict(requests=[e.asDict for e in self.endpoints])
+
+    @classmethod
+    def from_dict(cls, d):
+        """from ``{"requests": [...]}`` or just the list of requests"""
+        requests = d['requests'] if isinstance(d, dict) else d
+        return cls([Endpoint.from_dict(r) for r in requests])
+
+
+def load(path):
+    with open(path) as f:
+        return Scenario.from_dict(json.load(f))
+
+
+def merge_endpoint_stats(statsLists):
+    """merge lists of per endpoint stats (complete, failed, histogram)"""
+    merged = None
+    for stats in statsLists:
+        if merged is None:
+            merged = [dict(s, histogram=LatencyHistogram.from_dict(
+                s['histogram'])) for s in stats]
+            continue
+
+        for total, s in zip(merged, stats):
+            total['complete'] += s['complete']
+            total['failed'] += s['failed']
+            total['histogram'].merge(
+                LatencyHistogram.from_dict(s['histogram']))
+    for total in merged or []:
+        total['histogram'] = total['histogram'].asDict
+    return merged
@@ -0,0 +1,177 @@
+"""Keeping ssh sessions to the bees open between attacks
+
+A session is opened the first time a bee is talked to and reused from then
+on - for every step of an attack and for every following attack in the same
+process. Sessions are health checked before they are handed out and closed
+after they have not been used for a while - unless they are checked out:
+a session in use (see :meth:`SessionPool.using`) is never idle, however long
+the attack it serves takes.
+
+For the ssh binary (used by plumbum) the same is achieved across processes
+with OpenSSH's ControlMaster, see :data:`CONTROL_MASTER_OPTS`.
+"""
+import atexit
+import contextlib
+import logging
+import os
+import threading
+import time
+
+from beeswithmachineguns import localhive
+
+
+log = logging.getLogger('bees.sessions')
+
+DEFAULT_IDLE_TIMEOUT = 600
+CONTROL_MASTER_OPTS = [
+    '-oControlMaster=auto',
+    # a hash of host, port and user - the names of EC2 hosts make paths
+    # longer than a unix socket may be (104 bytes on macOS)
+    '-oControlPath=%s' % os.path.expanduser('~/.ssh/bees-%C'),
+    '-oControlPersist=%s' % DEFAULT_IDLE_TIMEOUT]
+"""ssh options sharing one authenticated connection per bee"""
+
+
+class Session(object):
+    def __init__(self, connection, clock):
+        self.connection = connection
+        self.lastUsed = clock()
+
+
+class SessionPool(object):
+    def __init__(self, connect, isAlive, close=None,
+                 idleTimeout=DEFAULT_IDLE_TIMEOUT, clock=time.time):
+        """
+        :param connect: key -> new connection
+        :param isAlive: connection -> bool (cheap health check)
+        :param close: connection -> None (default: ``connection.close()``)
+        :param idleTimeout: seconds after which unused sessions are closed
+        """
+        self._connect = connect
+        self._isAlive = isAlive
+        self._close = close or (lambda connection: connection.close())
+        self.idleTimeout = idleTimeout
+        self._clock = clock
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._keyLocks = {}
+        self._checkedOut = {}
+        """key -> number of users holding its session right now"""
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, key):
+        return key in self._sessions
+
+    def get(self, key):
+        """healthy connection for `key` - reused if possible"""
+        self.evict_idle()
+        with self._key_lock(key):
+            session = self._sessions.get(key)
+            if session and self._is_alive(session.connection):
+                session.lastUsed = self._clock()
+                return session.connection
+
+            if session:
+                log.info("session to %s is dead - reconnecting", key)
+                self.discard(key)
+            connection = self._connect(key)
+            with self._lock:
+                self._sessions[key] = Session(connection, self._clock)
+            return connection
+
+    def checkout(self, key):
+        """like :meth:`get`, but the session is not evicted as idle until
+        it is given back with :meth:`release`"""
+        with self._lock:
+            self._checkedOut[key] = self._checkedOut.get(key, 0) + 1
+        try:
+            return self.get(key)
+        except Exception:
+            self.release(key)
+            raise
+
+    def release(self, key):
+        """give back a session from :meth:`checkout` - it is idle from now"""
+        with self._lock:
+            users = self._checkedOut.pop(key, 0) - 1
+            if users > 0:
+                self._checkedOut[key] = users
+            session = self._sessions.get(key)
+            if session:
+                session.lastUsed = self._clock()
+
+    @contextlib.contextmanager
+    def using(self, key):
+        """connection for `key`, checked out for the ``with`` block"""
+        connection = self.checkout(key)
+        try:
+            yield connection
+        finally:
+            self.release(key)
+
+    def discard(self, key):
+        """close and forget the session (e.g. after a socket error)"""
+        with self._lock:
+            session = self._sessions.pop(key, None)
+        if session:
+            self._safe_close(session.connection)
+
+    def evict_idle(self):
+        now = self._clock()
+        with self._lock:
+            idle = [key for key, session in self._sessions.items()
+                    if now - session.lastUsed > self.idleTimeout and
+                    key not in self._checkedOut]
+            evicted = [self._sessions.pop(key) for key in idle]
+        for session in evicted:
+            self._safe_close(session.connection)
+        if evicted:
+            log.debug("closed %s idle sessions", len(evicted))
+
+    def close_all(self):
+        with self._lock:
+            sessions, self._sessions = self._sessions, {}
+        for session in sessions.values():
+            self._safe_close(session.connection)
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._keyLocks.setdefault(key, threading.Lock())
+
+    def _is_alive(self, connection):
+        try:
+            return self._isAlive(connection)
+        except Exception:
+            return False
+
+    def _safe_close(self, connection):
+        try:
+            self._close(connection)
+        except Exception:
+            log.debug("closing %s failed", connection, exc_info=True)
+
+
+def paramiko_is_alive(client):
+    """transport up and able to send (a keepalive ignore message)"""
+    transport = client.get_transport()
+    if transport is None or not transport.is_active():
+        return False
+
+    transport.send_ignore()
+    return True
+
+
+def plumbum_is_alive(machine):
+    """local machines (see :mod:`localhive`) are always alive, ssh ones
+    while their session is"""
+    if isinstance(machine, localhive.LocalMachine):
+        return True
+
+    return bool(machine._session.alive())
+
+
+def close_at_exit(pool):
+    atexit.register(pool.close_all)
+    return pool
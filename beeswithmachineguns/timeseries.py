@@ -0,0 +1,157 @@
+"""What happened in each second of an attack
+
+Every bee sorts its requests into one bucket per second (by the second the
+request was sent in - ab's ``-g`` output only has that one): number of
+requests, failures and a latency histogram. The buckets are keyed by the
+epoch second, so the series of all bees line up by their clocks (synced by
+ntp) and are merged exactly, like the histograms.
+
+A series takes memory per second of the attack, not per request, so long
+attacks at high rates are fine.
+"""
+import csv
+import json
+
+from beeswithmachineguns.histogram import (
+    DEFAULT_RELATIVE_ERROR, LatencyHistogram)
+
+
+PERCENTS = (50, 90, 99)
+"""latency percentiles in the exported rows"""
+
+
+class Bucket(object):
+    def __init__(self, relativeError=DEFAULT_RELATIVE_ERROR):
+        self.complete = 0
+        self.failed = 0
+        self.histogram = LatencyHistogram(relativeError)
+
+    def merge(self, other):
+        self.complete += other.complete
+        self.failed += other.failed
+        self.histogram.merge(other.histogram)
+        return self
+
+
+class TimeSeries(object):
+    def __init__(self, relativeError=DEFAULT_RELATIVE_ERROR):
+        self.relativeError = relativeError
+        self.buckets = {}
+        """epoch second -> :class:`Bucket`"""
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def __eq__(self, other):
+        return (isinstance(other, TimeSeries) and
+                self.relativeError == other.relativeError and
+                self._counts == other._counts)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '<%s %s seconds>' % (self.__class__.__name__, len(self))
+
+    @property
+    def _counts(self):
+        return dict((second, (b.complete, b.failed, b.histogram))
+                    for second, b in self.buckets.items())
+
+    @property
+    def first(self):
+        return min(self.buckets) if self.buckets else None
+
+    @property
+    def last(self):
+        return max(self.buckets) if self.buckets else None
+
+    def bucket(self, at):
+        """the bucket of the second `at` (epoch seconds) falls in"""
+        second = int(at)
+        bucket = self.buckets.get(second)
+        if bucket is None:
+            bucket = self.buckets[second] = Bucket(self.relativeError)
+        return bucket
+
+    def record(self, at, latency, failed=False):
+        """a request sent at `at` (epoch seconds) that took `latency` ms"""
+        bucket = self.bucket(at)
+        bucket.complete += 1
+        bucket.failed += bool(failed)
+        bucket.histogram.record(latency)
+
+    def record_failures(self, at, count=1):
+        """requests without an answer (and so without a latency)"""
+        bucket = self.bucket(at)
+        bucket.complete += count
+        bucket.failed += count
+
+    def merge(self, other):
+        """add all buckets of `other`, second by second (exact)"""
+        for second, bucket in other.buckets.items():
+            self.bucket(second).merge(bucket)
+        return self
+
+    @classmethod
+    def merged(cls, series, relativeError=DEFAULT_RELATIVE_ERROR):
+        series = list(series)
+        if series:
+            relativeError = series[0].relativeError
+        result = cls(relativeError)
+        for s in series:
+            result.merge(s)
+        return result
+
+    def rows(self, percents=PERCENTS):
+        """one dict per second from the first to the last, gaps included"""
+        if not self.buckets:
+            return []
+
+        empty = Bucket(self.relativeError)
+        rows = []
+        for second in range(self.first, self.last + 1):
+            bucket = self.buckets.get(second, empty)
+            row = dict(second=second, elapsed=second - self.first,
+                       complete=bucket.complete, failed=bucket.failed,
+                       mean=bucket.histogram.mean)
+            for percent, value in zip(
+                    percents, bucket.histogram.percentiles(percents)):
+                row['p%s' % percent] = value
+            rows.append(row)
+        return rows
+
+    @property
+    def asDict(self):
+        """json compatible representation (see :meth:`from_dict`)"""
+        return dict(
+            relativeError=self.relativeError,
+            buckets=[[second, b.complete, b.failed, b.histogram.asDict]
+                     for second, b in sorted(self.buckets.items())])
+
+    @classmethod
+    def from_dict(cls, data):
+        series = cls(data['relativeError'])
+        for second, complete, failed, histogram in data['buckets']:
+            bucket = series.bucket(second)
+            bucket.complete = complete
+            bucket.failed = failed
+            bucket.histogram = LatencyHistogram.from_dict(histogram)
+        return series
+
+
+def write(series, path, percents=PERCENTS):
+    """export to csv - or json if `path` ends with .json"""
+    rows = series.rows(percents)
+    if path.endswith('.json'):
+        with open(path, 'w') as f:
+            json.dump(rows, f, indent=1)
+        return
+
+    fields = (['second', 'elapsed', 'complete', 'failed', 'mean'] +
+              ['p%s' % p for p in percents])
+    with open(path, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(fields)
+        for row in rows:
+            writer.writerow([row[field] for field in fields])
@@ -0,0 +1,208 @@
+"""Warm-up - fill the caches on the way to the target before the attack
+
+Every bee requests every URL of the plan from where she is (so the caches
+and CDN edges near her get warm, not those near the commander), in rounds:
+each round asks each URL that isn't warm yet a few times, at most
+`concurrency` requests at a time, until the URL's hit rate doesn't change
+any more from one round to the next.
+
+A response is a hit if a cache says so - ``HIT`` in ``X-Cache``,
+``CF-Cache-Status``, ``X-Cache-Status`` or ``X-Proxy-Cache``, or an ``Age``
+above 0. URLs whose responses carry none of those are warm when their
+median latency doesn't change any more instead (application caches, JITs
+and connection pools don't say when they are warm).
+
+The agent warms up before it reports ready, so none of it is in the numbers
+of the attack - only in the ``warmup`` frame with what it took.
+"""
+import threading
+import time
+
+try:
+    from urllib import request as urllib_request
+    from urllib.error import HTTPError
+    import queue
+except ImportError:  # python 2
+    import urllib2 as urllib_request
+    from urllib2 import HTTPError
+    import Queue as queue
+
+
+CACHE_HEADERS = ('x-cache', 'cf-cache-status', 'x-cache-status',
+                 'x-proxy-cache')
+SECONDS = 30.0
+"""no new round after this long"""
+CONCURRENCY = 8
+PER_ROUND = 10
+"""requests per URL and round at least - fewer make for noisy rates"""
+TOLERANCE = 0.1
+TIMEOUT = 10.0
+MIN_ROUNDS = 2
+GIVE_UP_ROUNDS = 2
+"""rounds without a single answer after which a URL is given up"""
+
+
+def fetch(request):
+    """the (lower case) response headers of one request - raises if there is
+    no answer at all (an error status is an answer)"""
+    body = request.get('body')
+    if request.get('bodyPath'):
+        with open(request['bodyPath'], 'rb') as f:
+            body = f.read()
+    if body is not None and not isinstance(body, bytes):
+        body = body.encode('utf-8')
+    r = urllib_request.Request(request['url'], data=body)
+    if request.get('method'):
+        r.get_method = lambda: request['method']
+    for header in request.get('headers') or ():
+        name, _, value = header.partition(':')
+        r.add_header(name.strip(), value.strip())
+    try:
+        response = urllib_request.urlopen(r, timeout=TIMEOUT)
+    except HTTPError as e:
+        response = e
+    try:
+        response.read()
+        return dict(
+            (k.lower(), v) for k, v in response.info().items())
+    finally:
+        response.close()
+
+
+def is_hit(headers):
+    """True/False if a cache told, None if none did"""
+    told = False
+    for name in CACHE_HEADERS:
+        if name in headers:
+            if 'HIT' in headers[name].upper():
+                return True
+
+            told = True
+    if 'age' in headers:
+        try:
+            return int(headers['age']) > 0
+        except ValueError:
+            pass
+    return False if told else None
+
+
+class UrlWarmup(object):
+    """the rounds of one URL"""
+    def __init__(self, request):
+        self.request = request
+        self.rounds = []
+        """(hit rate or None, median ms, answered) per round"""
+        self.requests = 0
+        self.failed = 0
+        self.error = None
+        self.warm = False
+        self.givenUp = False
+        self._round = []
+        self._silentRounds = 0
+
+    @property
+    def done(self):
+        return self.warm or self.givenUp
+
+    def add(self, ms, hit=None, error=None):
+        """one request of the current round (ms None if no answer)"""
+        self.requests += 1
+        if ms is None:
+            self.failed += 1
+            self.error = error
+        else:
+            self._round.append((ms, hit))
+
+    def end_round(self, tolerance):
+        answers, self._round = self._round, []
+        if not answers:
+            self.rounds.append((None, None, 0))
+            self._silentRounds += 1
+            self.givenUp = self._silentRounds >= GIVE_UP_ROUNDS
+            return
+
+        self._silentRounds = 0
+        told = [hit for _, hit in answers if hit is not None]
+        hitRate = float(sum(told)) / len(told) if told else None
+        latencies = sorted(ms for ms, _ in answers)
+        medianMs = latencies[len(latencies) // 2]
+        self.rounds.append((hitRate, medianMs, len(answers)))
+        if len(self.rounds) < MIN_ROUNDS or not self.rounds[-2][2]:
+            return
+
+        lastRate, lastMs, _ = self.rounds[-2]
+        if hitRate is not None and lastRate is not None:
+            self.warm = hitRate == 1.0 or abs(hitRate - lastRate) <= tolerance
+        else:
+            self.warm = abs(medianMs - lastMs) <= tolerance * lastMs
+
+    @property
+    def asDict(self):
+        hitRate, medianMs, _ = self.rounds[-1] if self.rounds else (
+            None, None, 0)
+        return dict(url=self.request['url'], rounds=len(self.rounds),
+                    requests=self.requests, failed=self.failed,
+                    hitRate=hitRate, ms=medianMs, warm=self.warm,
+                    error=self.error if self.givenUp else None)
+
+
+def warm_up(requests, concurrency=CONCURRENCY, seconds=SECONDS,
+            tolerance=TOLERANCE, perRound=None, fetch=fetch,
+            clock=time.time):
+    """warm up the URLs of `requests` - what it took
+
+    :param requests: dicts with url and optionally method, headers, body
+        (or bodyPath)
+    :param concurrency: requests at a time, for all URLs together
+    :param seconds: no new round after this long
+    :param tolerance: change of the hit rate (or relative change of the
+        median latency) from one round to the next that counts as stable
+    :param perRound: requests per URL and round (default: `concurrency`,
+        at least :data:`PER_ROUND`)
+    """
+    urls = [UrlWarmup(r) for r in requests]
+    perRound = perRound or max(concurrency, PER_ROUND)
+    startedAt = clock()
+    while clock() - startedAt < seconds:
+        pending = [u for u in urls if not u.done]
+        if not pending:
+            break
+
+        tasks = queue.Queue()
+        for url in pending:
+            for _ in range(perRound):
+                tasks.put(url)
+        workers = [threading.Thread(target=_work, args=(tasks, fetch, clock))
+                   for _ in range(min(concurrency, tasks.qsize()))]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        for url in pending:
+            url.end_round(tolerance)
+    return dict(seconds=clock() - startedAt,
+                requests=sum(u.requests for u in urls),
+                failed=sum(u.failed for u in urls),
+                urls=[u.asDict for u in urls])
+
+
+def _work(tasks, fetch, clock):
+    while True:
+        try:
+            url = tasks.get_nowait()
+        except queue.Empty:
+            return
+
+        start = clock()
+        try:
+            headers = fetch(url.request)
+        except Exception as e:
+            with _lock:
+                url.add(None, error=str(e) or e.__class__.__name__)
+            continue
+
+        with _lock:
+            url.add((clock() - start) * 1000, is_hit(headers))
+
+
+_lock = threading.Lock()
@@ -0,0 +1,149 @@
+"""Work queue - the requests of an attack handed out in batches on demand
+
+Instead of a fixed share each, the bees ask for their next batch when they
+are done with the last one, so the faster bees take more of the work and a
+slow bee (a noisy neighbour, a long way to the target) holds up no more
+than the batch she is working on::
+
+    bees attack -u http://x/ -n 100000 -c 200 --batch 2000
+
+A bee that is lost hands her unfinished batch back, and so does a bee that
+lags behind: a batch that takes much longer than the others (or longer than
+a timeout) is taken away from her and handed to the next bee that asks.
+Bees that run out of work wait while batches are still out - they might
+come back - so the requests that complete add up to the total exactly, as
+long as one bee is left.
+"""
+import logging
+import threading
+import time
+
+
+log = logging.getLogger('bees.workqueue')
+
+BATCHES_PER_BEE = 8
+"""batches each bee gets with the default batch size"""
+STRAGGLER_FACTOR = 4.0
+"""a batch is taken away if it takes this many times as long as usual ..."""
+MIN_STRAGGLER_SECONDS = 10.0
+"""... but not before it has been out for this long"""
+POLL = 0.5
+
+
+def batch_size(total, bees, concurrency):
+    """a few batches per bee, but not fewer requests than connections"""
+    return max(1, concurrency, total // (bees * BATCHES_PER_BEE))
+
+
+class WorkQueue(object):
+    def __init__(self, total, batchSize, timeout=None, clock=time.time):
+        """
+        :param total: requests to hand out
+        :param batchSize: requests per batch (the last one may be smaller)
+        :param timeout: seconds a batch may take before it is handed to
+            another bee (None: :data:`STRAGGLER_FACTOR` times the median)
+        """
+        self.total = total
+        self.batchSize = batchSize
+        self.timeout = timeout
+        self._clock = clock
+        self._unissued = total
+        self._returned = []
+        """batches of lost or lagging bees, handed out first"""
+        self._out = {}
+        """bee -> (requests, handed out at) of the batch she works on"""
+        self._secondsPerRequest = []
+        self.done = 0
+        self.reassigned = 0
+        self.batches = {}
+        """bee -> number of batches she completed"""
+        self._condition = threading.Condition()
+
+    def __repr__(self):
+        return '<WorkQueue %s/%s done, %s out>' % (
+            self.done, self.total, len(self._out))
+
+    @property
+    def remaining(self):
+        """requests neither done nor being worked on"""
+        with self._condition:
+            return self._unissued + sum(self._returned)
+
+    @property
+    def finished(self):
+        return self.done == self.total
+
+    def take(self, bee, wait=True):
+        """requests of the next batch for `bee` - 0 if there is no more work
+
+        :param wait: while batches are out (they might come back) wait for
+            them - if False there is no more work for now
+        """
+        with self._condition:
+            while True:
+                if self._returned:
+                    requests = self._returned.pop(0)
+                else:
+                    requests = min(self.batchSize, self._unissued)
+                    self._unissued -= requests
+                if requests or not wait or not self._out:
+                    break
+
+                self._condition.wait(POLL)
+            if requests:
+                self._out[bee] = (requests, self._clock())
+            return requests
+
+    def begin(self, bee, at):
+        """`bee` starts on her batch only at `at` (the start of the attack)"""
+        with self._condition:
+            if bee in self._out:
+                self._out[bee] = (self._out[bee][0], at)
+
+    def complete(self, bee):
+        """`bee` is done with her batch - False if it was taken away"""
+        with self._condition:
+            batch = self._out.pop(bee, None)
+            if batch is None:
+                return False
+
+            requests, handedOut = batch
+            self.done += requests
+            self.batches[bee] = self.batches.get(bee, 0) + 1
+            self._secondsPerRequest.append(
+                (self._clock() - handedOut) / requests)
+            self._condition.notify_all()
+            return True
+
+    def fail(self, bee):
+        """take the batch away from `bee` - returns its requests (0: none)"""
+        with self._condition:
+            batch = self._out.pop(bee, None)
+            if batch is None:
+                return 0
+
+            requests = batch[0]
+            self._returned.append(requests)
+            self.reassigned += requests
+            log.info("batch of %s requests of bee %s goes back", requests, bee)
+            self._condition.notify_all()
+            return requests
+
+    def overdue(self):
+        """bees whose batch is out for too long"""
+        now = self._clock()
+        with self._condition:
+            return sorted(bee for bee, (requests, handedOut) in
+                          self._out.items()
+                          if now - handedOut > self._limit(requests))
+
+    def _limit(self, requests):
+        if self.timeout is not None:
+            return self.timeout
+
+        if not self._secondsPerRequest:
+            return float('inf')
+
+        usual = sorted(self._secondsPerRequest)[
+            len(self._secondsPerRequest) // 2]
+        return max(MIN_STRAGGLER_SECONDS, STRAGGLER_FACTOR * usual * requests)
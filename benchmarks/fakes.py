@@ -0,0 +1,229 @@
+"""Synthetic data and fake bees for the benchmarks
+
+Everything is generated from a seeded random, so every run (and every
+commit) gets the same input.
+"""
+import json
+import math
+import random
+
+from beeswithmachineguns import agent, drivers
+from beeswithmachineguns.histogram import LatencyHistogram
+from beeswithmachineguns.timeseries import TimeSeries
+
+
+AB_REPORT = """\
+This is ApacheBench, Version 2.3 <$Revision: 1528965 $>
+Copyright 1996 Adam Twiss, Zeus Technology Ltd, http://www.zeustech.net/
+Licensed to The Apache Software Foundation, http://www.apache.org/
+
+Benchmarking target.example.com (be patient)
+
+
+Server Software:        nginx
+Server Hostname:        target.example.com
+Server Port:            80
+
+Document Path:          /
+Document Length:        612 bytes
+
+Concurrency Level:      %(concurrency)s
+Time taken for tests:   %(duration).3f seconds
+Complete requests:      %(complete)s
+Failed requests:        %(failed)s
+Total transferred:      %(transferred)s bytes
+HTML transferred:       %(html)s bytes
+Requests per second:    %(rps).2f [#/sec] (mean)
+Time per request:       %(tpr).3f [ms] (mean)
+Time per request:       %(tprAll).3f [ms] (mean, across all concurrent requests)
+Transfer rate:          %(rate).2f [Kbytes/sec] received
+
+Connection Times (ms)
+              min  mean[+/-sd] median   max
+Connect:        1    2   0.4      2       4
+Processing:     3   %(tprInt)s  11.2     %(tprInt)s     212
+Waiting:        3   %(tprInt)s  11.2     %(tprInt)s     212
+Total:          4   %(tprInt)s  11.2     %(tprInt)s     214
+
+Percentage of the requests served within a certain time (ms)
+  50%%     %(tprInt)s
+  66%%     %(tprInt)s
+  75%%     %(tprInt)s
+  80%%     %(tprInt)s
+  90%%     %(tprInt)s
+  95%%     %(tprInt)s
+  98%%     %(tprInt)s
+  99%%     %(tprInt)s
+ 100%%    214 (longest request)
+"""
+
+
+def ab_report(rand, complete=1000, concurrency=10):
+    tpr = rand.lognormvariate(math.log(30), 0.3)
+    duration = complete * tpr / concurrency / 1000
+    return AB_REPORT % dict(
+        concurrency=concurrency, duration=duration, complete=complete,
+        failed=rand.randint(0, complete // 100), transferred=complete * 850,
+        html=complete * 612, rps=complete / duration, tpr=tpr,
+        tprAll=tpr / concurrency, rate=complete * 850 / duration / 1024,
+        tprInt=int(tpr))
+
+
+def histogram(rand, numRequests=1000, median=30.0, spread=0.5):
+    """response times as a bee would report them"""
+    h = LatencyHistogram()
+    for _ in range(numRequests):
+        h.record(rand.lognormvariate(math.log(median), spread))
+    return h
+
+
+def timeseries(rand, numRequests=1000, seconds=10, median=30.0, spread=0.5):
+    series = TimeSeries()
+    for _ in range(numRequests):
+        series.record(rand.uniform(0, seconds),
+                      rand.lognormvariate(math.log(median), spread))
+    return series
+
+
+def bee_results(numBees, seed=0):
+    """what ``bees._attack`` returns for a swarm - results and params"""
+    rand = random.Random(seed)
+    results = []
+    params = []
+    for i in range(numBees):
+        h = histogram(rand, median=rand.uniform(20, 40))
+        results.append({
+            'complete_requests': 1000.0,
+            'failed_requests': float(rand.randint(0, 10)),
+            'requests_per_second': rand.uniform(300, 400),
+            'ms_per_request': h.mean,
+            'request_time_histogram': h,
+            'start_skew': rand.uniform(0, 0.005),
+            'clock_offset': rand.uniform(-0.01, 0.01)})
+        params.append({'i': i, 'instance_id': 'i-%08x' % i, 'tpr': None,
+                       'rps': None, 'rate': None, 'profile': None,
+                       'scenario_payload': None})
+    return results, params
+
+
+def frame(frameType, compress=False, **payload):
+    payload['type'] = frameType
+    payload['t'] = 0.0
+    line = json.dumps(payload)
+    if compress:
+        line = json.dumps(dict(type=frameType, t=0.0,
+                               zlib=agent._pack(line.encode('utf-8'))))
+    return agent.FRAME_PREFIX + line + '\n'
+
+
+class Answers(object):
+    """the frames all fake bees answer with - rendered once, up front"""
+    def __init__(self, seed=0, numProgress=3):
+        rand = random.Random(seed)
+        h = histogram(rand)
+        self.ready = frame('ready')
+        self.progress = [frame('progress', complete=n * 250, failed=0,
+                               histogram=histogram(rand, 250).asDict)
+                         for n in range(1, numProgress + 1)]
+        # compressed like the agent's - the times in it are made up, the
+        # commander only reports the skew between them
+        self._result = frame('result', compress=True, exitCode=0,
+                             summary=drivers.parse_ab_report(
+                                 ab_report(rand)), errors='',
+                             histogram=h.asDict,
+                             timeseries=timeseries(rand).asDict,
+                             startAt=0.0, startedAt=0.001)
+
+    def result(self, startAt):
+        return self._result
+
+
+class FakeStdin(object):
+    def __init__(self):
+        self.lines = []
+
+    def write(self, data):
+        self.lines.append(data)
+
+    def flush(self):
+        pass
+
+
+class FakeFile(object):
+    def __init__(self, store, path):
+        self.store = store
+        self.path = path
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(data)
+
+    def close(self):
+        self.store[self.path] = b''.join(self.chunks)
+
+
+class FakeSftp(object):
+    def __init__(self, store):
+        self.store = store
+
+    def stat(self, path):
+        if path not in self.store:
+            raise IOError(2, 'No such file', path)
+
+        return FakeStat(len(self.store[path]))
+
+    def mkdir(self, path):
+        pass
+
+    def open(self, path, mode='r'):
+        return FakeFile(self.store, path)
+
+    def rename(self, oldPath, newPath):
+        self.store[newPath] = self.store.pop(oldPath)
+
+    def remove(self, path):
+        del self.store[path]
+
+    def close(self):
+        pass
+
+
+class FakeStat(object):
+    def __init__(self, size):
+        self.st_size = size
+
+
+class FakeBee(object):
+    """stands in for the paramiko client of a bee running the agent"""
+    answers = None
+
+    def __init__(self, sessionKey):
+        self.sessionKey = sessionKey
+        self.store = {}
+
+    def exec_command(self, command):
+        stdin = FakeStdin()
+        return stdin, self._frames(stdin), None
+
+    def _frames(self, stdin):
+        yield self.answers.ready
+        # the commander answers "go <epoch>" before reading on
+        startAt = float(stdin.lines[-1].split()[1])
+        for line in self.answers.progress:
+            yield line
+        yield self.answers.result(startAt)
+
+    def open_sftp(self):
+        return FakeSftp(self.store)
+
+    def get_transport(self):
+        return self
+
+    def is_active(self):
+        return True
+
+    def send_ignore(self):
+        pass
+
+    def close(self):
+        pass
@@ -0,0 +1,330 @@
+"""Benchmarks of the commander's hot paths
+
+    python -m benchmarks.run [--save] [--threshold 0.25] [name ...]
+
+Each scenario runs in a process of its own (so the peak memory of one does
+not hide the next) and is compared to ``baseline.json``: slower by more than
+the threshold, or more memory by more than the threshold, fails the run.
+
+Times are the median of the repeats, and they are compared after scaling
+the baseline by a calibration - a fixed piece of python timed in the same
+process - so a machine that is busier or slower than when the baseline was
+recorded doesn't look like a regression. The threshold for the time grows
+with the noise (the relative median absolute deviation of the repeats, now
+and in the baseline), and a scenario that looks slower is measured once
+more before it fails the run.
+
+The baseline still holds the numbers of the machine it was recorded on -
+record it again with ``--save`` after moving to another one (or after a
+change that is supposed to cost more).
+
+The bees are fakes that answer with pre-rendered agent frames, so the
+numbers are all commander: fan-out, session and payload bookkeeping, start
+barrier, frame parsing, summarizing and the csv - plus the parsing of ab's
+report, which the ab driver does on the bees.
+"""
+import json
+import multiprocessing
+import optparse
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks import fakes
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+THRESHOLD = 0.25
+NOISE_FACTOR = 3
+"""deviations of the repeats (now plus baseline) added to the threshold"""
+# timer noise and allocator granularity
+SLACK_SECONDS = 0.005
+SLACK_KB = 1024
+CALIBRATION_REPEAT = 3
+"""timings of the calibration before and after each scenario"""
+
+
+class Scenario(object):
+    def __init__(self, name, setup, run, teardown=None, repeat=9):
+        """
+        :param setup: builds the input, not measured - returns the state
+        :param run: the measured part, gets the state
+        :param teardown: cleans up after the repeats, gets the state
+        """
+        self.name = name
+        self.setup = setup
+        self.run = run
+        self.teardown = teardown
+        self.repeat = repeat
+
+    def measure(self, repeat=None):
+        """median of the repeats, their noise, the calibration around them
+        and the memory they took on top of setup"""
+        state = self.setup()
+        calibration = _timings(_calibration_run, CALIBRATION_REPEAT)
+        baseKb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        seconds = _timings(lambda: self.run(state), repeat or self.repeat)
+        peakKb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        calibration += _timings(_calibration_run, CALIBRATION_REPEAT)
+        if self.teardown:
+            self.teardown(state)
+        median = _median(seconds)
+        return dict(seconds=round(median, 6),
+                    noise=round(_median(
+                        [abs(s - median) for s in seconds]) / median, 4),
+                    calibration=round(_median(calibration), 6),
+                    peakKb=peakKb - baseKb)
+
+
+def _timings(func, repeat):
+    seconds = []
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        seconds.append(time.time() - start)
+    return seconds
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return (values[middle] if len(values) % 2 else
+            (values[middle - 1] + values[middle]) / 2.0)
+
+
+def _calibration_run():
+    """dicts, strings and sorting, like the scenarios"""
+    counts = {}
+    for i in range(100000):
+        key = 'bee-%i' % (i % 1000)
+        counts[key] = counts.get(key, 0) + i
+    sorted(counts.items())
+
+
+def parse_ab_setup(numReports=1000):
+    rand = random.Random(0)
+    return [fakes.ab_report(rand) for _ in range(numReports)]
+
+
+def parse_ab_run(reports):
+    from beeswithmachineguns import drivers
+    for report in reports:
+        drivers.parse_ab_report(report)
+
+
+def summarize_setup(numBees):
+    return lambda: fakes.bee_results(numBees)
+
+
+def summarize_run(state):
+    from beeswithmachineguns import bees
+    results, params = state
+    bees._summarize_results(results, params, None)
+
+
+def cdf_setup():
+    from beeswithmachineguns.histogram import LatencyHistogram
+    results, _ = fakes.bee_results(1000)
+    return LatencyHistogram.merged(
+        r['request_time_histogram'] for r in results)
+
+
+def cdf_run(histogram):
+    from beeswithmachineguns import bees
+    for _ in range(100):
+        bees._get_request_time_cdf(histogram)
+
+
+def csv_setup():
+    results, params = fakes.bee_results(1000)
+    directory = tempfile.mkdtemp(prefix='bees-benchmark-')
+    return results, params, cdf_setup(), directory
+
+
+def csv_run(state):
+    from beeswithmachineguns import bees
+    results, params, histogram, directory = state
+    bees._create_request_time_cdf_csv(
+        results, params, bees._get_request_time_cdf(histogram),
+        os.path.join(directory, 'cdf.csv'))
+
+
+def csv_teardown(state):
+    shutil.rmtree(state[-1])
+
+
+class Hive(object):
+    """a swarm of fake bees, as ``bees up`` leaves it behind"""
+    def __init__(self, numBees):
+        from beeswithmachineguns import bees, history, localhive
+        self.numBees = numBees
+        self.dir = tempfile.mkdtemp(prefix='bees-benchmark-')
+        bees.STATE_FILENAME = os.path.join(self.dir, 'bees')
+        localhive.STATE_PATH = os.path.join(self.dir, 'hive.json')
+        history.HISTORY_PATH = os.path.join(self.dir, 'history.sqlite')
+        reservation = localhive.LocalConnection().run_instances(
+            max_count=numBees)
+        bees._write_server_list('bee', 'none', localhive.LOCAL_ZONE,
+                                reservation.instances)
+        fakes.FakeBee.answers = fakes.Answers()
+
+    def attack(self):
+        from beeswithmachineguns import bees, payloads, sessions
+        # a fresh commander - connects and uploads to every bee again
+        bees._sessions = sessions.SessionPool(
+            fakes.FakeBee, sessions.paramiko_is_alive)
+        bees._distributor = payloads.Distributor()
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            bees.attack('http://target.example.com/', self.numBees * 1000,
+                        self.numBees * 10, start_lead=0)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+
+    def close(self):
+        shutil.rmtree(self.dir)
+
+
+def attack_setup(numBees):
+    def setup():
+        from beeswithmachineguns import agent
+        # nothing to sting
+        os.environ[agent.SIMULATE_ENV] = '1'
+        return Hive(numBees)
+    return setup
+
+
+def attack_run(hive):
+    hive.attack()
+
+
+def attack_teardown(hive):
+    hive.close()
+
+
+SCENARIOS = [
+    Scenario('parse_ab', parse_ab_setup, parse_ab_run),
+    Scenario('summarize_10', summarize_setup(10), summarize_run),
+    Scenario('summarize_100', summarize_setup(100), summarize_run),
+    Scenario('summarize_1000', summarize_setup(1000), summarize_run),
+    Scenario('request_time_cdf', cdf_setup, cdf_run),
+    Scenario('request_time_cdf_csv', csv_setup, csv_run, csv_teardown),
+    # threads - these vary more from run to run
+    Scenario('attack_10', attack_setup(10), attack_run, attack_teardown,
+             repeat=20),
+    Scenario('attack_100', attack_setup(100), attack_run, attack_teardown,
+             repeat=20),
+    Scenario('attack_1000', attack_setup(1000), attack_run, attack_teardown,
+             repeat=9),
+]
+
+
+def _measure_in_child(scenario, repeat, connection):
+    # loaded up front, so no scenario pays for the imports
+    from beeswithmachineguns import bees  # noqa
+    connection.send(scenario.measure(repeat))
+    connection.close()
+
+
+def measure(scenario, repeat=None):
+    parent, child = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(
+        target=_measure_in_child, args=(scenario, repeat, child))
+    process.start()
+    result = parent.recv()
+    process.join()
+    return result
+
+
+def regressions(result, baseline, threshold=THRESHOLD):
+    """what got worse beyond the threshold - empty if nothing did"""
+    if baseline is None:
+        return []
+
+    worse = []
+    # baselines recorded before the calibration are taken as they are
+    speed = (result['calibration'] / baseline['calibration']
+             if result.get('calibration') and baseline.get('calibration')
+             else 1.0)
+    allowed = threshold + NOISE_FACTOR * (
+        result.get('noise', 0) + baseline.get('noise', 0))
+    if result['seconds'] > (
+            baseline['seconds'] * speed * (1 + allowed) + SLACK_SECONDS):
+        worse.append('time %.4fs (baseline %.4fs, %.4fs at this speed, '
+                     '+%.0f%% allowed)' % (
+                         result['seconds'], baseline['seconds'],
+                         baseline['seconds'] * speed, allowed * 100))
+    if result['peakKb'] > baseline['peakKb'] * (1 + threshold) + SLACK_KB:
+        worse.append('memory %i KB (baseline %i KB)' % (
+            result['peakKb'], baseline['peakKb']))
+    return worse
+
+
+def load_baseline(path=BASELINE_PATH):
+    if not os.path.exists(path):
+        return {}
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(results, path=BASELINE_PATH):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True,
+                  separators=(',', ': '))
+        f.write('\n')
+
+
+def parse_options(argv):
+    parser = optparse.OptionParser(usage="python -m benchmarks.run [options] [name ...]")
+    parser.add_option('--save', action='store_true', default=False,
+                      help="record the results as the new baseline")
+    parser.add_option('--threshold', type='float', default=THRESHOLD,
+                      help="allowed regression, as a fraction (default: %default)")
+    parser.add_option('--repeat', type='int', default=None,
+                      help="runs per scenario, the median counts")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options, names = parse_options(sys.argv[1:] if argv is None else argv)
+    scenarios = [s for s in SCENARIOS if not names or s.name in names]
+    baseline = load_baseline()
+    results = {}
+    failed = False
+    print('%-22s %12s %8s %12s' % ('scenario', 'seconds', 'noise',
+                                   'peak [KB]'))
+    for scenario in scenarios:
+        result = measure(scenario, options.repeat)
+        worse = regressions(result, baseline.get(scenario.name),
+                            options.threshold)
+        if worse and not options.save:
+            # a slow run is as often the machine as the code
+            again = measure(scenario, options.repeat)
+            if again['seconds'] < result['seconds']:
+                result = again
+            worse = regressions(result, baseline.get(scenario.name),
+                                options.threshold)
+        results[scenario.name] = result
+        failed = failed or bool(worse)
+        print('%-22s %12.4f %7.1f%% %12i%s' % (
+            scenario.name, result['seconds'], result['noise'] * 100,
+            result['peakKb'],
+            '  REGRESSION: ' + ', '.join(worse) if worse else ''))
+    if options.save:
+        baseline.update(results)
+        save_baseline(baseline)
+        print('saved as baseline: %s' % BASELINE_PATH)
+        return 0
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
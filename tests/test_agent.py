@@ -0,0 +1,215 @@
+import io
+import json
+import time
+import zipfile
+
+import pytest
+
+from beeswithmachineguns import agent, samples
+from beeswithmachineguns.histogram import LatencyHistogram
+from beeswithmachineguns.timeseries import TimeSeries
+
+
+def test_frames_roundtrip(capsys):
+    agent.emit('progress', complete=10, failed=1)
+    out, _ = capsys.readouterr()
+    lines = ['Benchmarking somewhere (be patient)\n'] + out.splitlines(True)
+    frames = list(agent.read_frames(lines))
+    assert len(frames) == 1
+    assert frames[0]['type'] == 'progress'
+    assert frames[0]['complete'] == 10
+
+
+def test_progress_is_rate_limited(capsys):
+    progress = agent.Progress(interval=60)
+    for n in range(1000):
+        progress.update(complete=n, latency=n % 7 + 1)
+    progress.maybe_emit(force=True)
+    frames = list(agent.read_frames(capsys.readouterr()[0].splitlines()))
+    assert len(frames) == 2
+    assert frames[-1]['complete'] == 999
+    assert sum(c for _, c in frames[-1]['histogram']['counts']) == 999
+
+
+def test_bundle_is_runnable_zip():
+    bundle = zipfile.ZipFile(io.BytesIO(agent.build_bundle()))
+    names = bundle.namelist()
+    assert '__main__.py' in names
+    assert 'beeswithmachineguns/agent.py' in names
+    assert 'beeswithmachineguns/bees.py' not in names
+
+
+def test_armed_agent_waits_for_go(capsys):
+    startAt = round(time.time() + 0.05, 3)
+    assert agent.wait_for_go(io.StringIO(u'go %f\n' % startAt)) == startAt
+    assert time.time() >= startAt
+    frames = list(agent.read_frames(capsys.readouterr()[0].splitlines()))
+    assert [f['type'] for f in frames] == ['ready']
+
+
+def test_warm_up_comes_before_the_attack(capsys, monkeypatch):
+    monkeypatch.setenv(agent.SIMULATE_ENV, 'latency=1')
+    agent.main(['--warm-up', json.dumps(dict(requests=[], seconds=1)),
+                'ab', '-n', '10', '-c', '1', 'http://x/'])
+    frames = list(agent.read_frames(capsys.readouterr()[0].splitlines()))
+    assert frames[0]['type'] == 'warmup' and frames[0]['urls'] == []
+    assert frames[-1]['type'] == 'result'
+    assert frames[-1]['summary']['complete_requests'] == 10
+
+
+def test_armed_agent_refuses_garbage(capsys):
+    with pytest.raises(ValueError):
+        agent.wait_for_go(io.StringIO(u''))
+
+
+def test_stages_run_back_to_back(capsys):
+    calls = []
+
+    def generate(args, progress, release):
+        calls.append((args, release))
+        histogram = LatencyHistogram()
+        histogram.record(len(calls))
+        series = TimeSeries()
+        series.record(1000 + len(calls), len(calls))
+        return dict(exitCode=0, histogram=histogram.asDict,
+                    timeseries=series.asDict, startAt=None,
+                    startedAt=time.time())
+
+    stages = [dict(concurrency=10, duration=1.5),
+              dict(concurrency=20, duration=1.5, rate=100)]
+    release = object()
+    result = agent.run_stages(generate, ['-k', 'http://x/'], stages,
+                              agent.Progress(), release)
+    assert calls == [
+        (['-k', '-t', '1.5', '-c', '10', 'http://x/'], release),
+        (['-k', '-t', '1.5', '-c', '20', '--rate', '100', 'http://x/'],
+         None)]
+    assert [r['stage'] for r in result['stages']] == stages
+    assert LatencyHistogram.from_dict(result['histogram']).total == 2
+    series = TimeSeries.from_dict(result['timeseries'])
+    assert [(r['second'], r['complete']) for r in series.rows()] == [
+        (1001, 1), (1002, 1)]
+    assert not any('timeseries' in r for r in result['stages'])
+    frames = list(agent.read_frames(capsys.readouterr()[0].splitlines()))
+    assert [f['index'] for f in frames if f['type'] == 'stage'] == [0, 1]
+
+
+def test_queue_runs_batches_until_done(capsys):
+    calls = []
+
+    def generate(args, progress, release):
+        calls.append((args, release))
+        progress.update(complete=int(args[args.index('-n') + 1]))
+        histogram = LatencyHistogram()
+        histogram.record(len(calls))
+        return dict(exitCode=0, histogram=histogram.asDict,
+                    timeseries=TimeSeries().asDict, startAt=None,
+                    startedAt=time.time())
+
+    release = object()
+    progress = agent.Progress(interval=60)
+    result = agent.run_queue(generate, ['-k', 'http://x/'], 10, progress,
+                             release, io.StringIO(u'batch 50\nbatch 4\ndone\n'))
+    assert calls == [
+        (['-k', '-n', '50', '-c', '10', 'http://x/'], release),
+        (['-k', '-n', '4', '-c', '4', 'http://x/'], None)]
+    assert result == dict(exitCode=0, batches=2)
+    # the progress counts on from batch to batch
+    assert progress.complete == 54
+    frames = list(agent.read_frames(capsys.readouterr()[0].splitlines()))
+    assert [f['type'] for f in frames] == [
+        'want', 'progress', 'batch', 'want', 'batch', 'want']
+    batches = [f for f in frames if f['type'] == 'batch']
+    assert [f['requests'] for f in batches] == [50, 4]
+    merged = agent.merge_results(batches)
+    assert LatencyHistogram.from_dict(merged['histogram']).total == 2
+
+
+def test_simulated_attack():
+    progress = agent.Progress(interval=60)
+    result = agent.run_sim(['-r', '-n', '300', '-c', '10', 'http://x/'],
+                           progress, latency=2, failures=0.1, seed=1)
+    summary = result['summary']
+    assert summary['complete_requests'] == progress.complete == 300
+    assert 10 < summary['failed_requests'] < 60
+    histogram = LatencyHistogram.from_dict(result['histogram'])
+    assert histogram.total == 300
+    assert 1 < histogram.percentile(50) < 4
+    rows = TimeSeries.from_dict(result['timeseries']).rows()
+    assert sum(r['complete'] for r in rows) == 300
+    assert sum(r['failed'] for r in rows) == summary['failed_requests']
+
+
+def test_simulated_attack_writes_samples(tmpdir):
+    path = str(tmpdir.join('samples'))
+    result = agent.run_sim(['-n', '200', '-c', '10', 'http://x/'],
+                           agent.Progress(interval=60), samplesPath=path,
+                           latency=2, failures=0.1, seed=1)
+    with samples.SampleReader(path) as reader:
+        assert len(reader) == 200
+        statuses = list(reader.column('status'))
+        assert statuses.count(500) == result['summary']['failed_requests']
+
+
+def test_simulation_settings():
+    assert agent.parse_simulation('latency=20, failures=0.01') == dict(
+        latency=20, failures=0.01)
+
+
+def test_health(capsys):
+    agent.main(['--health'])
+    frames = list(agent.read_frames(capsys.readouterr()[0].splitlines()))
+    assert [f['type'] for f in frames] == ['health']
+    health = frames[0]
+    assert health['cpus'] >= 1
+    assert health['openFiles'] > 0
+    assert health['ab'] == agent._which('ab')
+    assert health['wrk'] == agent._which('wrk')
+    assert health['hey'] == agent._which('hey')
+    if health['cpuIdle'] is not None:
+        assert 0 <= health['cpuIdle'] <= 1
+
+
+def test_compressed_frames(capsys):
+    histogram = LatencyHistogram()
+    for n in range(1000):
+        histogram.record(n)
+    agent.emit('result', compress=True, histogram=histogram.asDict)
+    out = capsys.readouterr()[0]
+    assert '"zlib"' in out
+    frames = list(agent.read_frames(out.splitlines()))
+    assert frames[0]['type'] == 'result'
+    assert LatencyHistogram.from_dict(frames[0]['histogram']) == histogram
+
+
+def test_samples_travel_in_frames(tmpdir, capsys, monkeypatch):
+    monkeypatch.setattr(agent, 'SAMPLES_CHUNK', 1000)
+    path = str(tmpdir.join('samples'))
+    with samples.SampleWriter(path) as writer:
+        for n in range(500):
+            writer.record(1000.0 + n, n, 200)
+    with open(path, 'rb') as f:
+        data = f.read()
+    agent.send_samples(path)
+    assert not tmpdir.join('samples').check()
+    frames = list(agent.read_frames(capsys.readouterr()[0].splitlines()))
+    assert len(frames) == len(data) // 1000 + 1
+    assert b''.join(agent.read_samples(f) for f in frames) == data
+
+
+def test_launch_command_reports_missing_payloads(tmpdir):
+    import subprocess
+    bundle = tmpdir.join('agent.zip')
+    bundle.write_binary(agent.build_bundle())
+    missing = str(tmpdir.join('post'))
+    command = agent.launch_command(str(bundle), [missing], '--health')
+    out = subprocess.check_output(command, shell=True,
+                                  universal_newlines=True)
+    frames = list(agent.read_frames(out.splitlines()))
+    assert frames == [dict(type='missing', paths=' ' + missing)]
+
+    tmpdir.join('post').write('x')
+    out = subprocess.check_output(command, shell=True,
+                                  universal_newlines=True)
+    assert [f['type'] for f in agent.read_frames(out.splitlines())] == [
+        'health']
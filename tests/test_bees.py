@@ -0,0 +1,174 @@
+import pytest
+
+bees = pytest.importorskip('beeswithmachineguns.bees')  # python 2 commander
+from beeswithmachineguns.histogram import LatencyHistogram
+
+
+def summarize(tpr=None, rps=None):
+    histogram = LatencyHistogram()
+    histogram.record(20)
+    results = [dict(complete_requests=100.0, failed_requests=0.0,
+                    requests_per_second=500.0, ms_per_request=20.0,
+                    request_time_histogram=histogram)]
+    params = [dict(i=0, instance_id='i-0', tpr=tpr, rps=rps, rate=None)]
+    return bees._summarize_results(results, params, None)
+
+
+@pytest.mark.parametrize('tpr, rps, accepted', [
+    (None, None, None),
+    (30, None, True),
+    (10, None, False),
+    (None, 400, True),
+    (None, 600, False),
+    (30, 400, True),
+    (10, 400, False),
+    (30, 600, False),
+])
+def test_bounds_have_to_hold_both(tpr, rps, accepted):
+    assert summarize(tpr, rps).get('performance_accepted') is accepted
+
+
+def test_check_bee(tmpdir, monkeypatch):
+    from beeswithmachineguns import agent, payloads
+    from beeswithmachineguns.dispatch import Dispatcher
+
+    monkeypatch.setattr(payloads, 'REMOTE_PAYLOAD_DIR', str(tmpdir))
+    health = bees._check_bee(dict(
+        instance_name='i-1.bees.local', username='bee', key_name='none',
+        dispatcher=Dispatcher(), agent_bundle=payloads.Payload(
+            agent.build_bundle(), name='agent', suffix='.zip')))
+    assert health['error'] is None
+    assert health['ssh_ms'] >= 0
+    assert health['engine'] or health['ab']
+    assert health['ready'] is (health['problem'] is None)
+
+
+def test_ready_for_the_engine_that_will_run():
+    health = dict(ab=False, wrk=True, hey=False, engine=True, cpuIdle=0.9)
+    assert bees._readiness_problem(health, 'ab') == 'no ab (try -E wrk)'
+    assert bees._readiness_problem(health, 'engine') is None
+    assert bees._readiness_problem(dict(health, engine=False, wrk=False), 'engine') == (
+        'no python 3.5+ for the engine')
+    assert bees._readiness_problem(dict(health, cpuIdle=0.2), 'wrk') == 'busy, 20% cpu idle'
+
+
+def test_launch_uploads_what_the_bee_lacks(tmpdir, monkeypatch):
+    from beeswithmachineguns import agent, localhive, payloads
+    from beeswithmachineguns.dispatch import Dispatcher
+
+    monkeypatch.setattr(payloads, 'REMOTE_PAYLOAD_DIR', str(tmpdir))
+    bundle = payloads.Payload(agent.build_bundle(), name='agent',
+                              suffix='.zip')
+    post = payloads.Payload(b'{"x": 1}', name='post')
+    params = dict(agent_bundle=bundle, payloads=[bundle, post],
+                  dispatcher=Dispatcher())
+    client = localhive.LocalClient('i-1.bees.local')
+    for _ in range(2):
+        stdin, stderr, frames = bees._launch(client, 'i-1', params,
+                                             '--health')
+        assert [f['type'] for f in frames] == ['health']
+        assert tmpdir.join(post.remotePath.rsplit('/', 1)[1]).check()
+
+
+def test_share():
+    assert bees._share([33, 33, 33]) == '33'
+    assert bees._share([34, 33, 33]) == '33-34'
+
+
+def test_barrier_waits_for_all_waves_and_the_warm_up():
+    assert bees._barrier_timeout(64, 64, None) == bees.BEE_PREPARE_SECONDS
+    assert bees._barrier_timeout(65, 64, None) == 2 * bees.BEE_PREPARE_SECONDS
+    warm_up_spec = dict(seconds=120, concurrency=4, requests=[dict(url='http://x/')] * 2)
+    # 2 urls * 10 requests a round, 4 at a time: 5 requests in a row may time out
+    assert bees._barrier_timeout(3, 64, warm_up_spec) == (
+        bees.BEE_PREPARE_SECONDS + 120 + 5 * bees.warmup.TIMEOUT)
+
+
+def test_errors_of_the_bee_are_told():
+    missing = dict(exitCode=127, summary=None, errors='hey: [Errno 2] No such file')
+    assert bees._errors_of(missing) == 'hey: [Errno 2] No such file'
+    assert bees._errors_of(dict(stages=[dict(summary={}, errors=''), missing])) == 'hey: [Errno 2] No such file'
+    assert bees._errors_of(dict(summary=None, errors='')) == ''
+
+
+def test_warm_up_requests(tmpdir):
+    request, = bees._warm_up_requests('http://x/', dict(
+        headers='X-A: 1;', cookies='a=1; ', basic_auth='bee:secret'))
+    assert request == dict(url='http://x/', headers=[
+        'X-A: 1', 'Cookie: a=1; sessionid=NotARealSessionID;',
+        'Authorization: Basic YmVlOnNlY3JldA=='])
+    scenario = tmpdir.join('mix.json')
+    scenario.write('[{"url": "http://x/a"}, {"url": "http://x/b", '
+                   '"method": "POST", "body": "{}", '
+                   '"contentType": "application/json"}]')
+    a, b = bees._warm_up_requests(None, dict(scenario=str(scenario)))
+    assert a['url'] == 'http://x/a' and a['method'] is None
+    assert b['headers'][-1] == 'Content-Type: application/json'
+
+
+def test_warm_up_is_reported_apart(capsys):
+    bee_warm_up = dict(seconds=2.0, requests=16, failed=0, urls=[dict(
+        url='http://x/', rounds=2, requests=16, failed=0, hitRate=1.0,
+        ms=3.0, warm=True, error=None)])
+    slower = dict(bee_warm_up, seconds=3.0, urls=[dict(
+        bee_warm_up['urls'][0], hitRate=0.5, rounds=4, warm=False)])
+    summarized_results = summarize()
+    summarized_results['warm_up'] = bees._summarize_warm_up([bee_warm_up, slower])
+    assert summarized_results['warm_up']['seconds'] == 3.0
+    assert summarized_results['warm_up']['requests'] == 32
+    url, = summarized_results['warm_up']['urls']
+    assert url['hit_rate'] == 0.75 and url['warm_bees'] == 1
+    bees._print_results(summarized_results)
+    out = capsys.readouterr()[0]
+    assert '3.0 seconds, 32 requests (0 failed), not in the results' in out
+    assert '75% hits after 4 rounds, warm on 1 of 2 bees' in out
+    assert 'Mission Assessment' in out
+
+
+def test_gate_needs_the_baseline_asked_for(tmpdir, monkeypatch, capsys):
+    monkeypatch.setattr(bees.history, 'HISTORY_PATH', str(tmpdir.join('history.sqlite')))
+    assert bees._check_gate(None, '7', None) is False
+    assert 'there is no run 7 in the history to compare with, failed' in capsys.readouterr()[0]
+    assert bees._check_gate(None, 'last', None) is False
+    # only a previous run may be missing
+    assert bees._check_gate(None, 'previous', None) is None
+    with pytest.raises(SystemExit) as e:
+        bees.attack('http://x/', 100, 10, gate='7')
+    assert e.value.code == 1
+
+
+
+@pytest.mark.parametrize('num_complete_bees', [0, 2])
+def test_gate_fails_without_a_stored_run(monkeypatch, capsys, num_complete_bees):
+    # no bee completed the attack, or the history couldn't store it
+    monkeypatch.setattr(bees, '_assemble_swarm', lambda: ('ubuntu', 'key', [object()]))
+    monkeypatch.setattr(bees, '_fight', lambda *args: dict(num_complete_bees=num_complete_bees))
+    monkeypatch.setattr(bees, '_print_results', lambda results: None)
+    monkeypatch.setattr(bees, '_record_run', lambda *args: None)
+    with pytest.raises(SystemExit) as e:
+        bees.attack('http://x/', 100, 10, gate='previous')
+    assert e.value.code == 1
+    assert "can't pass the gate" in capsys.readouterr()[0]
+    # without a gate the attack itself is all there is to it
+    bees.attack('http://x/', 100, 10)
+
+
+def test_samples_are_exported_as_csv(tmpdir):
+    from beeswithmachineguns import samples
+    path, csv_path = str(tmpdir.join('samples')), str(tmpdir.join('s.csv'))
+    with samples.SampleWriter(path, 3) as writer:
+        writer.record(1000.5, 12.5, 200)
+        writer.record(1001.0, 40.0)
+    bees._export_samples(path, csv_path)
+    with open(csv_path) as f:
+        assert f.read().splitlines() == [
+            'time,latency,status,bee', '1000.5,12.5,200,3', '1001.0,40.0,0,3']
+
+
+def test_per_second_requests_of_the_run():
+    from beeswithmachineguns.timeseries import TimeSeries
+    series = TimeSeries()
+    for at in (10.2, 10.7, 12.1):
+        series.record(at, 5.0)
+    assert bees._per_second(series) == [2, 0, 1]
+    assert bees._per_second(None) is None
@@ -0,0 +1,43 @@
+import json
+
+import pytest
+
+bees_new = pytest.importorskip('beeswithmachineguns.bees_new')  # python 2
+from beeswithmachineguns import agent, payloads
+from beeswithmachineguns.histogram import LatencyHistogram
+from beeswithmachineguns.timeseries import TimeSeries
+
+
+@pytest.fixture
+def plan(monkeypatch, tmpdir):
+    """a battle plan of the second of two bees, without a bee to talk to"""
+    monkeypatch.setattr(bees_new.BattlePlan, 'remote', None)
+    monkeypatch.setattr(bees_new.DISTRIBUTOR, 'ensure', lambda *args: None)
+    monkeypatch.setattr(payloads, 'PlumbumTarget', lambda remote: None)
+    scenario = tmpdir.join('mix.json')
+    scenario.write('[{"url": "http://x/a"}, {"url": "http://x/b"}]')
+    plan = bees_new.BattlePlan.__new__(bees_new.BattlePlan)
+    plan.__dict__.update(
+        bees_new.BattlePlan.DEFAULTS, _sshKey=None, armySize=2, beeIndex=1,
+        command='engine', additionalOptions=[], postfilePath=None,
+        scenarioPath=str(scenario), profile=dict(shape='step', stages=[
+            dict(concurrency=4, duration=10)]))
+    return plan
+
+
+def test_scenario_with_profile(plan):
+    args = plan.contrive().specifics
+    assert args[-5::3] == ['--scenario', '1'] and args[-1] == '--'
+    generated = []
+
+    def generate(args, progress, release):
+        generated.append(args)
+        return dict(exitCode=0, histogram=LatencyHistogram().asDict,
+                    timeseries=TimeSeries().asDict, startAt=None,
+                    startedAt=0)
+
+    # the agent puts the load of the stage before the last argument
+    agent.run_stages(generate, args[args.index('engine') + 1:],
+                     json.loads(args[args.index('--stages') + 1]),
+                     agent.Progress())
+    assert generated[0][-7:] == ['--seed', '1', '-t', '10.0', '-c', '2', '--']
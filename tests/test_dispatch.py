@@ -0,0 +1,94 @@
+import threading
+import time
+
+import pytest
+
+from beeswithmachineguns.dispatch import Dispatcher, StartBarrier
+
+
+def test_results_in_item_order():
+    dispatcher = Dispatcher()
+    assert dispatcher.map(lambda n: n * 2, range(1000)) == \
+        [n * 2 for n in range(1000)]
+
+
+def test_all_bees_run_concurrently_but_fan_out_is_limited():
+    dispatcher = Dispatcher(fanOut=5)
+    lock = threading.Lock()
+    state = dict(running=0, maxRunning=0, throttled=0, maxThrottled=0)
+
+    def bee(n):
+        with lock:
+            state['running'] += 1
+            state['maxRunning'] = max(state['maxRunning'], state['running'])
+        with dispatcher.throttle():
+            with lock:
+                state['throttled'] += 1
+                state['maxThrottled'] = max(
+                    state['maxThrottled'], state['throttled'])
+            time.sleep(0.01)
+            with lock:
+                state['throttled'] -= 1
+        time.sleep(0.2)
+        with lock:
+            state['running'] -= 1
+
+    dispatcher.map(bee, range(50))
+    assert state['maxRunning'] == 50
+    assert state['maxThrottled'] == 5
+
+
+def test_max_workers():
+    seen = set()
+    Dispatcher(maxWorkers=3).map(
+        lambda n: seen.add(threading.current_thread().ident), range(30))
+    assert len(seen) <= 3
+
+
+def test_first_exception_is_reraised_after_all_items():
+    done = []
+
+    def bee(n):
+        if n == 3:
+            raise KeyError(n)
+        done.append(n)
+
+    with pytest.raises(KeyError):
+        Dispatcher().map(bee, range(10))
+    assert len(done) == 9
+
+
+def test_barrier_releases_everybody_at_the_same_instant():
+    barrier = StartBarrier(20, lead=0.5)
+    startTimes = []
+
+    def bee(n):
+        time.sleep(n * 0.005)
+        startTimes.append(barrier.arrive(n))
+        return time.time()
+
+    released = Dispatcher().map(bee, range(20))
+    assert len(set(startTimes)) == 1
+    assert max(released) < startTimes[0]
+
+
+def test_barrier_does_not_wait_for_bees_that_withdrew():
+    barrier = StartBarrier(3, lead=0)
+
+    def bee(n):
+        if n == 1:
+            barrier.withdraw(n)
+        else:
+            barrier.arrive(n)
+        barrier.withdraw(n)  # no-op after arriving
+
+    Dispatcher().map(bee, range(3))
+    assert barrier.parties == 2
+    assert barrier.startAt is not None and barrier.missing == 0
+
+
+def test_barrier_gives_up_on_stragglers():
+    barrier = StartBarrier(2, lead=0, timeout=0.1)
+    start = time.time()
+    assert barrier.arrive(0) >= start + 0.1
+    assert barrier.missing == 1
@@ -0,0 +1,173 @@
+import os
+import stat
+
+import pytest
+
+from beeswithmachineguns import agent, drivers
+from beeswithmachineguns.histogram import LatencyHistogram
+from beeswithmachineguns.timeseries import TimeSeries
+
+
+AB_REPORT = """Benchmarking x (be patient)
+Complete requests:      200
+Failed requests:        3
+Requests per second:    1234.56 [#/sec] (mean)
+Time per request:       8.101 [ms] (mean)
+"""
+
+
+@pytest.fixture
+def tools(tmpdir, monkeypatch):
+    """fake load generators on the PATH - name, shell script"""
+    monkeypatch.setenv('PATH', '%s%s%s' % (tmpdir, os.pathsep,
+                                           os.environ['PATH']))
+
+    def install(name, script):
+        path = tmpdir.join(name)
+        path.write('#!/bin/sh\n' + script)
+        path.chmod(path.stat().mode | stat.S_IXUSR)
+    return install
+
+
+def test_parse_ab_report():
+    assert drivers.parse_ab_report(AB_REPORT) == dict(
+        complete_requests=200, failed_requests=3,
+        requests_per_second=1234.56, ms_per_request=8.101)
+    assert drivers.parse_ab_report('apr_socket_connect(): refused') is None
+
+
+def test_ab_fails_as_the_others():
+    report = AB_REPORT.replace('Failed requests:        3', '''\
+Failed requests:        5
+   (Connect: 1, Receive: 0, Length: 4, Exceptions: 0)
+Non-2xx responses:      7''')
+    # a different length is no failure, an error status is
+    assert drivers.parse_ab_report(report)['failed_requests'] == 8
+
+
+def test_failed():
+    assert drivers.failed(404) and drivers.failed(503)
+    assert drivers.failed(drivers.samples.NO_STATUS)
+    assert not drivers.failed(200) and not drivers.failed(304)
+
+
+def test_headers():
+    options, url = drivers.parse_args([
+        '-r', '-n', '10', '-c', '2', '-H', 'X-A: 1', '-C', 'a=1', '-C', 'b=2',
+        '-A', 'bee:secret', '-p', '/tmp/post', '-T', 'text/plain',
+        'http://x/'])
+    assert url == 'http://x/'
+    assert drivers.headers(options) == [
+        'X-A: 1', 'Cookie: a=1; b=2', 'Authorization: Basic YmVlOnNlY3JldA==',
+        'Content-Type: text/plain']
+
+
+def test_parse_args_refuses_what_it_cannot_translate():
+    with pytest.raises(ValueError):
+        drivers.parse_args(['-n', '10', '--scenario', 'mix.json'])
+    with pytest.raises(ValueError):
+        drivers.parse_args(['-n', '10'])
+
+
+def test_ab(tools):
+    tools('ab', """while [ $# -gt 0 ]; do [ "$1" = -g ] && g=$2; shift; done
+printf 'starttime\\tseconds\\tctime\\tdtime\\tttime\\twait\\n' > $g
+printf 'x\\t1000\\t1\\t2\\t7\\t0\\nx\\t1001\\t1\\t2\\t9\\t0\\n' >> $g
+echo 'Completed 100 requests' >&2
+printf '%s' '""" + AB_REPORT + """'
+""")
+    progress = agent.Progress(interval=60)
+    result = drivers.run('ab', ['-n', '2', '-c', '1', 'http://x/'], progress)
+    assert result['exitCode'] == 0
+    assert result['summary']['complete_requests'] == 200
+    assert LatencyHistogram.from_dict(result['histogram']).total == 2
+    series = TimeSeries.from_dict(result['timeseries'])
+    assert [r['second'] for r in series.rows()] == [1000, 1001]
+    # the heartbeat and then the rest
+    assert progress.complete == 100
+
+
+def test_hey(tools, tmpdir):
+    tools('hey', """echo "$@" > %s
+echo 'response-time,DNS+dialup,DNS,Request-write,Response-delay,Response-read,status-code,offset'
+echo '0.0050,0,0,0,0,0,200,0.001'
+echo '0.0100,0,0,0,0,0,503,0.500'
+""" % tmpdir.join('args'))
+    samplesPath = str(tmpdir.join('samples'))
+    result = drivers.run('hey', ['-n', '2', '-c', '1', '-C', 'a=1',
+                                 'http://x/'], agent.Progress(), None,
+                         samplesPath)
+    assert tmpdir.join('args').read().split() == [
+        '-c', '1', '-o', 'csv', '-n', '2', '-H', 'Cookie:', 'a=1',
+        '-disable-keepalive', 'http://x/']
+    assert result['summary']['complete_requests'] == 2
+    assert result['summary']['failed_requests'] == 1
+    histogram = LatencyHistogram.from_dict(result['histogram'])
+    assert histogram.percentile(100) == pytest.approx(10, rel=0.01)
+    series = TimeSeries.from_dict(result['timeseries'])
+    assert sum(r['failed'] for r in series.rows()) == 1
+    assert os.path.getsize(samplesPath) > 0
+
+
+def test_hey_without_response(tools):
+    tools('hey', """echo 'response-time,DNS+dialup,DNS,Request-write,Response-delay,Response-read,status-code,offset'
+echo '0.0050,0,0,0,0,0,302,0.001'
+""")
+    summary = drivers.run('hey', ['-n', '3', '-c', '1', 'http://x/'],
+                          agent.Progress())['summary']
+    assert summary['complete_requests'] == 3
+    assert summary['failed_requests'] == 2
+
+
+def test_hey_sends_heartbeats(tools, capsys):
+    tools('hey', "sleep 0.5\n")
+    drivers.run('hey', ['-n', '1', '-c', '1', 'http://x/'],
+                agent.Progress(interval=0.1))
+    frames = list(agent.read_frames(capsys.readouterr()[0].splitlines()))
+    # while hey says nothing, and the last one once it is done
+    assert len([f for f in frames if f['type'] == 'progress']) > 2
+
+
+def test_wrk(tools, tmpdir, monkeypatch):
+    monkeypatch.setattr(drivers, '_cpu_count', lambda: 4)
+    tools('wrk', """while [ $# -gt 0 ]; do [ "$1" = -s ] && cp $2 %s; shift; done
+echo 'Running 10s test @ http://x/'
+echo 'BEES-WRK total 1000 2000000 10'
+echo 'BEES-WRK mean 4500.0'
+echo 'BEES-WRK p 50 4000'
+echo 'BEES-WRK p 99 9000'
+echo 'BEES-WRK p 100 20000'
+""" % tmpdir.join('bees.lua'))
+    driver = drivers.WrkDriver(['-n', '1001', '-c', '8', '-k', 'http://x/'])
+    command = driver.command(str(tmpdir))
+    assert command[:6] == ['wrk', '-c', '8', '-t', '4', '-d']
+    result = drivers.WrkDriver(['-n', '1001', '-c', '8', '-k',
+                                'http://x/']).run(agent.Progress())
+    script = tmpdir.join('bees.lua').read()
+    assert 'local limits = {251, 250, 250, 250}' in script
+    assert 'wrk.thread:stop()' in script
+    assert result['summary'] == dict(
+        complete_requests=1000, failed_requests=10, requests_per_second=500.0,
+        ms_per_request=4.5)
+    histogram = LatencyHistogram.from_dict(result['histogram'])
+    assert histogram.total == 1000
+    assert histogram.percentile(50) == pytest.approx(4, rel=0.01)
+
+
+def test_wrk_runs_for_a_time(tmpdir):
+    driver = drivers.WrkDriver(['-t', '30', '-c', '2', 'http://x/'])
+    command = driver.command(str(tmpdir))
+    assert command[command.index('-d') + 1] == '30s'
+    assert command[-3:] == ['-H', 'Connection: close', 'http://x/']
+
+
+def test_missing_tool(tmpdir, monkeypatch):
+    monkeypatch.setenv('PATH', str(tmpdir))
+    result = drivers.run('hey', ['-n', '1', 'http://x/'], agent.Progress())
+    assert result['exitCode'] == 127 and result['summary'] is None
+    assert result['errors'].startswith('hey: ')
+
+
+def test_missing_report():
+    driver = drivers.HeyDriver(['-n', '1', 'http://x/'])
+    assert driver.finish('connection refused', '/tmp', 0.1) is None
@@ -0,0 +1,176 @@
+import json
+import socket
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('asyncio')  # the engine runs on python 3 bees only
+engine = pytest.importorskip('beeswithmachineguns.engine')
+from beeswithmachineguns import samples
+from beeswithmachineguns.histogram import LatencyHistogram
+from beeswithmachineguns.timeseries import TimeSeries
+
+
+class Progress(object):
+    complete = failed = 0
+
+    def add(self, complete=0, failed=0, histogram=None):
+        self.complete += complete
+        self.failed += failed
+
+    def maybe_emit(self, force=False):
+        pass
+
+
+@pytest.fixture
+def server():
+    """answers everything with 200 (/empty with 204 after a 100, /missing
+    with 404, /moved with 302), keep-alive unless asked to close"""
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(128)
+
+    def serve(conn):
+        buf = b''
+        while True:
+            data = conn.recv(65536)
+            if not data:
+                break
+            buf += data
+            while b'\r\n\r\n' in buf:
+                head, buf = buf.split(b'\r\n\r\n', 1)
+                status = b'404 Not Found' if b'/missing' in head else b'200 OK'
+                if b'/moved' in head:
+                    status = b'302 Found'
+                if b'/slow' in head:
+                    time.sleep(0.05)
+                if b'/empty' in head:
+                    # no body and no length
+                    conn.sendall(b'HTTP/1.1 100 Continue\r\n\r\n'
+                                 b'HTTP/1.1 204 No Content\r\n\r\n')
+                else:
+                    conn.sendall(b'HTTP/1.1 ' + status +
+                                 b'\r\nContent-Length: 2\r\n\r\nok')
+                if b'Connection: close' in head:
+                    conn.close()
+                    return
+        conn.close()
+
+    def accept():
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=serve, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    yield 'http://127.0.0.1:%s' % listener.getsockname()[1]
+    listener.close()
+
+
+@pytest.mark.parametrize('args', [
+    ['-n', '500', '-c', '10'],
+    ['-n', '500', '-c', '10', '-k'],
+    ['-n', '501', '-c', '7', '-k', '--pipeline', '8'],
+])
+def test_delivers_exactly_the_requested_number(server, args):
+    progress = Progress()
+    result = engine.run(args + ['--workers', '2', server + '/'], progress)
+    summary = result['summary']
+    assert summary['complete_requests'] == int(args[1])
+    assert summary['failed_requests'] == 0
+    assert progress.complete == int(args[1])
+    rows = TimeSeries.from_dict(result['timeseries']).rows()
+    assert sum(r['complete'] for r in rows) == int(args[1])
+
+
+def test_errors_and_unreachable_count_as_failed(server):
+    summary = engine.run(['-n', '20', '-c', '2', '-k', server + '/missing'],
+                         Progress())['summary']
+    assert summary['failed_requests'] == 20
+    summary = engine.run(['-n', '20', '-c', '2', '-k', server + '/moved'],
+                         Progress())['summary']
+    assert summary['failed_requests'] == 0
+    result = engine.run(['-n', '5', '-c', '1', 'http://127.0.0.1:1/'],
+                        Progress())
+    assert result['summary']['failed_requests'] == 5
+    rows = TimeSeries.from_dict(result['timeseries']).rows()
+    assert sum(r['failed'] for r in rows) == 5
+
+
+def test_responses_without_body_keep_the_connection(server):
+    started = time.time()
+    summary = engine.run(['-n', '5', '-c', '1', '-k', '--workers', '1',
+                          '--timeout', '3', server + '/empty'],
+                         Progress())['summary']
+    assert time.time() - started < 3
+    assert summary['complete_requests'] == 5
+    assert summary['failed_requests'] == 0
+
+
+def test_failing_worker_ends_the_run_with_the_cause(server, tmpdir):
+    started = time.time()
+    result = engine.run(['-n', '5', '-c', '2', '--workers', '2',
+                         server + '/'], Progress(),
+                        samplesPath=str(tmpdir.join('missing', 'samples')))
+    assert time.time() - started < 5
+    assert result['exitCode'] == 1 and result['summary'] is None
+    assert 'No such file or directory' in result['errors']
+
+
+def test_raw_samples_of_all_workers(server, tmpdir):
+    path = str(tmpdir.join('samples'))
+    engine.run(['-n', '300', '-c', '6', '-k', '--workers', '3',
+                server + '/'], Progress(), samplesPath=path)
+    with samples.SampleReader(path) as reader:
+        assert len(reader) == 300
+        assert set(reader.column('status')) == set([200])
+    assert tmpdir.listdir() == [tmpdir.join('samples')]
+
+
+def test_open_loop_keeps_the_rate(server):
+    summary = engine.run(['-n', '100', '-c', '10', '-k', '--rate', '200',
+                          '--workers', '1', server + '/'],
+                         Progress())['summary']
+    assert summary['complete_requests'] == 100
+    assert summary['requests_per_second'] == pytest.approx(200, rel=0.1)
+
+
+def test_open_loop_counts_queueing_delay(server):
+    """target does 20/s, we want 100/s: the backlog shows in the latency"""
+    result = engine.run(['-n', '20', '-c', '1', '-k', '--rate', '100',
+                         '--workers', '1', server + '/slow'], Progress())
+    histogram = LatencyHistogram.from_dict(result['histogram'])
+    assert histogram.percentile(50) > 200
+    assert result['summary']['max_backlog'] > 5
+
+
+def test_time_limit(server):
+    start = time.time()
+    summary = engine.run(['-t', '0.5', '-c', '4', '-k', '--workers', '2',
+                          server + '/'], Progress())['summary']
+    assert 0.5 <= time.time() - start < 2
+    assert summary['complete_requests'] > 10
+
+
+def test_time_limit_with_rate(server):
+    summary = engine.run(['-t', '0.5', '-c', '4', '-k', '--rate', '100',
+                          '--workers', '1', server + '/'],
+                         Progress())['summary']
+    assert summary['complete_requests'] == 50
+
+
+def test_scenario_mix_is_reported_per_endpoint(server, tmpdir):
+    scenario = tmpdir.join('scenario.json')
+    scenario.write(json.dumps({'requests': [
+        {'name': 'home', 'url': server + '/', 'weight': 3},
+        {'name': 'missing', 'url': server + '/missing', 'weight': 1}]}))
+    result = engine.run(['-n', '2000', '-c', '8', '-k', '--seed', '1',
+                         '--scenario', str(scenario)], Progress())
+    home, missing = result['endpoints']
+    assert home['complete'] + missing['complete'] == 2000
+    assert home['complete'] == pytest.approx(1500, abs=100)
+    assert (home['failed'], missing['failed']) == (0, missing['complete'])
+    assert result['summary']['failed_requests'] == missing['complete']
@@ -0,0 +1,90 @@
+import random
+
+import pytest
+
+from beeswithmachineguns import gate
+from beeswithmachineguns.histogram import LatencyHistogram
+from beeswithmachineguns.history import BeeRun, Run
+
+
+def make_run(median=20.0, rps=(300.0, 310.0, 290.0), failed=10, seed=0,
+             numRequests=3000):
+    rnd = random.Random(seed)
+    bees = []
+    for bee, beeRps in enumerate(rps):
+        histogram = LatencyHistogram()
+        for _ in range(numRequests // len(rps)):
+            histogram.record(rnd.lognormvariate(0, 0.4) * median)
+        bees.append(BeeRun(bee, 'i-%s' % bee, numRequests // len(rps),
+                           failed // len(rps), beeRps, histogram.mean,
+                           histogram))
+    return Run('http://x/', 'ab', len(bees), numRequests, failed, sum(rps),
+               20.0, LatencyHistogram.merged(b.histogram for b in bees),
+               bees=bees)
+
+
+def regressed(verdicts):
+    return sorted(v.metric for v in verdicts if v.regressed)
+
+
+def test_noise_alone_passes():
+    verdicts = gate.check(make_run(seed=1), make_run(seed=2), rounds=300)
+    assert regressed(verdicts) == []
+    p50 = [v for v in verdicts if v.metric == 'p50'][0]
+    assert p50.low < 1 < p50.high
+
+
+def test_slower_latencies_fail():
+    verdicts = gate.check(make_run(seed=1), make_run(median=30, seed=2),
+                          rounds=300)
+    assert regressed(verdicts) == ['p50', 'p90', 'p99']
+
+
+def test_change_within_tolerance_passes():
+    verdicts = gate.check(make_run(seed=1), make_run(median=21, seed=2),
+                          gate.parse_tolerances('p50=20%,p90=20%,p99=30%'),
+                          rounds=300)
+    assert regressed(verdicts) == []
+
+
+def test_lower_throughput_and_more_failures_fail():
+    verdicts = gate.check(make_run(seed=1),
+                          make_run(rps=(200, 210, 190), failed=300, seed=1),
+                          rounds=300)
+    assert regressed(verdicts) == ['failed', 'rps']
+
+
+def test_throughput_of_one_bee_is_resampled_by_the_second():
+    def one_bee(rps, seed):
+        rnd = random.Random(seed)
+        run = make_run(rps=(rps,), seed=seed)
+        run.perSecond = [max(0, int(rnd.gauss(rps, rps / 2)))
+                         for _ in range(12)]
+        return run
+
+    baseline, latest = one_bee(300, 1), one_bee(265, 11)
+    # 12% less from a bee whose seconds vary by half is noise
+    assert regressed(gate.check(baseline, latest, rounds=300)) == []
+    # the bee's rps alone leave no room for it
+    baseline.perSecond = latest.perSecond = None
+    assert regressed(gate.check(baseline, latest, rounds=300)) == ['rps']
+    assert regressed(gate.check(one_bee(300, 1), one_bee(150, 11),
+                                rounds=300)) == ['rps']
+
+
+def test_parse_tolerances():
+    tolerances = gate.parse_tolerances('p99.9=50%, rps=0.2')
+    assert tolerances['p99.9'] == 0.5
+    assert tolerances['rps'] == 0.2
+    assert tolerances['p50'] == gate.DEFAULT_TOLERANCES['p50']
+    with pytest.raises(ValueError):
+        gate.parse_tolerances('latency=10%')
+    with pytest.raises(ValueError):
+        gate.parse_tolerances('p50=-50%')
+
+
+def test_poisson_mean():
+    rnd = random.Random(3)
+    for mean in (0.5, 5, 500):
+        draws = [gate.poisson(rnd, mean) for _ in range(4000)]
+        assert sum(draws) / 4000.0 == pytest.approx(mean, rel=0.1)
@@ -0,0 +1,81 @@
+import array
+import json
+import random
+
+import pytest
+
+from beeswithmachineguns.histogram import LatencyHistogram
+
+
+def exact_percentile(values, percent):
+    values = sorted(values)
+    rank = max(1, int(-(-percent * len(values) // 100)))
+    return values[rank - 1]
+
+
+@pytest.mark.parametrize('percent', [0, 1, 50, 90, 99, 99.9, 99.99, 100])
+def test_percentiles_within_relative_error(percent):
+    rnd = random.Random(42)
+    values = [rnd.lognormvariate(3, 1.5) for _ in range(20000)]
+    histogram = LatencyHistogram()
+    for value in values:
+        histogram.record(value)
+    expected = exact_percentile(values, percent)
+    assert histogram.percentile(percent) == pytest.approx(expected, rel=0.01)
+
+
+def test_merge_is_exact_and_order_independent():
+    rnd = random.Random(1)
+    bees = []
+    for _ in range(10):
+        histogram = LatencyHistogram()
+        for _ in range(1000):
+            histogram.record(rnd.expovariate(0.01))
+        bees.append(histogram)
+    merged = LatencyHistogram.merged(bees)
+    assert merged.total == 10000
+    assert merged == LatencyHistogram.merged(reversed(bees))
+    assert merged.percentiles([50, 99.9]) == \
+        LatencyHistogram.merged(reversed(bees)).percentiles([50, 99.9])
+
+
+def test_zero_values_and_empty_histogram():
+    histogram = LatencyHistogram()
+    assert histogram.percentiles([50, 99]) == [0.0, 0.0]
+    histogram.record(0, count=3)
+    histogram.record(10)
+    assert histogram.percentiles([50, 75, 100]) == \
+        [0.0, 0.0, pytest.approx(10, rel=0.01)]
+
+
+def test_dict_roundtrip_through_json():
+    histogram = LatencyHistogram(0.02)
+    for value in [0, 0.5, 1, 2, 300, 300, 7000]:
+        histogram.record(value)
+    data = json.loads(json.dumps(histogram.asDict))
+    assert LatencyHistogram.from_dict(data) == histogram
+
+
+def test_merge_refuses_different_resolution():
+    with pytest.raises(ValueError):
+        LatencyHistogram(0.01).merge(LatencyHistogram(0.02))
+
+
+def test_add_bucket_counts_like_record():
+    recorded, added = LatencyHistogram(), LatencyHistogram()
+    recorded.record(12.0, count=3)
+    added.add_bucket(added.bucket_index(12.0), 2)
+    added.add_bucket(added.bucket_index(12.0), 1)
+    assert added == recorded
+
+
+def test_record_many_is_the_same_as_one_by_one():
+    rnd = random.Random(3)
+    values = [rnd.lognormvariate(3, 1.5) for _ in range(5000)] + [0.0, 0.0]
+    one_by_one = LatencyHistogram()
+    for value in values:
+        one_by_one.record(value)
+    at_once = LatencyHistogram()
+    at_once.record_many(array.array('d', values))
+    assert at_once == one_by_one
+    assert at_once.sum == pytest.approx(one_by_one.sum)
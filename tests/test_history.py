@@ -0,0 +1,97 @@
+import sqlite3
+
+import pytest
+
+from beeswithmachineguns import history
+from beeswithmachineguns.histogram import LatencyHistogram
+
+
+@pytest.fixture
+def store(tmpdir):
+    store = history.RunStore(str(tmpdir.join('history.sqlite')))
+    yield store
+    store.close()
+
+
+def make_run(started, target='http://x/', plan='ab -n 100 -c 10',
+             latency=10.0, numBees=2):
+    bees = []
+    for bee in range(numBees):
+        histogram = LatencyHistogram()
+        histogram.record(latency + bee, 50)
+        bees.append(history.BeeRun(bee, 'i-%s' % bee, 50, 1, 100.0,
+                                   latency + bee, histogram))
+    return history.Run(target, plan, numBees, 50 * numBees, numBees,
+                       100.0 * numBees, latency + 0.5,
+                       LatencyHistogram.merged(b.histogram for b in bees),
+                       instanceType='t2.micro', started=started, bees=bees)
+
+
+def test_roundtrip(store):
+    run = make_run(1000.0)
+    runId = store.add(run)
+    stored = store.get(runId, withBees=True)
+    assert (stored.target, stored.plan, stored.started, stored.swarmSize,
+            stored.instanceType, stored.complete, stored.failed) == (
+        'http://x/', 'ab -n 100 -c 10', 1000.0, 2, 't2.micro', 100, 2)
+    assert stored.histogram == run.histogram
+    assert [(b.bee, b.instanceId, b.meanMs) for b in stored.bees] == [
+        (0, 'i-0', 10.0), (1, 'i-1', 11.0)]
+    assert stored.bees[1].histogram == run.bees[1].histogram
+    assert store.get(runId + 1) is None
+    assert stored.perSecond is None
+    run = make_run(1001.0)
+    run.perSecond = [40, 52, 8]
+    assert store.get(store.add(run)).perSecond == [40, 52, 8]
+
+
+def test_history_without_time_series_is_upgraded(tmpdir):
+    path = str(tmpdir.join('history.sqlite'))
+    old = sqlite3.connect(path)
+    old.executescript(history.SCHEMA.replace(',\n    perSecond TEXT', ''))
+    old.close()
+    store = history.RunStore(path)
+    try:
+        run = make_run(1000.0)
+        run.perSecond = [5]
+        assert store.get(store.add(run)).perSecond == [5]
+    finally:
+        store.close()
+
+
+def test_previous_is_the_same_plan_on_the_same_target(store):
+    first = store.add(make_run(1000.0))
+    store.add(make_run(1001.0, plan='engine -n 100 -c 10'))
+    store.add(make_run(1002.0, target='http://y/'))
+    latest = store.get(store.add(make_run(1003.0)))
+    assert store.latest().id == latest.id
+    assert store.latest(target='http://y/').started == 1002.0
+    assert store.previous(latest).id == first
+    assert store.previous(store.get(first)) is None
+    assert [r.started for r in store.find(target='http://x/')] == [
+        1003.0, 1001.0, 1000.0]
+    assert [r.started for r in store.find(since=1002.0)] == [1003.0, 1002.0]
+
+
+def test_compare(store):
+    baseline = make_run(1000.0, latency=10.0)
+    latest = make_run(1001.0, latency=20.0)
+    rows = dict((metric, (before, after)) for metric, before, after in
+                history.compare(baseline, latest))
+    assert rows['mean [ms]'] == (10.5, 20.5)
+    assert rows['failed [%]'] == (2.0, 2.0)
+    assert rows['p50 [ms]'][0] == pytest.approx(10, rel=0.01)
+    assert rows['p50 [ms]'][1] == pytest.approx(20, rel=0.01)
+
+
+def test_lookups_use_the_index(store):
+    for i in range(2000):
+        store.add(make_run(1000.0 + i, plan='plan %s' % (i % 7), numBees=1))
+    latest = store.latest(target='http://x/', plan='plan 3')
+    assert latest.started == 1000.0 + 1998
+    assert store.previous(latest).started == 1000.0 + 1991
+    plan = ' '.join(str(row) for row in store.connection.execute(
+        'EXPLAIN QUERY PLAN SELECT id FROM runs WHERE target = ? AND '
+        'plan = ? AND started < ? ORDER BY started DESC LIMIT 1',
+        ['http://x/', 'plan 3', 3000.0]))
+    assert 'runsByPlan' in plan
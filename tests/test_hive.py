@@ -0,0 +1,255 @@
+from boto.exception import EC2ResponseError
+import pytest
+
+from beeswithmachineguns import hive
+from beeswithmachineguns.lib import BeeSting
+
+
+class FakeInstance(object):
+    def __init__(self, id, state='pending'):
+        self.id = id
+        self.state = state
+
+    def _update(self, updated):
+        self.__dict__.update(updated.__dict__)
+
+
+class FakeConnection(object):
+    """bees become ready after a given number of describe calls"""
+    def __init__(self, readyAfter, failures=()):
+        self.readyAfter = readyAfter
+        self.failures = list(failures)
+        self.calls = []
+
+    def get_only_instances(self, instance_ids):
+        self.calls.append(sorted(instance_ids))
+        if self.failures:
+            raise self.failures.pop(0)
+
+        tick = len(self.calls)
+        return [FakeInstance(
+            i, 'running' if tick >= self.readyAfter[i] else 'pending')
+            for i in instance_ids]
+
+
+def test_one_describe_call_per_tick_for_whole_swarm():
+    readyAfter = dict(('i-%s' % n, n % 3 + 1) for n in range(30))
+    connection = FakeConnection(readyAfter)
+    instances = [FakeInstance(i) for i in sorted(readyAfter)]
+    sleeps = []
+    ready = list(hive.wait_for_bees(
+        connection, instances, sleep=sleeps.append))
+    assert len(connection.calls) == 3
+    assert len(connection.calls[0]) == 30
+    assert len(connection.calls[2]) == 10
+    assert sorted(b.id for b in ready) == sorted(readyAfter)
+    assert all(b.state == 'running' for b in instances)
+    assert len(sleeps) == 2
+
+
+def test_throttling_backs_off():
+    throttled = EC2ResponseError(503, 'Service Unavailable')
+    throttled.error_code = 'RequestLimitExceeded'
+    connection = FakeConnection({'i-1': 1}, failures=[throttled])
+    sleeps = []
+    ready = list(hive.wait_for_bees(
+        connection, [FakeInstance('i-1')], sleep=sleeps.append))
+    assert [b.id for b in ready] == ['i-1']
+    assert sleeps[0] > hive.Backoff().initial
+
+
+def test_timeout():
+    connection = FakeConnection({'i-1': 1000})
+    with pytest.raises(BeeSting):
+        list(hive.wait_for_bees(connection, [FakeInstance('i-1')],
+                                timeout=0.001, sleep=lambda s: None))
+
+
+def test_parse_placements():
+    assert hive.parse_placements('us-east-1a:20, eu-west-1b:10', 5) == [
+        hive.Placement('us-east-1a', 20), hive.Placement('eu-west-1b', 10)]
+    placements = hive.parse_placements('us-east-1a,us-east-1b,eu-west-1a:3', 5)
+    assert [p.count for p in placements] == [3, 2, 3]
+    assert [p.region for p in placements] == [
+        'us-east-1', 'us-east-1', 'eu-west-1']
+    assert hive.parse_placements('local', 3) == [hive.Placement('local', 3)]
+
+
+@pytest.mark.parametrize('spec', ['', 'us-east-1a,us-east-1a',
+                                  'us-east-1a:0', 'a,b,c,d'])
+def test_parse_bad_placements(spec):
+    with pytest.raises(ValueError):
+        hive.parse_placements(spec, 3)
+
+
+def test_parse_images():
+    assert hive.parse_images('ami-1') == {None: 'ami-1'}
+    assert hive.parse_images('us-east-1=ami-1,eu-west-1=ami-2') == {
+        'us-east-1': 'ami-1', 'eu-west-1': 'ami-2'}
+
+
+class FakeZone(object):
+    def __init__(self, name, state='available'):
+        self.name = name
+        self.state = state
+
+
+class FakeRegion(object):
+    """an EC2 region whose zones have room for a given number of bees"""
+    def __init__(self, name, room, error=None):
+        self.name = name
+        self.room = dict(room)
+        self.error = error
+        self.calls = []
+        self.tagged = []
+
+    def run_instances(self, zone, count):
+        self.calls.append((zone, count))
+        if self.error:
+            raise self.error
+
+        if not self.room.get(zone):
+            error = EC2ResponseError(500, 'Server.InsufficientCapacity')
+            error.error_code = 'InsufficientInstanceCapacity'
+            raise error
+
+        launched = min(count, self.room[zone])
+        self.room[zone] -= launched
+        return FakeReservation([
+            FakeInstance('i-%s-%s' % (zone, self.room[zone] + n), 'running')
+            for n in range(launched)])
+
+    def get_only_instances(self, instance_ids):
+        return [FakeInstance(i, 'running') for i in instance_ids]
+
+    def get_all_zones(self):
+        return [FakeZone(z) for z in sorted(self.room)] + [
+            FakeZone(self.name + 'z', 'impaired')]
+
+    def create_tags(self, ids, tags):
+        self.tagged.extend(ids)
+
+
+class FakeReservation(object):
+    def __init__(self, instances):
+        self.instances = instances
+
+
+def launch(regions, spec, count=0, **kwargs):
+    return hive.launch(
+        lambda region: regions[region], hive.parse_placements(spec, count),
+        lambda connection, zone, count: connection.run_instances(zone, count),
+        **kwargs)
+
+
+def test_launch_in_several_regions():
+    regions = {'us-east-1': FakeRegion('us-east-1', {'us-east-1a': 10}),
+               'eu-west-1': FakeRegion('eu-west-1', {'eu-west-1b': 10})}
+    ready = []
+    result = launch(regions, 'us-east-1a:4,eu-west-1b:2', tags={'Name': 'b'},
+                    ready=ready.append)
+    assert len(result.instances) == len(result.ready) == len(ready) == 6
+    assert regions['us-east-1'].calls == [('us-east-1a', 4)]
+    assert regions['eu-west-1'].calls == [('eu-west-1b', 2)]
+    assert len(regions['us-east-1'].tagged) == 4
+    assert result.shortfall == result.errors == {}
+
+
+def test_launch_falls_back_to_listed_zones_first():
+    region = FakeRegion('us-east-1', {'us-east-1a': 3, 'us-east-1b': 10,
+                                      'us-east-1c': 10})
+    result = launch({'us-east-1': region}, 'us-east-1a:5,us-east-1c:2')
+    assert region.calls == [('us-east-1a', 5), ('us-east-1c', 2),
+                            ('us-east-1c', 2)]
+    assert len(result.instances) == 7
+    assert result.shortfall == {}
+
+
+def test_launch_falls_back_to_other_zones_of_region():
+    region = FakeRegion('us-east-1', {'us-east-1a': 0, 'us-east-1b': 1,
+                                      'us-east-1c': 10})
+    result = launch({'us-east-1': region}, 'us-east-1a:5')
+    assert region.calls == [('us-east-1a', 5), ('us-east-1b', 5),
+                            ('us-east-1c', 4)]
+    assert len(result.instances) == 5
+
+
+def test_launch_without_fallback_reports_shortfall():
+    region = FakeRegion('us-east-1', {'us-east-1a': 3, 'us-east-1b': 10})
+    result = launch({'us-east-1': region}, 'us-east-1a:5', fallback=False)
+    assert region.calls == [('us-east-1a', 5)]
+    assert result.shortfall == {'us-east-1a': 2}
+    assert len(result.instances) == 3
+
+
+def test_launch_error_in_one_region_spares_the_others():
+    denied = EC2ResponseError(403, 'Forbidden')
+    denied.error_code = 'UnauthorizedOperation'
+    regions = {'us-east-1': FakeRegion('us-east-1', {'us-east-1a': 10}),
+               'eu-west-1': FakeRegion('eu-west-1', {}, error=denied)}
+    result = launch(regions, 'us-east-1a:4,eu-west-1b:2')
+    assert len(result.ready) == 4
+    assert list(result.errors) == ['eu-west-1']
+
+
+class RestingConnection(FakeConnection):
+    """bees in given states that start when told to"""
+    def __init__(self, states):
+        super(RestingConnection, self).__init__({})
+        self.states = dict(states)
+        self.started = []
+
+    def get_only_instances(self, instance_ids):
+        self.calls.append(sorted(instance_ids))
+        for id, state in self.states.items():
+            # one tick from stopping to stopped and from pending to running
+            self.states[id] = dict(stopping='stopped',
+                                   pending='running').get(state, state)
+        return [FakeInstance(i, self.states[i]) for i in instance_ids]
+
+    def start_instances(self, instance_ids):
+        assert all(self.states[i] == 'stopped' for i in instance_ids)
+        self.started.extend(instance_ids)
+        for i in instance_ids:
+            self.states[i] = 'pending'
+
+
+def test_wake():
+    connection = RestingConnection({'i-1': 'stopped', 'i-2': 'stopping',
+                                    'i-3': 'running', 'i-4': 'terminated'})
+    ready = []
+    awake = hive.wake(connection, ['i-1', 'i-2', 'i-3', 'i-4'],
+                      ready=ready.append, sleep=lambda s: None)
+    assert sorted(connection.started) == ['i-1', 'i-2']
+    assert sorted(b.id for b in awake) == ['i-1', 'i-2', 'i-3']
+    assert [b.id for b in ready] == [b.id for b in awake]
+
+
+class FakeImage(object):
+    def __init__(self, state):
+        self.state = state
+
+
+class ImageConnection(object):
+    def __init__(self, states):
+        self.states = list(states)
+
+    def get_image(self, imageId):
+        state = self.states.pop(0)
+        if isinstance(state, Exception):
+            raise state
+
+        return FakeImage(state)
+
+
+def test_wait_for_image():
+    unknown = EC2ResponseError(400, 'Bad Request')
+    unknown.error_code = 'InvalidAMIID.NotFound'
+    sleeps = []
+    connection = ImageConnection([unknown, 'pending', 'available'])
+    image = hive.wait_for_image(connection, 'ami-1', sleep=sleeps.append)
+    assert image.state == 'available'
+    assert len(sleeps) == 2
+    with pytest.raises(BeeSting):
+        hive.wait_for_image(ImageConnection(['pending', 'failed']), 'ami-1',
+                            sleep=lambda s: None)
@@ -0,0 +1,58 @@
+from beeswithmachineguns import hive, localhive, payloads
+
+
+def test_swarm_lifecycle(tmpdir):
+    now = [1000.0]
+    connection = localhive.LocalConnection(
+        str(tmpdir.join('hive.json')), bootTime=5, clock=lambda: now[0])
+    reservation = connection.run_instances(min_count=3, max_count=3)
+    assert [i.state for i in reservation.instances] == ['pending'] * 3
+    assert all(localhive.is_local(i.public_dns_name)
+               for i in reservation.instances)
+
+    def sleep(seconds):
+        now[0] += seconds
+
+    ready = list(hive.wait_for_bees(
+        connection, reservation.instances, sleep=sleep))
+    assert len(ready) == 3
+    assert now[0] >= 1005
+
+    # another process (same state file) sees the same swarm
+    other = localhive.LocalConnection(str(tmpdir.join('hive.json')))
+    ids = [i.id for i in reservation.instances]
+    other.create_tags(ids, {'Name': 'a bee!'})
+    reservations = other.get_all_instances(instance_ids=ids)
+    assert [r.id for r in reservations] == [reservation.id]
+    assert reservations[0].instances[0].tags == {'Name': 'a bee!'}
+
+    # stopped bees stay in the swarm, started they boot again
+    assert [i.state for i in other.stop_instances(instance_ids=ids[:1])] == [
+        'stopped']
+    assert [i.state for i in connection.get_only_instances(ids)] == [
+        'stopped', 'running', 'running']
+    awake = hive.wake(connection, ids, sleep=sleep)
+    assert sorted(i.id for i in awake) == sorted(ids)
+    assert all(i.state == 'running' for i in awake)
+
+    assert len(other.terminate_instances(instance_ids=ids[:2])) == 2
+    assert [i.id for i in connection.get_only_instances()] == ids[2:]
+
+
+def test_client_runs_commands_locally():
+    client = localhive.LocalClient('i-1.bees.local')
+    stdin, stdout, stderr = client.exec_command('read x; echo "got $x"')
+    stdin.write('go\n')
+    stdin.flush()
+    assert list(stdout) == ['got go\n']
+    client.close()
+
+
+def test_payloads_reach_local_bees(tmpdir, monkeypatch):
+    monkeypatch.setattr(payloads, 'REMOTE_PAYLOAD_DIR', str(tmpdir))
+    payload = payloads.Payload(b'x' * 100000, name='post')
+    target = payloads.SftpTarget(localhive.LocalClient('i-1.bees.local'))
+    distributor = payloads.Distributor()
+    assert distributor.ensure('i-1', target, [payload]) == 1
+    assert distributor.ensure('i-2', target, [payload]) == 0
+    assert tmpdir.join(payload.remotePath.rsplit('/', 1)[1]).size() == 100000
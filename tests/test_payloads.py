@@ -0,0 +1,71 @@
+from beeswithmachineguns import payloads
+from beeswithmachineguns.payloads import Distributor, Payload, RateLimit
+
+
+class FakeTarget(object):
+    def __init__(self):
+        self.files = {}
+        self.checks = 0
+
+    def has(self, payload):
+        self.checks += 1
+        return payload.remotePath in self.files
+
+    def write(self, payload, chunks):
+        self.files[payload.remotePath] = b''.join(chunks)
+
+
+def test_payloads_are_addressed_by_content():
+    assert Payload(b'x' * 10).remotePath == Payload(b'x' * 10).remotePath
+    assert Payload(b'x').remotePath != Payload(b'y').remotePath
+    assert Payload(b'x', suffix='.zip').remotePath.startswith(
+        payloads.REMOTE_PAYLOAD_DIR)
+
+
+def test_each_payload_travels_once_per_bee():
+    distributor = Distributor()
+    post = Payload(b'{"honey": 1}' * 10000)
+    targets = dict((bee, FakeTarget()) for bee in ['bee-1', 'bee-2'])
+    for _ in range(10):
+        for bee, target in targets.items():
+            distributor.ensure(bee, target, [post])
+    for target in targets.values():
+        assert target.files == {post.remotePath: post.data}
+        assert target.checks == 1
+
+
+def test_bee_holding_the_payload_already_gets_no_upload():
+    target = FakeTarget()
+    post = Payload(b'data')
+    target.files[post.remotePath] = post.data
+    assert Distributor().ensure('bee-1', target, [post]) == 0
+
+
+def test_forgotten_bees_are_checked_again():
+    distributor = Distributor()
+    target = FakeTarget()
+    post = Payload(b'data')
+    distributor.ensure('bee-1', target, [post])
+    distributor.forget('bee-1')
+    target.files.clear()
+    assert distributor.ensure('bee-1', target, [post]) == 1
+
+
+def test_rate_limit_spaces_out_chunks():
+    clock = dict(now=0.0)
+    slept = []
+
+    def sleep(seconds):
+        slept.append(seconds)
+        clock['now'] += seconds
+
+    limit = RateLimit(1000, clock=lambda: clock['now'], sleep=sleep)
+    for _ in range(5):
+        limit.consume(500)
+    assert clock['now'] == 2.0
+
+
+def test_load_caches_unchanged_files(tmpdir):
+    path = tmpdir.join('post_data')
+    path.write('payload')
+    assert payloads.load(str(path)) is payloads.load(str(path))
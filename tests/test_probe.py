@@ -0,0 +1,95 @@
+import pytest
+
+from beeswithmachineguns import probe
+
+
+class Target(object):
+    """answers quickly up to its capacity, then queues up"""
+    def __init__(self, capacity, failing=None):
+        self.capacity = capacity
+        self.failing = failing
+        self.loads = []
+
+    def __call__(self, load):
+        self.loads.append(load)
+        latency = 50.0 if load <= self.capacity else 100.0 * load / self.capacity
+        errorRate = (0.1 if self.failing is not None and load > self.failing
+                     else 0.0)
+        return probe.Measurement(load, min(load, self.capacity) * 10.0,
+                                 latency, errorRate, duration=20.0)
+
+
+SLO = probe.Slo(latency=60, errorRate=0.01)
+
+
+def test_parse_slo():
+    slo = probe.Slo.parse('p99.9<250ms, errors<0.5%')
+    assert (slo.percent, slo.latency, slo.errorRate) == (99.9, 250.0, 0.005)
+    assert repr(slo) == 'p99.9<250ms,errors<0.5%'
+    assert probe.Slo.parse('errors<1%').latency is None
+
+
+@pytest.mark.parametrize('spec', ['p99>250ms', 'errors<1', 'rps>10', ''])
+def test_parse_bad_slo(spec):
+    with pytest.raises(ValueError):
+        probe.Slo.parse(spec)
+
+
+def test_grows_then_bisects():
+    target = Target(capacity=700)
+    search = probe.CapacitySearch(target, SLO, start=10, precision=0.05).run()
+    assert target.loads[:8] == [10, 20, 40, 80, 160, 320, 640, 1280]
+    assert search.best <= 700 < search.worst
+    assert search.worst - search.best <= 0.05 * search.best
+    assert len(target.loads) == len(set(target.loads))
+    assert search.duration == 20.0 * len(target.loads)
+    assert search.bestMeasurement.load == search.best
+
+
+def test_granularity():
+    target = Target(capacity=700)
+    search = probe.CapacitySearch(target, SLO, start=4, minimum=4,
+                                  granularity=4, precision=0.0,
+                                  maxSteps=30).run()
+    assert all(load % 4 == 0 for load in target.loads)
+    assert (search.best, search.worst) == (700, 704)
+
+
+def test_errors_count_too():
+    search = probe.CapacitySearch(Target(capacity=700, failing=100), SLO,
+                                  start=10).run()
+    assert search.best <= 100 < search.worst
+    assert any(v.startswith('10.00% errors') for step in search.steps
+               for v in step.violations)
+
+
+def test_limit():
+    target = Target(capacity=700)
+    search = probe.CapacitySearch(target, SLO, start=10, limit=100).run()
+    assert target.loads == [10, 20, 40, 80, 100]
+    assert (search.best, search.worst) == (100, None)
+
+
+def test_failing_at_start_bisects_down():
+    target = Target(capacity=30)
+    search = probe.CapacitySearch(target, SLO, start=100, minimum=10,
+                                  granularity=10).run()
+    assert target.loads[0] == 100
+    assert search.best == 30
+    assert search.worst == 40
+
+
+def test_failing_at_minimum():
+    target = Target(capacity=1)
+    search = probe.CapacitySearch(target, SLO, start=10, minimum=10,
+                                  granularity=10).run()
+    assert target.loads == [10]
+    assert search.best is None
+    assert search.bestMeasurement is None
+
+
+def test_max_steps():
+    target = Target(capacity=10 ** 9)
+    search = probe.CapacitySearch(target, SLO, start=1, maxSteps=5).run()
+    assert len(search.steps) == 5
+    assert search.best == 16
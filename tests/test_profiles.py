@@ -0,0 +1,62 @@
+import pytest
+
+from beeswithmachineguns import profiles
+from beeswithmachineguns.profiles import Stage
+
+
+def test_ramp_in_steps():
+    stages = profiles.expand(dict(shape='ramp', duration=600, steps=10,
+                                  **{'from': 100, 'to': 1000}))
+    assert [s.concurrency for s in stages] == list(range(100, 1001, 100))
+    assert sum(s.duration for s in stages) == 600
+
+
+def test_rate_ramp_keeps_concurrency():
+    stages = profiles.expand(dict(shape='ramp', of='rate', concurrency=50,
+                                  duration=30, steps=3,
+                                  **{'from': 1000, 'to': 3000}))
+    assert [(s.concurrency, s.rate) for s in stages] == \
+        [(50, 1000), (50, 2000), (50, 3000)]
+
+
+def test_spike():
+    stages = profiles.expand(dict(shape='spike', base=100, peak=2000,
+                                  duration=300, spikeAt=120,
+                                  spikeDuration=30))
+    assert [(s.concurrency, s.duration) for s in stages] == \
+        [(100, 120), (2000, 30), (100, 150)]
+
+
+def test_explicit_steps():
+    stages = profiles.expand(dict(shape='step', stages=[
+        dict(concurrency=10, duration=5), dict(concurrency=20, duration=5,
+                                               name='double')]))
+    assert [s.name for s in stages] == ['step 1', 'double']
+
+
+def test_shares_add_up_exactly():
+    stage = Stage(concurrency=103, duration=10, rate=1030, requests=10001)
+    shares = [stage.share(10, i) for i in range(10)]
+    assert sum(s.concurrency for s in shares) == 103
+    assert sum(s.requests for s in shares) == 10001
+    assert sum(s.rate for s in shares) == pytest.approx(1030)
+
+
+@pytest.mark.parametrize('profile', [
+    dict(shape='sawtooth'),
+    dict(shape='ramp', of='bees', duration=10, **{'from': 1, 'to': 2}),
+    dict(shape='spike', base=1, peak=2, duration=10, spikeAt=8,
+         spikeDuration=5)])
+def test_invalid_profiles(profile):
+    with pytest.raises(ValueError):
+        profiles.expand(profile)
+
+
+def test_less_than_one_connection_per_bee():
+    with pytest.raises(ValueError):
+        Stage(concurrency=5, duration=1).share(10, 0)
+
+
+def test_split_is_exact():
+    assert profiles.split(10, 3) == [4, 3, 3]
+    assert sum(profiles.split(1001, 16)) == 1001
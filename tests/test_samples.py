@@ -0,0 +1,84 @@
+import io
+import random
+
+import pytest
+
+from beeswithmachineguns import samples
+from beeswithmachineguns.histogram import LatencyHistogram
+
+
+def write(path, numSamples, bee=0, blockSize=100, seed=0):
+    rnd = random.Random(seed)
+    expected = []
+    with samples.SampleWriter(path, bee, blockSize) as writer:
+        for i in range(numSamples):
+            sample = (1000.0 + i / 100.0, rnd.expovariate(0.05),
+                      rnd.choice([200, 200, 500]))
+            writer.record(*sample)
+            expected.append(sample)
+    return expected
+
+
+def test_columns_roundtrip_across_blocks(tmpdir):
+    path = str(tmpdir.join('samples'))
+    expected = write(path, 250, bee=3)
+    with samples.SampleReader(path) as reader:
+        assert len(reader) == 250
+        assert [len(b) for b in reader.blocks()] == [100, 100, 50]
+        assert list(reader.column('time')) == [e[0] for e in expected]
+        assert list(reader.column('latency')) == pytest.approx(
+            [e[1] for e in expected], rel=1e-6)
+        assert list(reader.column('status')) == [e[2] for e in expected]
+        assert set(reader.column('bee')) == set([3])
+
+
+def test_append_sets_the_bee(tmpdir):
+    swarm = str(tmpdir.join('swarm'))
+    for bee in range(3):
+        beePath = str(tmpdir.join('bee%s' % bee))
+        write(beePath, 120, seed=bee)
+        assert samples.append(swarm, beePath, bee=bee) == 120
+    with samples.SampleReader(swarm) as reader:
+        bees = list(reader.column('bee'))
+        assert bees == [0] * 120 + [1] * 120 + [2] * 120
+        assert reader.histogram(bee=1).total == 120
+        assert reader.histogram().total == 360
+
+
+def test_histogram_matches_recorded_latencies(tmpdir):
+    path = str(tmpdir.join('samples'))
+    expected = LatencyHistogram()
+    for _, latency, _ in write(path, 500):
+        expected.record(latency)
+    with samples.SampleReader(path) as reader:
+        assert reader.histogram() == expected
+
+
+def test_unfinished_block_is_left_out(tmpdir):
+    path = str(tmpdir.join('samples'))
+    write(path, 150)
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path, 'wb') as f:
+        f.write(data[:-10])
+    with samples.SampleReader(path) as reader:
+        assert len(reader) == 100
+
+
+def test_rejects_other_files(tmpdir):
+    path = tmpdir.join('other')
+    path.write('time,latency\n')
+    with pytest.raises(ValueError):
+        samples.SampleReader(str(path))
+
+
+def test_csv_export(tmpdir):
+    path = str(tmpdir.join('samples'))
+    expected = write(path, 150, bee=2)
+    stream = io.BytesIO() if str is bytes else io.StringIO()
+    with samples.SampleReader(path) as reader:
+        samples.write_csv(reader, stream)
+    lines = stream.getvalue().splitlines()
+    assert lines[0].strip() == 'time,latency,status,bee'
+    assert len(lines) == 151
+    assert lines[1].split(',')[2:] == [str(expected[0][2]), '2']
@@ -0,0 +1,63 @@
+import random
+
+import pytest
+
+from beeswithmachineguns import scenarios
+from beeswithmachineguns.histogram import LatencyHistogram
+
+
+def test_alias_table_follows_the_weights():
+    weights = [50, 30, 15, 4, 1, 0]
+    table = scenarios.AliasTable(weights)
+    probabilities = [0.0] * len(weights)
+    for index, probability in enumerate(table.probability):
+        probabilities[index] += probability / len(weights)
+        probabilities[table.alias[index]] += (1 - probability) / len(weights)
+    assert probabilities == pytest.approx([w / 100.0 for w in weights])
+
+
+def test_alias_table_picks():
+    table = scenarios.AliasTable([3, 1, 0])
+    rand = random.Random(42).random
+    counts = [0, 0, 0]
+    for _ in range(40000):
+        counts[table.pick(rand)] += 1
+    assert counts[0] == pytest.approx(30000, abs=500)
+    assert counts[2] == 0
+
+
+@pytest.mark.parametrize('weights', [[], [0, 0], [1, -1]])
+def test_invalid_weights(weights):
+    with pytest.raises(ValueError):
+        scenarios.AliasTable(weights)
+
+
+def test_same_seed_same_sequence():
+    scenario = scenarios.Scenario.from_dict([
+        dict(url='http://x/a', weight=2), dict(url='http://x/b')])
+    first, second = scenario.picker(7), scenario.picker(7)
+    assert [first() for _ in range(100)] == [second() for _ in range(100)]
+
+
+def test_scenario_from_dict():
+    scenario = scenarios.Scenario.from_dict(dict(requests=[
+        dict(url='http://x/', name='home', weight=3),
+        dict(url='http://x/login', method='POST', body='{}')]))
+    assert [e.name for e in scenario.endpoints] == ['home', 'http://x/login']
+    assert scenario.endpoints[1].weight == 1
+    assert scenarios.Scenario.from_dict(scenario.asDict).endpoints[1].method \
+        == 'POST'
+
+
+def test_merge_endpoint_stats():
+    def stats(complete, latency):
+        histogram = LatencyHistogram()
+        histogram.record(latency, complete)
+        return dict(name='x', complete=complete, failed=1,
+                    histogram=histogram.asDict)
+
+    merged = scenarios.merge_endpoint_stats([[stats(2, 10)], [stats(3, 20)]])
+    assert merged[0]['complete'] == 5
+    assert merged[0]['failed'] == 2
+    assert merged[0]['name'] == 'x'
+    assert LatencyHistogram.from_dict(merged[0]['histogram']).total == 5
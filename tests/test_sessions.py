@@ -0,0 +1,140 @@
+import pytest
+
+from beeswithmachineguns import sessions
+from beeswithmachineguns.sessions import Session, SessionPool
+
+
+class FakeConnection(object):
+    def __init__(self, key):
+        self.key = key
+        self.alive = True
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class Clock(object):
+    now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def make_pool(**kwargs):
+    opened = []
+
+    def connect(key):
+        opened.append(FakeConnection(key))
+        return opened[-1]
+
+    pool = SessionPool(connect, lambda c: c.alive, **kwargs)
+    return pool, opened
+
+
+def test_sessions_are_reused():
+    pool, opened = make_pool()
+    for _ in range(100):
+        assert pool.get('bee-1').key == 'bee-1'
+        pool.get('bee-2')
+    assert len(opened) == 2
+
+
+def test_dead_sessions_are_replaced():
+    pool, opened = make_pool()
+    first = pool.get('bee-1')
+    first.alive = False
+    second = pool.get('bee-1')
+    assert second is not first
+    assert first.closed
+    assert len(pool) == 1
+
+
+def test_failing_health_check_counts_as_dead():
+    opened = []
+
+    def isAlive(connection):
+        raise EOFError()
+
+    pool = SessionPool(lambda k: opened.append(k) or k, isAlive,
+                       close=lambda c: None)
+    pool.get('bee-1')
+    pool.get('bee-1')
+    assert len(opened) == 2
+
+
+def test_idle_sessions_are_evicted():
+    clock = Clock()
+    pool, opened = make_pool(idleTimeout=60, clock=clock)
+    pool.get('bee-1')
+    clock.now = 30
+    pool.get('bee-2')
+    clock.now = 70
+    pool.evict_idle()
+    assert 'bee-1' not in pool
+    assert 'bee-2' in pool
+    assert opened[0].closed and not opened[1].closed
+
+
+def test_sessions_in_use_are_not_evicted():
+    clock = Clock()
+    pool, opened = make_pool(idleTimeout=60, clock=clock)
+    with pool.using('bee-1') as attacking:
+        pool.checkout('bee-1')
+        clock.now = 1000
+        # another bee's attack starting meanwhile
+        pool.get('bee-2')
+        assert 'bee-1' in pool and not attacking.closed
+    # still checked out once more
+    clock.now = 2000
+    pool.evict_idle()
+    assert 'bee-1' in pool
+    pool.release('bee-1')
+    clock.now = 2030
+    pool.evict_idle()
+    assert 'bee-1' in pool
+    clock.now = 2070
+    pool.evict_idle()
+    assert 'bee-1' not in pool and attacking.closed
+
+
+def test_failed_checkout_is_released():
+    clock = Clock()
+
+    def connect(key):
+        raise EOFError()
+
+    pool = SessionPool(connect, lambda c: True, idleTimeout=60, clock=clock)
+    with pytest.raises(EOFError):
+        pool.checkout('bee-1')
+    pool._sessions['bee-1'] = Session(FakeConnection('bee-1'), clock)
+    clock.now = 70
+    pool.evict_idle()
+    assert 'bee-1' not in pool
+
+
+def test_close_all():
+    pool, opened = make_pool()
+    pool.get('bee-1')
+    pool.get('bee-2')
+    pool.close_all()
+    assert len(pool) == 0
+    assert all(c.closed for c in opened)
+
+
+def test_plumbum_sessions():
+    localhive = pytest.importorskip('beeswithmachineguns.localhive')
+    pytest.importorskip('plumbum')
+
+    class Machine(object):
+        def __init__(self, alive):
+            self._session = type('Session', (), {'alive': lambda s: alive})()
+
+    assert sessions.plumbum_is_alive(localhive.LocalMachine())
+    assert sessions.plumbum_is_alive(Machine(True))
+    assert not sessions.plumbum_is_alive(Machine(False))
+    # a machine that doesn't look like one is no healthy session
+    pool = SessionPool(lambda key: object(), sessions.plumbum_is_alive,
+                       close=lambda c: None)
+    first = pool.get('bee-1')
+    assert pool.get('bee-1') is not first
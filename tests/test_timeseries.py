@@ -0,0 +1,61 @@
+import csv
+import json
+import random
+
+from beeswithmachineguns.timeseries import TimeSeries, write
+
+
+def bee_series(seed, start):
+    rnd = random.Random(seed)
+    series = TimeSeries()
+    for _ in range(500):
+        series.record(start + rnd.uniform(0, 10), rnd.expovariate(0.05),
+                      failed=rnd.random() < 0.1)
+    return series
+
+
+def test_requests_go_into_the_second_they_were_sent_in():
+    series = TimeSeries()
+    series.record(1000.2, 10)
+    series.record(1000.9, 30, failed=True)
+    series.record(1002.0, 20)
+    series.record_failures(1002.5, 3)
+    rows = series.rows()
+    assert [(r['second'], r['elapsed'], r['complete'], r['failed'])
+            for r in rows] == [(1000, 0, 2, 1), (1001, 1, 0, 0),
+                               (1002, 2, 4, 3)]
+    assert rows[0]['mean'] == 20
+    assert rows[1]['p99'] == 0
+
+
+def test_merge_lines_up_seconds_and_is_exact():
+    bees = [bee_series(seed, 1000 + seed) for seed in range(5)]
+    merged = TimeSeries.merged(bees)
+    assert merged.first == 1000 and merged.last == 1013
+    assert sum(r['complete'] for r in merged.rows()) == 2500
+    for second in (1000, 1007, 1013):
+        expected = sum(b.buckets[second].complete for b in bees
+                       if second in b.buckets)
+        assert merged.buckets[second].complete == expected
+    assert TimeSeries.merged(reversed(bees)) == merged
+
+
+def test_roundtrip_through_json():
+    series = bee_series(1, 1000)
+    data = json.loads(json.dumps(series.asDict))
+    assert TimeSeries.from_dict(data) == series
+
+
+def test_write_csv_and_json(tmpdir):
+    series = bee_series(1, 1000)
+    csvPath = str(tmpdir.join('series.csv'))
+    jsonPath = str(tmpdir.join('series.json'))
+    write(series, csvPath)
+    write(series, jsonPath)
+    with open(csvPath) as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ['second', 'elapsed', 'complete', 'failed', 'mean',
+                       'p50', 'p90', 'p99']
+    assert len(rows) == len(series.rows()) + 1
+    with open(jsonPath) as f:
+        assert json.load(f) == json.loads(json.dumps(series.rows()))
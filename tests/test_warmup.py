@@ -0,0 +1,112 @@
+import socket
+import threading
+
+import pytest
+
+from beeswithmachineguns import warmup
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:  # python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def target():
+    """a server with a cache in front of /cached that is warm after the
+    first 5 requests, and /plain that says nothing about caches"""
+    seen = dict(requests=[])
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            seen['requests'].append((self.path, self.headers.get('Cookie')))
+            self.send_response(200)
+            if self.path == '/cached':
+                hits = len([p for p, _ in seen['requests'] if p == self.path])
+                self.send_header('X-Cache', 'HIT' if hits > 5 else 'MISS')
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            self.wfile.write(b'ok')
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    seen['url'] = 'http://127.0.0.1:%i' % server.server_address[1]
+    yield seen
+    server.shutdown()
+    server.server_close()
+
+
+def closed_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def test_is_hit():
+    assert warmup.is_hit({'x-cache': 'Hit from cloudfront'})
+    assert warmup.is_hit({'cf-cache-status': 'MISS'}) is False
+    assert warmup.is_hit({'age': '12'})
+    assert warmup.is_hit({'age': '0'}) is False
+    assert warmup.is_hit({'server': 'nginx'}) is None
+
+
+def test_warms_up_until_the_hit_rate_settles(target):
+    report = warmup.warm_up(
+        [dict(url=target['url'] + '/cached',
+              headers=['Cookie: sessionid=NotARealSessionID'])],
+        concurrency=2, perRound=4, seconds=10)
+    url, = report['urls']
+    assert url['warm'] and url['hitRate'] == 1.0
+    # all misses, three quarters hits, all hits
+    assert url['rounds'] == 3
+    assert report['requests'] == 12 and report['failed'] == 0
+    assert set(cookie for _, cookie in target['requests']) == set([
+        'sessionid=NotARealSessionID'])
+
+
+def test_without_cache_headers_the_latency_settles(target):
+    url, = warmup.warm_up([dict(url=target['url'] + '/plain')],
+                          tolerance=100, perRound=2)['urls']
+    assert url['warm'] and url['hitRate'] is None
+    assert url['rounds'] == warmup.MIN_ROUNDS
+
+
+def test_gives_up_on_urls_without_answer(target):
+    report = warmup.warm_up(
+        [dict(url='http://127.0.0.1:%i/' % closed_port()),
+         dict(url=target['url'] + '/cached')], perRound=3)
+    lost, cached = report['urls']
+    assert not lost['warm'] and lost['error']
+    assert lost['rounds'] == warmup.GIVE_UP_ROUNDS
+    assert cached['warm'] and cached['error'] is None
+
+
+def test_stops_after_the_time():
+    clock = Clock()
+
+    def fetch(request):
+        clock.now += 1.0
+        return {'x-cache': 'HIT' if clock.now % 4 == 0 else 'MISS'}
+
+    report = warmup.warm_up([dict(url='http://x/')], concurrency=1,
+                            perRound=2, seconds=5, fetch=fetch, clock=clock)
+    # the hit rate jumps between 0 and 0.5 for good, the round that began
+    # in time is finished
+    url, = report['urls']
+    assert url['warm'] is False and url['rounds'] == 3
+    assert report['seconds'] == 6.0
@@ -0,0 +1,99 @@
+import threading
+
+from beeswithmachineguns import workqueue
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_hands_out_the_total_exactly():
+    queue = workqueue.WorkQueue(1003, 100)
+    sizes = []
+    while True:
+        requests = queue.take('a')
+        if not requests:
+            break
+        sizes.append(requests)
+        assert queue.complete('a')
+    assert sum(sizes) == 1003
+    assert sizes[-1] == 3
+    assert queue.finished
+    assert queue.batches == {'a': 11}
+
+
+def test_faster_bees_take_more():
+    queue = workqueue.WorkQueue(1000, 10)
+    taken = dict(fast=0, slow=0)
+    queue.take('slow')
+    # the slow bee is busy with her first batch all along
+    while queue.take('fast', wait=False):
+        queue.complete('fast')
+        taken['fast'] += 1
+    queue.complete('slow')
+    assert taken['fast'] == 99
+    assert queue.finished
+
+
+def test_batch_of_a_lost_bee_goes_to_the_next():
+    queue = workqueue.WorkQueue(250, 100)
+    assert queue.take('a') == 100
+    assert queue.take('b') == 100
+    assert queue.fail('a') == 100
+    assert queue.fail('a') == 0
+    assert queue.remaining == 150
+    assert queue.take('c') == 100
+    assert not queue.complete('a')
+    assert queue.complete('b') and queue.complete('c')
+    assert queue.take('b') == 50
+    assert queue.complete('b')
+    assert queue.finished
+    assert queue.reassigned == 100
+
+
+def test_idle_bees_wait_for_batches_that_might_come_back():
+    queue = workqueue.WorkQueue(100, 100)
+    assert queue.take('a') == 100
+    assert queue.take('b', wait=False) == 0
+    taken = []
+    waiting = threading.Thread(target=lambda: taken.append(queue.take('b')))
+    waiting.start()
+    queue.fail('a')
+    waiting.join(5)
+    assert taken == [100]
+    # and they are done once nothing is out any more
+    queue.complete('b')
+    assert queue.take('a') == 0
+
+
+def test_stragglers_are_overdue():
+    clock = Clock()
+    queue = workqueue.WorkQueue(1000, 100, clock=clock)
+    queue.take('a')
+    queue.take('b')
+    clock.now = 1000.0
+    # nothing to compare with yet
+    assert queue.overdue() == []
+    queue.complete('a')
+    queue.take('a')
+    clock.now = 1000.0 + workqueue.STRAGGLER_FACTOR * 1000.0 - 1
+    assert queue.overdue() == ['b']
+
+
+def test_timeout():
+    clock = Clock()
+    queue = workqueue.WorkQueue(1000, 100, timeout=30, clock=clock)
+    queue.take('a')
+    clock.now = 29.0
+    assert queue.overdue() == []
+    clock.now = 31.0
+    assert queue.overdue() == ['a']
+
+
+def test_batch_size():
+    assert workqueue.batch_size(100000, 4, 50) == 3125
+    assert workqueue.batch_size(1000, 4, 50) == 50